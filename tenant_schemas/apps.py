@@ -4,11 +4,16 @@ from django.apps import AppConfig, apps
 from django.conf import settings
 from django.core.checks import Critical, Error, Warning, register
 from django.core.files.storage import default_storage
-from django.db.models.signals import pre_migrate
+from django.db import connection
+from django.db.models.signals import post_delete, post_save, pre_migrate
 from django.core.management import call_command
 
 from .contrib.drf.utils import is_bad_tenant_field_config
+from .fields import get_rls_field
+from .signals import post_schema_sync, post_schema_sync_bulk
 from .storage import TenantStorageMixin
+from .tenant_cache import invalidate_cached_tenant
+from .utils import get_composite_indexes, get_rls_policy_mode, get_tenant_key, get_tenant_partitions
 
 logger = logging.getLogger()
 
@@ -19,11 +24,32 @@ def create_or_replace_pg_get_tenant_function(sender, **kwargs):
     logger.info("OK")
 
 
+def create_tenant_partitions(sender, tenant=None, tenants=None, **kwargs):
+    """
+    Create the partitions of new tenants in the list partitioned tables.
+    """
+    tenants = [tenant] if tenants is None else tenants
+    labels = [label for label, partitioning in get_tenant_partitions().items()
+              if partitioning.get('method', 'hash') == 'list']
+    if not labels or not tenants:
+        return
+    # The partitioned models are registered along with the tenant model.
+    registry = tenants[0]._meta.apps
+    with connection.schema_editor() as editor:
+        for label in labels:
+            editor.create_tenant_partitions(registry.get_model(label), tenants)
+
+
 class TenantSchemaConfig(AppConfig):
     name = 'tenant_schemas'
 
     def ready(self):
         pre_migrate.connect(create_or_replace_pg_get_tenant_function, sender=self)
+        post_save.connect(invalidate_cached_tenant, dispatch_uid='tenant_schemas.invalidate_cached_tenant')
+        post_delete.connect(invalidate_cached_tenant, dispatch_uid='tenant_schemas.invalidate_cached_tenant')
+        post_schema_sync.connect(create_tenant_partitions, dispatch_uid='tenant_schemas.create_tenant_partitions')
+        post_schema_sync_bulk.connect(create_tenant_partitions,
+                                      dispatch_uid='tenant_schemas.create_tenant_partitions')
         self.configure_external_models()
 
     def configure_external_models(self):
@@ -73,6 +99,18 @@ def best_practice(app_configs, **kwargs):
                   hint="Maybe you don't need this app?",
                   id="tenant_schemas.E001"))
 
+    if get_tenant_key() not in ('schema_name', 'pk'):
+        errors.append(
+            Error("TENANT_KEY must be 'schema_name' or 'pk'.",
+                  obj="django.conf.settings",
+                  id="tenant_schemas.E004"))
+    elif get_tenant_key() == 'pk' and get_rls_policy_mode() != 'integer':
+        # The other policies compare tenant_id with the schema name.
+        errors.append(
+            Error("TENANT_RLS_POLICY must be 'integer' when TENANT_KEY is 'pk'.",
+                  obj="django.conf.settings",
+                  id="tenant_schemas.E005"))
+
     if not set(settings.TENANT_APPS).issubset(installed_apps):
         delta = set(settings.TENANT_APPS).difference(installed_apps)
         errors.append(
@@ -115,6 +153,76 @@ def best_practice(app_configs, **kwargs):
     return warnings + errors
 
 
+@register('models')
+def check_tenant_indexes(app_configs, **kwargs):
+    """
+    Every query on a multitenant table is filtered by tenant_id, indexes that
+    don't start with it can't serve those queries on their own.
+    """
+    if app_configs is None:
+        app_configs = apps.get_app_configs()
+
+    warnings = list()
+
+    for app_config in app_configs:
+        for model in app_config.get_models():
+            tenant_field = get_rls_field(model)
+            if tenant_field is None:
+                continue
+            tenant_names = {tenant_field.name, tenant_field.attname}
+            for index, first, rewritten in _get_indexes(model):
+                if first in tenant_names or (rewritten and get_composite_indexes()):
+                    continue
+                if rewritten:
+                    hint = "Put '%s' first or set TENANT_COMPOSITE_INDEXES = True." % tenant_field.name
+                else:
+                    # Expressions are left as they are by TENANT_COMPOSITE_INDEXES.
+                    hint = "Put F('%s') first." % tenant_field.name
+                warnings.append(Warning(
+                    f"{index} of {model._meta.label} doesn't start with the tenant field, "
+                    f"it can't serve the queries filtered by row level security.",
+                    hint=hint,
+                    obj=model,
+                    id='tenant_schemas.W005',
+                ))
+
+    return warnings
+
+
+def _get_indexes(model):
+    """
+    Yield the (description, name of the first field, rewritten by
+    TENANT_COMPOSITE_INDEXES) of the indexes declared by ``model``. Single
+    foreign keys and unique=True fields are left out, their indexes are never
+    rewritten.
+    """
+    for field in model._meta.local_fields:
+        if field.db_index and not field.unique and field.remote_field is None:
+            yield f"Index of field {field.name}", field.name, True
+    for option in ('unique_together', 'index_together'):
+        for fields in getattr(model._meta, option, ()):
+            yield f"{option} {tuple(fields)}", fields[0], True
+    for index in [*model._meta.indexes, *model._meta.constraints]:
+        if getattr(index, 'fields', None):
+            yield f"Index {index.name}", index.fields[0].lstrip('-'), True
+        elif getattr(index, 'expressions', None):
+            yield f"Index {index.name}", _get_expression_name(index.expressions[0]), False
+
+
+def _get_expression_name(expression):
+    """
+    Return the name of the field ``expression`` starts with, looking through
+    the expressions wrapping it, e.g. tenant for F('tenant').desc() or
+    Lower('tenant').
+    """
+    while not hasattr(expression, 'name'):
+        sources = expression.get_source_expressions() if hasattr(expression, 'get_source_expressions') else []
+        if not sources:
+            return None
+        expression = sources[0]
+    return expression.name
+
+
 @register('rest_framework.serializers')
 def check_serializers(app_configs, **kwargs):
     import inspect
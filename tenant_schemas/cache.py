@@ -1,4 +1,10 @@
-from django.db import connection
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from tenant_schemas.context import get_current_schema_name
+from tenant_schemas.utils import get_public_schema_name
 
 
 def make_key(key, key_prefix, version):
@@ -8,7 +14,7 @@ def make_key(key, key_prefix, version):
     Constructs the key used by all other methods. Prepends the tenant
     `schema_name` and `key_prefix'.
     """
-    return '%s:%s:%s:%s' % (connection.schema_name, key_prefix, version, key)
+    return '%s:%s:%s:%s' % (get_current_schema_name(), key_prefix, version, key)
 
 
 def reverse_key(key):
@@ -18,3 +24,128 @@ def reverse_key(key):
     Required for django-redis REVERSE_KEY_FUNCTION setting.
     """
     return key.split(':', 3)[3]
+
+
+class TenantCache(BaseCache):
+    """
+    Cache backend storing the values of each tenant under a namespace of the
+    cache named by ``LOCATION``, so the whole cache of a tenant can be
+    invalidated at once with clear_tenant().
+
+    Keys are prefixed with the schema name of the current tenant and its
+    generation, a number kept in the wrapped cache and bumped by
+    clear_tenant(), which leaves the previous keys to expire. Each process
+    keeps the generations it read for ``GENERATION_TIMEOUT`` seconds (an
+    option, 1 by default), the keys of a cleared tenant may be served by other
+    processes for that long. ``KEY_PREFIX``, ``VERSION`` and ``KEY_FUNCTION``
+    apply to the keys passed to the wrapped cache, which adds its own.
+    """
+    generation_key = 'tenant_schemas:cache_generation:%s'
+
+    def __init__(self, location, params):
+        super(TenantCache, self).__init__(params)
+        self._alias = location
+        self.generation_timeout = params.get('OPTIONS', {}).get('GENERATION_TIMEOUT', 1)
+        # The default timeout of the wrapped cache applies unless one is set.
+        self._has_timeout = 'TIMEOUT' in params or 'timeout' in params
+        # schema_name -> (generation, expires_at)
+        self._generations = {}
+
+    @property
+    def cache(self):
+        return caches[self._alias]
+
+    def get_generation(self, schema_name):
+        now = time.monotonic()
+        try:
+            generation, expires_at = self._generations[schema_name]
+            if expires_at > now:
+                return generation
+        except KeyError:
+            pass
+        key = self.generation_key % schema_name
+        generation = self.cache.get(key)
+        if generation is None:
+            # Never start over from a generation used before the counter
+            # was evicted.
+            self.cache.add(key, self._new_generation(), timeout=None)
+            generation = self.cache.get(key)
+        self._generations[schema_name] = (generation, now + self.generation_timeout)
+        return generation
+
+    def clear_tenant(self, schema_name=None):
+        """
+        Invalidate the cache of the tenant ``schema_name``, of the current
+        tenant by default.
+        """
+        schema_name = schema_name or self._get_schema_name()
+        key = self.generation_key % schema_name
+        try:
+            generation = self.cache.incr(key)
+        except ValueError:
+            generation = self._new_generation()
+            self.cache.set(key, generation, timeout=None)
+        self._generations[schema_name] = (generation, time.monotonic() + self.generation_timeout)
+
+    def tenant_key(self, key, version=None):
+        """
+        Return the key of the wrapped cache for ``key``, made by the
+        ``KEY_FUNCTION`` of this cache with its ``KEY_PREFIX`` and ``version``
+        (``VERSION`` by default) once prefixed with the tenant namespace.
+        """
+        schema_name = self._get_schema_name()
+        return self.make_key('%s:%s:%s' % (schema_name, self.get_generation(schema_name), key), version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.cache.add(self.tenant_key(key, version), value, self._get_timeout(timeout))
+
+    def get(self, key, default=None, version=None):
+        return self.cache.get(self.tenant_key(key, version), default)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.cache.set(self.tenant_key(key, version), value, self._get_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.cache.touch(self.tenant_key(key, version), self._get_timeout(timeout))
+
+    def delete(self, key, version=None):
+        return self.cache.delete(self.tenant_key(key, version))
+
+    def get_many(self, keys, version=None):
+        keys = {self.tenant_key(key, version): key for key in keys}
+        return {keys[key]: value for key, value in self.cache.get_many(keys).items()}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        keys = {self.tenant_key(key, version): key for key in data}
+        failed = self.cache.set_many({key: data[original] for key, original in keys.items()},
+                                     self._get_timeout(timeout))
+        return [keys[key] for key in failed]
+
+    def delete_many(self, keys, version=None):
+        return self.cache.delete_many([self.tenant_key(key, version) for key in keys])
+
+    def has_key(self, key, version=None):
+        return self.cache.has_key(self.tenant_key(key, version))
+
+    def incr(self, key, delta=1, version=None):
+        return self.cache.incr(self.tenant_key(key, version), delta)
+
+    def decr(self, key, delta=1, version=None):
+        return self.cache.decr(self.tenant_key(key, version), delta)
+
+    def clear(self):
+        self._generations.clear()
+        return self.cache.clear()
+
+    def _get_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT and self._has_timeout:
+            return self.default_timeout
+        return timeout
+
+    @staticmethod
+    def _get_schema_name():
+        return get_current_schema_name() or get_public_schema_name()
+
+    @staticmethod
+    def _new_generation():
+        return int(time.time() * 1000)
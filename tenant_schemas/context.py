@@ -0,0 +1,89 @@
+"""
+Tenant of the current execution context.
+
+The tenant selected with ``connection.set_tenant()`` or ``set_schema()`` is
+kept in a ``ContextVar`` per database alias instead of on the connection
+object. Every asyncio task runs in its own copy of the context, so async views
+running concurrently on one event loop can't see each other's tenant, and
+``sync_to_async`` carries the tenant to the thread running the sync code and
+back. Sync code running in a thread behaves as before, the tenant sticks to
+the thread until it is changed.
+
+The backend, ``cache.make_key``, ``log.TenantContextFilter`` and
+``storage.TenantStorageMixin`` all read the tenant from here.
+"""
+import functools
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS
+
+from .utils import get_public_schema_name
+
+_current_tenants = {}
+
+
+class FakeTenant:
+    """
+    We can't import any db model in a backend (apparently?), so this class is used
+    for wrapping schema names in a tenant-like structure.
+
+    Instances are shared, use get_fake_tenant() to get the one of a schema.
+    """
+    __slots__ = ('schema_name', 'model_instance')
+
+    def __init__(self, schema_name):
+        self.schema_name = schema_name
+        # Unsaved tenant model instance of this schema, kept by
+        # tenant_schemas.models.get_tenant().
+        self.model_instance = None
+
+    def __repr__(self):
+        return '<FakeTenant: %s>' % self.schema_name
+
+
+@functools.lru_cache(maxsize=4096)
+def get_fake_tenant(schema_name):
+    """
+    Return the interned FakeTenant of ``schema_name``, so switching tenants
+    doesn't allocate a new one every time.
+    """
+    return FakeTenant(schema_name)
+
+
+def _get_context_var(alias):
+    try:
+        return _current_tenants[alias]
+    except KeyError:
+        return _current_tenants.setdefault(alias, ContextVar('tenant_schemas.tenant.%s' % alias))
+
+
+def get_current_tenant(alias=DEFAULT_DB_ALIAS):
+    """
+    Return the tenant of the current context for the database ``alias``, the
+    public schema when none has been set.
+    """
+    try:
+        return _get_context_var(alias).get()
+    except LookupError:
+        return get_fake_tenant(get_public_schema_name())
+
+
+def get_current_schema_name(alias=DEFAULT_DB_ALIAS):
+    tenant = get_current_tenant(alias)
+    return tenant.schema_name if tenant is not None else None
+
+
+def set_current_tenant(tenant, alias=DEFAULT_DB_ALIAS):
+    """
+    Set the tenant of the current context for the database ``alias``. Return
+    a token for reset_current_tenant().
+    """
+    return _get_context_var(alias).set(tenant)
+
+
+def reset_current_tenant(token, alias=DEFAULT_DB_ALIAS):
+    """
+    Restore the tenant that was current before the set_current_tenant() call
+    that returned ``token``.
+    """
+    _get_context_var(alias).reset(token)
@@ -20,3 +20,14 @@ def generate_rls_fk_field():
         default=get_tenant,
         on_delete=models.PROTECT
     )
+
+
+def get_rls_field(model):
+    """
+    Return the field of ``model`` the row level security policy filters on,
+    None for shared models.
+    """
+    for field in model._meta.local_concrete_fields:
+        if getattr(field, 'rls_required', False):
+            return field
+    return None
@@ -1,6 +1,6 @@
 import logging
 
-from django.db import connection
+from tenant_schemas.context import get_current_tenant
 
 
 class TenantContextFilter(logging.Filter):
@@ -10,6 +10,7 @@ class TenantContextFilter(logging.Filter):
     Thanks to @regolith for the snippet on #248
     """
     def filter(self, record):
-        record.schema_name = connection.tenant.schema_name
-        record.domain_url = getattr(connection.tenant, 'domain_url', '')
+        tenant = get_current_tenant()
+        record.schema_name = tenant.schema_name
+        record.domain_url = getattr(tenant, 'domain_url', '')
         return True
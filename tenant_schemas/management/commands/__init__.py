@@ -1,11 +1,44 @@
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import django
 from django.conf import settings
 from django.core.management import call_command, get_commands, load_command_class
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
+from django.db import connection, connections
 
+from tenant_schemas.migration_executors import get_executor
 from tenant_schemas.utils import get_tenant_model, get_public_schema_name
 
+# Command run by the worker processes of BaseTenantCommand --workers, with its
+# arguments. Set before the workers are forked, so they inherit it.
+_worker_command = None
+
+
+def _run_tenant_command(tenant_pk):
+    """
+    Run the command of ``_worker_command`` on a tenant, in a worker process.
+    Return ``(schema_name, duration, error)``.
+    """
+    command, args, options = _worker_command
+    started = time.monotonic()
+    schema_name = tenant_pk
+    try:
+        connection.set_schema_to_public()
+        tenant = get_tenant_model().objects.get(pk=tenant_pk)
+        schema_name = tenant.schema_name
+        command.execute_command(tenant, command.COMMAND_NAME, *args, **options)
+    except BaseException:
+        # SystemExit included, e.g. raised by the command on errors, it
+        # would kill the worker.
+        return schema_name, time.monotonic() - started, traceback.format_exc()
+    return schema_name, time.monotonic() - started, None
+
 
 # TODO: remove all schema reference
 class BaseTenantCommand(BaseCommand):
@@ -15,6 +48,9 @@ class BaseTenantCommand(BaseCommand):
     class variable COMMAND_NAME of the subclass.
     """
 
+    # Number of tenants fetched at once when iterating over them.
+    tenants_chunk_size = 2000
+
     def __new__(cls, *args, **kwargs):
         """
         Sets option_list and help dynamically.
@@ -45,6 +81,15 @@ class BaseTenantCommand(BaseCommand):
         parser.add_argument("-s", "--schema", dest="schema_name")
         parser.add_argument("-p", "--skip-public", dest="skip_public",
                             action="store_true", default=False)
+        parser.add_argument("--workers", dest="workers", type=int, default=1,
+                            help="Number of processes running the command on "
+                                 "the tenants in parallel.")
+        parser.add_argument("--checkpoint", dest="checkpoint",
+                            help="File recording the last tenant the command "
+                                 "completed on, removed once all tenants are done.")
+        parser.add_argument("--resume", dest="resume", action="store_true", default=False,
+                            help="Skip the tenants completed according to the "
+                                 "--checkpoint file of a previous run.")
         # use the privately held reference to the underlying command to invoke
         # the add_arguments path on this parser instance
         self._original_command.add_arguments(parser)
@@ -63,50 +108,191 @@ class BaseTenantCommand(BaseCommand):
         # call the original command with the args it knows
         call_command(command_name, *args, **options)
 
+    def get_command_options(self, options):
+        """
+        Returns the options understood by the original command, leaving out
+        the ones added by this command.
+        """
+        parser = self._original_command.create_parser('', self.COMMAND_NAME)
+        valid_options = {action.dest for action in parser._actions}
+        valid_options.update(self._original_command.base_stealth_options, self._original_command.stealth_options)
+        return {key: value for key, value in options.items() if key in valid_options}
+
+    def get_tenants(self, options):
+        """
+        Returns the tenants to run the command on, ordered by pk and starting
+        after the checkpoint when resuming.
+        """
+        tenants = get_tenant_model().objects.order_by('pk')
+        if options['skip_public']:
+            tenants = tenants.exclude(schema_name=get_public_schema_name())
+        if options['resume']:
+            checkpoint = self.read_checkpoint(options['checkpoint'])
+            if checkpoint is not None:
+                tenants = tenants.filter(pk__gt=checkpoint)
+        return tenants
+
+    def iter_tenants(self, tenants):
+        """
+        Yields ``tenants``, ordered by pk, fetching ``tenants_chunk_size`` of
+        them at a time after the pk of the last one instead of loading all of
+        them at once. A server-side cursor would be kept open on the
+        connection the command runs on, and can't be used in autocommit mode
+        with TENANT_SET_MODE = 'transaction'.
+        """
+        last_pk = None
+        while True:
+            chunk = tenants if last_pk is None else tenants.filter(pk__gt=last_pk)
+            chunk = list(chunk[:self.tenants_chunk_size])
+            yield from chunk
+            if len(chunk) < self.tenants_chunk_size:
+                return
+            last_pk = chunk[-1].pk
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        if checkpoint.get('command') != self.COMMAND_NAME:
+            raise CommandError("Checkpoint '%s' was written by %s, not %s." % (
+                path, checkpoint.get('command'), self.COMMAND_NAME))
+        return checkpoint['pk']
+
+    def write_checkpoint(self, path, pk):
+        if not path:
+            return
+        # Replace the file at once, so a crash never leaves it half written.
+        with open(path + '.tmp', 'w') as checkpoint_file:
+            json.dump({'command': self.COMMAND_NAME, 'pk': pk if isinstance(pk, int) else str(pk)}, checkpoint_file)
+        os.replace(path + '.tmp', path)
+
     def handle(self, *args, **options):
         """
         Iterates a command over all registered schemata.
         """
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume requires --checkpoint.")
+
+        command_options = self.get_command_options(options)
         if options['schema_name']:
             # only run on a particular schema
             connection.set_schema_to_public()
             self.execute_command(get_tenant_model().objects.get(schema_name=options['schema_name']), self.COMMAND_NAME,
-                                 *args, **options)
+                                 *args, **command_options)
+            return
+
+        tenants = self.get_tenants(options)
+        if options['workers'] > 1:
+            self.execute_command_in_workers(list(tenants.values_list('pk', flat=True)), options['workers'],
+                                            options['checkpoint'], *args, **command_options)
         else:
-            for tenant in get_tenant_model().objects.all():
-                if not (options['skip_public'] and tenant.schema_name == get_public_schema_name()):
-                    self.execute_command(tenant, self.COMMAND_NAME, *args, **options)
+            for tenant in self.iter_tenants(tenants):
+                self.execute_command(tenant, self.COMMAND_NAME, *args, **command_options)
+                self.write_checkpoint(options['checkpoint'], tenant.pk)
+        if options['checkpoint'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+    def execute_command_in_workers(self, tenant_pks, workers, checkpoint, *args, **options):
+        """
+        Runs the command on the tenants with a pool of ``workers`` forked
+        processes, each with its own database connection, then reports the
+        results. Failures don't stop the other tenants, CommandError is raised
+        once all of them are done. The checkpoint only moves past tenants
+        when the command completed on all the tenants before them.
+        """
+        global _worker_command
+
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise CommandError("--workers requires a platform supporting fork().")
+
+        # The workers must not share the sockets of the parent's connections.
+        connections.close_all()
+        _worker_command = (self, args, options)
+        started = time.monotonic()
+        results = []
+        failed = False
+        try:
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                futures = [pool.submit(_run_tenant_command, tenant_pk) for tenant_pk in tenant_pks]
+                try:
+                    for tenant_pk, future in zip(tenant_pks, futures):
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            # A worker was killed, or exited, taking the pool
+                            # down: its tenant and the ones left fail.
+                            result = (tenant_pk, 0, 'The worker process running the command died.')
+                        results.append(result)
+                        failed = failed or result[2] is not None
+                        if not failed:
+                            self.write_checkpoint(checkpoint, tenant_pk)
+                except BaseException:
+                    # Don't wait for the tenants left when interrupted.
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            _worker_command = None
+
+        self.print_summary(results, time.monotonic() - started, workers, int(options.get('verbosity', 1)))
+
+    def print_summary(self, results, duration, workers, verbosity):
+        failed = [(schema_name, error) for schema_name, _, error in results if error]
+
+        if verbosity >= 1:
+            self.stdout.write(
+                "Ran %s on %d tenants in %.2fs with %d workers, %d failed."
+                % (self.COMMAND_NAME, len(results), duration, workers, len(failed))
+            )
+        if verbosity >= 2:
+            for schema_name, tenant_duration, error in sorted(results, key=lambda result: -result[1]):
+                self.stdout.write("  %s: %.2fs%s" % (schema_name, tenant_duration, ' (failed)' if error else ''))
+        for schema_name, error in failed:
+            self.stderr.write("=== %s failed on schema '%s':\n%s" % (self.COMMAND_NAME, schema_name, error))
+
+        if failed:
+            raise CommandError("%s failed on %d tenants: %s" % (
+                self.COMMAND_NAME, len(failed), ', '.join(str(schema_name) for schema_name, _ in failed)))
 
 
 class InteractiveTenantOption(object):
+    no_tenants_message = """There are no tenants in the system.
+To learn how create a tenant, see:
+https://django-tenant-schemas.readthedocs.io/en/latest/use.html#creating-a-tenant"""
 
     def add_arguments(self, parser):
         parser.add_argument("-s", "--schema", dest="schema_name", help="specify tenant schema")
 
     def get_tenant_from_options_or_interactive(self, **options):
         TenantModel = get_tenant_model()
-        all_tenants = TenantModel.objects.all()
-
-        if not all_tenants:
-            raise CommandError("""There are no tenants in the system.
-To learn how create a tenant, see:
-https://django-tenant-schemas.readthedocs.io/en/latest/use.html#creating-a-tenant""")
 
         if options.get('schema_name'):
             tenant_schema = options['schema_name']
         else:
+            if not TenantModel.objects.exists():
+                raise CommandError(self.no_tenants_message)
             while True:
                 tenant_schema = input("Enter Tenant Schema ('?' to list schemas): ")
                 if tenant_schema == '?':
-                    print('\n'.join(["%s - %s" % (t.schema_name, t.domain_url,) for t in all_tenants]))
+                    tenants = TenantModel.objects.order_by('pk').values_list('schema_name', 'domain_url')
+                    for schema_name, domain_url in tenants.iterator():
+                        print("%s - %s" % (schema_name, domain_url))
                 else:
                     break
 
-        if tenant_schema not in [t.schema_name for t in all_tenants]:
+        # A single lookup on the unique schema_name index, the tenants table
+        # is only checked for emptiness to report the right error.
+        try:
+            return TenantModel.objects.get(schema_name=tenant_schema)
+        except TenantModel.DoesNotExist:
+            if not TenantModel.objects.exists():
+                raise CommandError(self.no_tenants_message)
             raise CommandError("Invalid tenant schema, '%s'" % (tenant_schema,))
 
-        return TenantModel.objects.get(schema_name=tenant_schema)
-
 
 class TenantWrappedCommand(InteractiveTenantOption, BaseCommand):
     """
@@ -153,7 +339,7 @@ class SyncCommon(BaseCommand):
         self.sync_tenant = options.get('tenant')
         self.sync_public = options.get('shared')
         self.schema_name = options.get('schema_name')
-        self.executor = options.get('executor')
+        self.executor = get_executor(options.get('executor'))(args, options, stdout=self.stdout, style=self.style)
         self.installed_apps = settings.INSTALLED_APPS
         self.args = args
         self.options = options
@@ -0,0 +1,250 @@
+import re
+import time
+
+from django.apps import apps
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from tenant_schemas.fields import get_rls_field
+from tenant_schemas.utils import get_tenant_model
+
+
+class Command(BaseCommand):
+
+    help = ('Converts the tenant_id column of multitenant tables from the schema_name of the tenant to its '
+            'primary key (TENANT_KEY = "pk"). The new column is backfilled in batches while the table stays '
+            'in use, then swapped with the old one in a short transaction.')
+
+    sql_column_type = """
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = %s AND column_name = 'tenant_id' AND table_schema = current_schema()
+    """
+    sql_partitioning = """
+        SELECT relkind = 'p' OR relispartition FROM pg_class WHERE oid = %s::regclass
+    """
+    sql_tenant_indexes = """
+        SELECT i.relname, pg_get_indexdef(x.indexrelid), c.conname, c.contype
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+        LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid
+        WHERE x.indrelid = %s::regclass AND a.attname = 'tenant_id' AND NOT x.indisprimary
+        ORDER BY i.relname
+    """
+    sql_tenant_foreign_key = """
+        SELECT c.conname FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = %s::regclass AND c.contype = 'f' AND a.attname = 'tenant_id'
+    """
+    sql_sync_function = (
+        "CREATE OR REPLACE FUNCTION tenant_schemas_sync_tenant_key() RETURNS trigger AS $$ "
+        "BEGIN NEW.tenant_key := (SELECT %(pk)s FROM %(tenant_table)s WHERE schema_name = NEW.tenant_id); "
+        "RETURN NEW; END $$ LANGUAGE plpgsql"
+    )
+    sql_create_trigger = (
+        "CREATE TRIGGER _tr_tenant_key BEFORE INSERT OR UPDATE OF tenant_id ON %(table)s "
+        "FOR EACH ROW EXECUTE PROCEDURE tenant_schemas_sync_tenant_key()"
+    )
+    sql_backfill = (
+        "UPDATE %(table)s t SET tenant_key = c.%(pk)s FROM %(tenant_table)s c "
+        "WHERE c.schema_name = t.tenant_id AND t.tenant_key IS NULL AND t.%(table_pk)s <= %%s"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*',
+                            help='Tables to convert, defaults to the tables of all multitenant models.')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=10000,
+                            help='Rows updated per transaction while backfilling.')
+        parser.add_argument('--sleep', dest='sleep', type=float, default=0,
+                            help='Seconds to wait between batches, to limit the load on the database.')
+        parser.add_argument('--backfill-only', dest='backfill_only', action='store_true', default=False,
+                            help="Backfill and index the new column but don't swap it with tenant_id yet, "
+                                 "run the command again to finish the conversion.")
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+        TenantModel = get_tenant_model()
+        self.tenant_table = TenantModel._meta.db_table
+        self.tenant_pk = TenantModel._meta.pk
+        # Every row has to be converted, not only the rows of one tenant.
+        # This fails instead of skipping rows when the role can't bypass RLS.
+        connection.set_schema_to_public()
+        with connection.cursor() as cursor:
+            cursor.execute('SET row_security = off')
+        try:
+            for table in options['tables'] or self.get_tables():
+                self.convert_table(table, options)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET row_security')
+
+    @staticmethod
+    def get_tables():
+        return sorted({
+            model._meta.db_table for model in apps.get_models(include_auto_created=True)
+            if get_rls_field(model) is not None
+        })
+
+    def convert_table(self, table, options):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql_column_type, [table])
+            row = cursor.fetchone()
+        if row is None or row[0] not in ('character varying', 'text'):
+            if self.verbosity >= 1:
+                self.stdout.write('%s: already converted, skipped.' % table)
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql_partitioning, [connection.ops.quote_name(table)])
+            if cursor.fetchone()[0]:
+                # tenant_id is part of the partition key and of the primary
+                # key, and indexes can't be built concurrently on partitioned
+                # tables.
+                raise CommandError("%s: partitioned tables can't be converted, convert the table before "
+                                   "partitioning it." % table)
+
+        self.prepare(table)
+        self.backfill(table, options['batch_size'], options['sleep'])
+        indexes = self.create_indexes(table)
+        if options['backfill_only']:
+            if self.verbosity >= 1:
+                self.stdout.write('%s: tenant_key backfilled.' % table)
+            return
+        self.swap(table, indexes)
+        if self.verbosity >= 1:
+            self.stdout.write(self.style.SUCCESS('%s: converted.' % table))
+
+    def prepare(self, table):
+        """
+        Add the tenant_key column and a trigger filling it for the rows
+        written during the conversion.
+        """
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE %s ADD COLUMN IF NOT EXISTS tenant_key %s' % (
+                quote_name(table), self.tenant_pk.rel_db_type(connection)))
+            cursor.execute(self.sql_sync_function % {
+                'pk': quote_name(self.tenant_pk.column),
+                'tenant_table': quote_name(self.tenant_table),
+            })
+            cursor.execute('DROP TRIGGER IF EXISTS _tr_tenant_key ON %s' % quote_name(table))
+            cursor.execute(self.sql_create_trigger % {'table': quote_name(table)})
+
+    def backfill(self, table, batch_size, sleep):
+        """
+        Fill tenant_key for the existing rows, walking the primary key in
+        batches of ``batch_size`` rows, each one in its own transaction.
+        """
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            table_pk = quote_name(connection.introspection.get_primary_key_column(cursor, table))
+        sql_upper_bound = 'SELECT max(pk) FROM (SELECT %(pk)s AS pk FROM %(table)s %(where)s ORDER BY %(pk)s LIMIT %%s) s'
+        sql_backfill = self.sql_backfill % {
+            'table': quote_name(table),
+            'pk': quote_name(self.tenant_pk.column),
+            'tenant_table': quote_name(self.tenant_table),
+            'table_pk': table_pk,
+        }
+
+        lower, updated = None, 0
+        while True:
+            with connection.cursor() as cursor:
+                if lower is None:
+                    cursor.execute(sql_upper_bound % {'pk': table_pk, 'table': quote_name(table), 'where': ''},
+                                   [batch_size])
+                else:
+                    cursor.execute(sql_upper_bound % {'pk': table_pk, 'table': quote_name(table),
+                                                      'where': 'WHERE %s > %%s' % table_pk},
+                                   [lower, batch_size])
+                upper = cursor.fetchone()[0]
+                if upper is None:
+                    break
+                with transaction.atomic():
+                    cursor.execute(sql_backfill + ('' if lower is None else ' AND t.%s > %%s' % table_pk),
+                                   [upper] if lower is None else [upper, lower])
+                    updated += cursor.rowcount
+            lower = upper
+            if self.verbosity >= 2:
+                self.stdout.write('%s: %d rows backfilled.' % (table, updated))
+            if sleep:
+                time.sleep(sleep)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT tenant_id FROM %s WHERE tenant_key IS NULL LIMIT 10' % quote_name(table))
+            unknown = [row[0] for row in cursor.fetchall()]
+        if unknown:
+            raise CommandError('%s: rows reference unknown tenants: %s' % (table, ', '.join(map(str, unknown))))
+
+        # NOT NULL without scanning the table under an exclusive lock when
+        # the column is swapped.
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE %(table)s DROP CONSTRAINT IF EXISTS tenant_key_not_null; '
+                           'ALTER TABLE %(table)s ADD CONSTRAINT tenant_key_not_null '
+                           'CHECK (tenant_key IS NOT NULL) NOT VALID' % {'table': quote_name(table)})
+            cursor.execute('ALTER TABLE %s VALIDATE CONSTRAINT tenant_key_not_null' % quote_name(table))
+
+    def create_indexes(self, table):
+        """
+        Build a copy on tenant_key of every index on tenant_id, concurrently
+        unless running in a transaction. Return the (index, copy, constraint,
+        constraint type) of each index.
+        """
+        concurrently = '' if connection.in_atomic_block else 'CONCURRENTLY '
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql_tenant_indexes, [connection.ops.quote_name(table)])
+            rows = cursor.fetchall()
+
+        indexes = []
+        for name, definition, constraint, constraint_type in rows:
+            if '_pattern_ops' in definition:
+                # LIKE support of the varchar column.
+                continue
+            copy = '%s_tk' % name[:60]
+            head, using, columns = definition.partition(' USING ')
+            unique, _, on = re.match(r'CREATE (UNIQUE )?INDEX (\S+) (ON .*)', head).groups()
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE %sINDEX %sIF NOT EXISTS %s %s USING %s' % (
+                    unique or '', concurrently, connection.ops.quote_name(copy), on,
+                    re.sub(r'\btenant_id\b', 'tenant_key', columns),
+                ))
+            indexes.append((name, copy, constraint, constraint_type))
+        return indexes
+
+    def swap(self, table, indexes):
+        """
+        Replace tenant_id with tenant_key, along with its indexes, foreign
+        key, default and policy, in one short transaction.
+        """
+        quote_name = connection.ops.quote_name
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql_tenant_foreign_key, [quote_name(table)])
+            row = cursor.fetchone()
+        foreign_key = row[0] if row else '%s_tenant_id_fk' % table[:50]
+
+        statements = [
+            'LOCK TABLE %(table)s IN ACCESS EXCLUSIVE MODE',
+            'DROP TRIGGER _tr_tenant_key ON %(table)s',
+            editor.sql_drop_policy % {'table': table},
+            'ALTER TABLE %(table)s DROP COLUMN tenant_id',
+            'ALTER TABLE %(table)s RENAME COLUMN tenant_key TO tenant_id',
+            'ALTER TABLE %(table)s ALTER COLUMN tenant_id SET NOT NULL',
+            'ALTER TABLE %(table)s DROP CONSTRAINT tenant_key_not_null',
+        ]
+        for name, copy, constraint, constraint_type in indexes:
+            statements.append('ALTER INDEX %s RENAME TO %s' % (quote_name(copy), quote_name(name)))
+            if constraint_type == 'u':
+                statements.append('ALTER TABLE %%(table)s ADD CONSTRAINT %s UNIQUE USING INDEX %s' % (
+                    quote_name(constraint), quote_name(name)))
+        statements += [
+            'ALTER TABLE %%(table)s ADD CONSTRAINT %s FOREIGN KEY (tenant_id) REFERENCES %s (%s) '
+            'DEFERRABLE INITIALLY DEFERRED NOT VALID' % (
+                quote_name(foreign_key), quote_name(self.tenant_table), quote_name(self.tenant_pk.column)),
+            editor.sql_alter_column_defaul_tenant % {'table': '%(table)s', 'default': editor.tenant_defaults['pk']},
+            editor.sql_create_policy % {'table': table, 'policy': editor.get_rls_policy('integer')},
+        ]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('; '.join(statements) % {'table': quote_name(table)})
+
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' % (quote_name(table), quote_name(foreign_key)))
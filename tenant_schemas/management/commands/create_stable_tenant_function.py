@@ -1,14 +1,28 @@
-
 from django.core.management import BaseCommand
 from django.db import connection
 
+from tenant_schemas.utils import get_tenant_model
+
 
 class Command(BaseCommand):
 
-    help = 'Command creates stable function with a very high cost which returns tenant from the current settings.'
+    help = ('Command creates stable function with a very high cost which returns tenant from the current settings, '
+            'and the function returning the primary key of that tenant used by the integer policy mode.')
 
     def handle(self, *args, **options):
+        TenantModel = get_tenant_model()
+        pk = TenantModel._meta.pk
         with connection.cursor() as cursor:
             cursor.execute('CREATE OR REPLACE FUNCTION get_current_tenant() RETURNS VARCHAR AS $$ '
                            'SELECT current_setting(\'txerpa.tenant\') '
                            '$$ LANGUAGE SQL STABLE COST 100000;')
+            # The tenant table doesn't exist yet when this runs before the first migration.
+            cursor.execute('SET check_function_bodies = false')
+            cursor.execute('CREATE OR REPLACE FUNCTION get_current_tenant_id() RETURNS %s AS $$ '
+                           'SELECT %s FROM %s WHERE schema_name = current_setting(\'txerpa.tenant\', true) '
+                           '$$ LANGUAGE SQL STABLE;' % (
+                               pk.rel_db_type(connection),
+                               connection.ops.quote_name(pk.column),
+                               connection.ops.quote_name(TenantModel._meta.db_table),
+                           ))
+            cursor.execute('RESET check_function_bodies')
@@ -0,0 +1,22 @@
+from tenant_schemas.management.commands import SyncCommon
+
+
+class Command(SyncCommon):
+    help = ("Updates the database schema. All tenants share the tables of the "
+            "tenant apps (isolated by row level security), so the migrations "
+            "are applied once, with the executor given by --executor.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--database', action='store', dest='database', default='default',
+                            help='Nominates a database to synchronize. Defaults to the "default" database.')
+        parser.add_argument('--fake', action='store_true', dest='fake', default=False,
+                            help='Mark migrations as run without actually running them.')
+        parser.add_argument('--fake-initial', action='store_true', dest='fake_initial', default=False,
+                            help='Detect if tables already exist and fake-apply initial migrations if so.')
+        parser.add_argument('--plan', action='store_true', dest='plan', default=False,
+                            help='Shows a list of the migration actions that will be performed.')
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        self.executor.run_migrations(self.options.get('app_label'), self.options.get('migration_name'))
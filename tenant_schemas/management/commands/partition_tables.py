@@ -0,0 +1,230 @@
+import re
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.utils import truncate_name
+
+from tenant_schemas.utils import get_tenant_model, get_tenant_partitions
+
+
+class Command(BaseCommand):
+
+    help = ('Moves the rows of the tables of the models in TENANT_PARTITIONS into tables partitioned by tenant_id, '
+            'and creates the missing tenant partitions of list partitioned tables.')
+    verbosity = 1
+
+    sql_relkind = "SELECT relkind FROM pg_class WHERE oid = %s::regclass"
+    sql_referencing_constraints = """
+        SELECT conname, conrelid::regclass::text FROM pg_constraint
+        WHERE confrelid = %s::regclass AND contype = 'f'
+    """
+    sql_constraints = """
+        SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f')
+        ORDER BY conname
+    """
+    sql_indexes = """
+        SELECT i.relname, pg_get_indexdef(x.indexrelid), x.indisunique
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass AND NOT x.indisprimary
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+    """
+    sql_drop_copy = "DROP TABLE IF EXISTS %(new_table)s, %(log)s; DROP FUNCTION IF EXISTS %(function)s() CASCADE"
+    sql_create_partitioned = (
+        "CREATE TABLE %(new_table)s (LIKE %(table)s INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY, "
+        "PRIMARY KEY (%(pk)s, tenant_id))%(partition_by)s"
+    )
+    # Primary keys of the rows written while the table is copied.
+    sql_create_log = """
+        CREATE TABLE %(log)s AS SELECT %(pk)s AS pk FROM %(table)s WITH NO DATA;
+        CREATE FUNCTION %(function)s() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN INSERT INTO %(log)s VALUES (OLD.%(pk)s); END IF;
+            IF TG_OP <> 'DELETE' THEN INSERT INTO %(log)s VALUES (NEW.%(pk)s); END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        CREATE TRIGGER %(function)s AFTER INSERT OR UPDATE OR DELETE ON %(table)s
+        FOR EACH ROW EXECUTE PROCEDURE %(function)s()
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help='Models (app_label.ModelName) to partition, defaults to all in TENANT_PARTITIONS.')
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=10000,
+                            help='Rows copied per transaction.')
+
+    def handle(self, *args, **options):
+        self.verbosity = int(options['verbosity'])
+        connection.set_schema_to_public()
+        # The rows of every tenant are moved.
+        with connection.cursor() as cursor:
+            cursor.execute('SET row_security = off')
+        try:
+            for label in options['models'] or sorted(get_tenant_partitions()):
+                try:
+                    model = apps.get_model(label)
+                except (LookupError, ValueError) as e:
+                    raise CommandError(e)
+                self.partition_model(model, options['batch_size'])
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET row_security')
+
+    def partition_model(self, model, batch_size=10000):
+        table = model._meta.db_table
+        with connection.schema_editor() as editor:
+            try:
+                partitioning = editor.get_partitioning(model)
+            except ImproperlyConfigured as e:
+                raise CommandError(e)
+            if partitioning is None:
+                raise CommandError('%s is not in TENANT_PARTITIONS.' % model._meta.label)
+            method, partitions = partitioning
+
+            with connection.cursor() as cursor:
+                cursor.execute(self.sql_relkind, [editor.quote_name(table)])
+                partitioned = cursor.fetchone()[0] == 'p'
+        if not partitioned:
+            self.move_into_partitions(model, method, partitions, batch_size)
+        elif self.verbosity >= 1:
+            self.stdout.write('%s: already partitioned.' % table)
+
+        if method == 'list':
+            with connection.schema_editor() as editor:
+                self.create_tenant_partitions(editor, model)
+
+    def move_into_partitions(self, model, method, partitions, batch_size):
+        """
+        Copy the table of ``model`` into a new partitioned table, which then
+        replaces it. The rows are copied in batches, each one in its own
+        transaction, while a trigger logs the primary keys of the rows written
+        meanwhile. The table is only locked at the end, to copy those rows
+        again and swap the tables.
+        """
+        quote_name = connection.ops.quote_name
+        max_length = connection.ops.max_name_length()
+        table = model._meta.db_table
+        new_table = truncate_name('%s_partitioned' % table, max_length)
+        names = {
+            'table': quote_name(table),
+            'new_table': quote_name(new_table),
+            'log': quote_name(truncate_name('%s_changes' % table, max_length)),
+            'function': quote_name(truncate_name('%s_log_changes' % table, max_length)),
+            'pk': quote_name(model._meta.pk.column),
+        }
+
+        with connection.schema_editor() as editor:
+            with connection.cursor() as cursor:
+                cursor.execute(self.sql_referencing_constraints, [quote_name(table)])
+                references = ['%s (%s)' % (name, referencing) for name, referencing in cursor.fetchall()]
+            if references:
+                raise CommandError("%s is referenced by foreign keys, partitioned tables can't be: %s." % (
+                    table, ', '.join(references)))
+            # Left over by an interrupted run.
+            editor.execute(self.sql_drop_copy % names)
+            editor.execute(self.sql_create_partitioned % dict(
+                names, partition_by=editor.sql_partition_by % {'method': method.upper()}))
+            editor.create_partitions(model, method, partitions, table=new_table)
+            editor.execute(self.sql_create_log % names, None)
+
+        copied = self.copy_rows(table, new_table, model._meta.pk.column, batch_size)
+
+        with connection.schema_editor() as editor:
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % quote_name(table))
+                # Rows written during the copy, copied again as they are now.
+                cursor.execute('DELETE FROM %(new_table)s WHERE %(pk)s IN (SELECT pk FROM %(log)s)' % names)
+                cursor.execute('INSERT INTO %(new_table)s OVERRIDING SYSTEM VALUE SELECT * FROM %(table)s '
+                               'WHERE %(pk)s IN (SELECT pk FROM %(log)s)' % names)
+                if self.verbosity >= 2:
+                    self.stdout.write('%s: %d rows written during the copy copied again.' % (table, cursor.rowcount))
+                cursor.execute(self.sql_constraints, [quote_name(table)])
+                constraints = cursor.fetchall()
+                cursor.execute(self.sql_indexes, [quote_name(table)])
+                indexes = cursor.fetchall()
+                self.move_sequence(cursor, table, new_table, model._meta.pk.column)
+
+            statements = [
+                'DROP TABLE %(table)s, %(log)s' % names,
+                'DROP FUNCTION %(function)s()' % names,
+                'ALTER TABLE %s RENAME TO %s' % (quote_name(new_table), quote_name(table)),
+            ]
+            for name, constraint_type, definition in constraints:
+                if constraint_type == 'u' and not self.has_tenant_column(definition):
+                    self.skip(table, name)
+                    continue
+                statements.append('ALTER TABLE %s ADD CONSTRAINT %s %s' % (
+                    quote_name(table), quote_name(name), definition))
+            for name, definition, unique in indexes:
+                if unique and not self.has_tenant_column(definition):
+                    self.skip(table, name)
+                    continue
+                statements.append(definition)
+            editor.execute('; '.join(statements + editor.get_rls_statements(table)), None)
+
+        if self.verbosity >= 1:
+            self.stdout.write(self.style.SUCCESS('%s: %d rows moved into %s partitions.' % (table, copied, method)))
+
+    @staticmethod
+    def move_sequence(cursor, table, new_table, pk):
+        quote_name = connection.ops.quote_name
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s), pg_get_serial_sequence(%s, %s)',
+                       [quote_name(table), pk, quote_name(new_table), pk])
+        sequence, new_sequence = cursor.fetchone()
+        if new_sequence:
+            # Identity column, it got a sequence of its own.
+            cursor.execute('SELECT setval(%%s, max(%s)) FROM %s HAVING max(%s) IS NOT NULL' % (
+                quote_name(pk), quote_name(new_table), quote_name(pk)), [new_sequence])
+        elif sequence:
+            # Serial column, keep its sequence when the table is dropped.
+            cursor.execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (sequence, quote_name(new_table), quote_name(pk)))
+
+    def copy_rows(self, table, new_table, pk, batch_size):
+        """
+        Copy the rows of ``table`` into ``new_table``, walking the primary key
+        in batches of ``batch_size`` rows, each one in its own transaction.
+        """
+        quote_name = connection.ops.quote_name
+        sql_upper_bound = 'SELECT max(pk) FROM (SELECT %(pk)s AS pk FROM %(table)s %(where)s ORDER BY %(pk)s LIMIT %%s) s'
+        sql_copy = 'INSERT INTO %s OVERRIDING SYSTEM VALUE SELECT * FROM %s WHERE %s <= %%s' % (
+            quote_name(new_table), quote_name(table), quote_name(pk))
+
+        lower, copied = None, 0
+        while True:
+            with connection.cursor() as cursor:
+                if lower is None:
+                    cursor.execute(sql_upper_bound % {'pk': quote_name(pk), 'table': quote_name(table), 'where': ''},
+                                   [batch_size])
+                else:
+                    cursor.execute(sql_upper_bound % {'pk': quote_name(pk), 'table': quote_name(table),
+                                                      'where': 'WHERE %s > %%s' % quote_name(pk)},
+                                   [lower, batch_size])
+                upper = cursor.fetchone()[0]
+                if upper is None:
+                    break
+                with transaction.atomic():
+                    if lower is None:
+                        cursor.execute(sql_copy, [upper])
+                    else:
+                        cursor.execute(sql_copy + ' AND %s > %%s' % quote_name(pk), [upper, lower])
+                    copied += cursor.rowcount
+            lower = upper
+            if self.verbosity >= 2:
+                self.stdout.write('%s: %d rows copied.' % (table, copied))
+        return copied
+
+    def create_tenant_partitions(self, editor, model):
+        tenants = get_tenant_model().objects.order_by('pk').only('pk', 'schema_name')
+        created = editor.create_tenant_partitions(model, tenants)
+        if self.verbosity >= 1:
+            self.stdout.write('%s: %d tenant partitions created.' % (model._meta.db_table, len(created)))
+
+    @staticmethod
+    def has_tenant_column(definition):
+        return re.search(r'\btenant_id\b', definition) is not None
+
+    def skip(self, table, name):
+        self.stderr.write("%s: %s dropped, unique constraints of partitioned tables must include tenant_id." % (
+            table, name))
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from tenant_schemas.management.commands import InteractiveTenantOption
+from tenant_schemas.purge import purge_tenant
+from tenant_schemas.utils import get_public_schema_name
+
+
+class Command(InteractiveTenantOption, BaseCommand):
+
+    help = ('Deletes a tenant along with all its rows, table by table in batches, '
+            'instead of loading them in memory as delete() does.')
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=1000,
+                            help='Rows deleted per transaction.')
+        parser.add_argument('--sleep', dest='sleep', type=float, default=0,
+                            help='Seconds to wait between batches, to limit the load on the database.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Do NOT prompt the user for confirmation.')
+
+    def handle(self, *args, **options):
+        connection.set_schema_to_public()
+        tenant = self.get_tenant_from_options_or_interactive(**options)
+        if tenant.schema_name == get_public_schema_name():
+            raise CommandError("The public tenant can't be purged.")
+
+        if options['interactive']:
+            confirm = input("All the data of the tenant '%s' will be deleted, this can't be undone.\n"
+                            "Type 'yes' to continue, or 'no' to cancel: " % tenant.schema_name)
+            if confirm != 'yes':
+                raise CommandError('Purge cancelled.')
+
+        verbosity = int(options['verbosity'])
+        started = time.monotonic()
+
+        def progress(model, deleted):
+            if verbosity >= 2:
+                self.stdout.write('  %s: %d rows deleted' % (model._meta.label, deleted))
+
+        deleted = purge_tenant(tenant, batch_size=options['batch_size'], sleep=options['sleep'], progress=progress)
+
+        if verbosity >= 1:
+            for label, count in deleted.items():
+                if count:
+                    self.stdout.write('%s: %d rows' % (label, count))
+            self.stdout.write(self.style.SUCCESS("Purged tenant '%s', %d rows deleted in %.2fs." % (
+                tenant.schema_name, sum(deleted.values()), time.monotonic() - started)))
@@ -0,0 +1,29 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+
+    help = ('Rewrites the tenant RLS policy of every table in place (ALTER POLICY) for the '
+            'TENANT_RLS_POLICY mode, or the one given by --mode.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', dest='mode', choices=('function', 'setting', 'initplan', 'integer'),
+                            help='Policy mode, defaults to the TENANT_RLS_POLICY setting.')
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true', default=False,
+                            help='Print the SQL instead of running it.')
+
+    def handle(self, *args, **options):
+        connection.set_schema_to_public()
+        try:
+            with connection.schema_editor(collect_sql=options['dry_run']) as editor:
+                tables = editor.rewrite_rls_policies(options['mode'])
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+
+        if options['dry_run']:
+            for sql in editor.collected_sql:
+                self.stdout.write(sql)
+        elif int(options['verbosity']) >= 1:
+            self.stdout.write('Rewrote the tenant policy of %d tables.' % len(tables))
@@ -1,10 +1,12 @@
 import django
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import DisallowedHost, PermissionDenied
 from django.db import connection
 from django.http import Http404
+from tenant_schemas.tenant_cache import aget_cached_tenant, get_cached_tenant
 from tenant_schemas.utils import (get_tenant_model, remove_www,
                                   get_public_schema_name)
 
@@ -25,6 +27,8 @@ such as inspecting the header, or extracting it from some OAuth token.
 
 class BaseTenantMiddleware(MIDDLEWARE_MIXIN):
     TENANT_NOT_FOUND_EXCEPTION = Http404
+    sync_capable = True
+    async_capable = True
 
     """
     Subclass and override  this to achieve desired behaviour. Given a
@@ -35,12 +39,49 @@ class BaseTenantMiddleware(MIDDLEWARE_MIXIN):
     def get_tenant(self, model, hostname, request):
         raise NotImplementedError
 
+    async def aget_tenant(self, model, hostname, request):
+        """
+        Async version of get_tenant(). Override it along with get_tenant() to
+        resolve the tenant without a thread hop in an async middleware stack,
+        by default get_tenant() runs in a thread.
+        """
+        return await sync_to_async(self.get_tenant, thread_sensitive=True)(model, hostname, request)
+
     def hostname_from_request(self, request):
         """ Extracts hostname from request. Used for custom requests filtering.
             By default removes the request's port and common prefixes.
         """
         return remove_www(request.get_host().split(':')[0]).lower()
 
+    async def __acall__(self, request):
+        """
+        Async version of ``__call__``. The tenant is set in the context of the
+        request, so async views running concurrently with other requests on
+        the event loop see their own tenant, see tenant_schemas.context.
+        """
+        if self._has_native_aget_tenant():
+            await self.aprocess_request(request)
+        else:
+            await sync_to_async(self.process_request, thread_sensitive=True)(request)
+            connection.set_tenant(request.tenant)
+        response = await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = await sync_to_async(self.process_response, thread_sensitive=True)(request, response)
+        return response
+
+    def _has_native_aget_tenant(self):
+        """
+        Return False when a subclass customizes process_request() or
+        get_tenant() without providing the matching async method.
+        """
+        mro = type(self).__mro__
+        if next(cls for cls in mro if 'process_request' in vars(cls)) is not BaseTenantMiddleware:
+            return False
+        get_tenant_owner = next(cls for cls in mro if 'get_tenant' in vars(cls))
+        aget_tenant_owner = next(cls for cls in mro if 'aget_tenant' in vars(cls))
+        return (aget_tenant_owner is not BaseTenantMiddleware
+                and mro.index(aget_tenant_owner) <= mro.index(get_tenant_owner))
+
     def process_request(self, request):
         # Connection needs first to be at the public schema, as this is where
         # the tenant metadata is stored.
@@ -58,8 +99,33 @@ class BaseTenantMiddleware(MIDDLEWARE_MIXIN):
                 'No tenant for {!r}'.format(request.get_host()))
         except AssertionError:
             raise self.TENANT_NOT_FOUND_EXCEPTION(
-                'Invalid tenant {!r}'.format(request.tenant))
+                'Invalid tenant {!r}'.format(tenant))
+
+        self.set_request_tenant(request, tenant)
 
+    async def aprocess_request(self, request):
+        """
+        Async version of process_request(), resolves the tenant with
+        aget_tenant().
+        """
+        connection.set_schema_to_public()
+
+        hostname = self.hostname_from_request(request)
+        TenantModel = get_tenant_model()
+
+        try:
+            tenant = await self.aget_tenant(TenantModel, hostname, request)
+            assert isinstance(tenant, TenantModel)
+        except TenantModel.DoesNotExist:
+            raise self.TENANT_NOT_FOUND_EXCEPTION(
+                'No tenant for {!r}'.format(request.get_host()))
+        except AssertionError:
+            raise self.TENANT_NOT_FOUND_EXCEPTION(
+                'Invalid tenant {!r}'.format(tenant))
+
+        self.set_request_tenant(request, tenant)
+
+    def set_request_tenant(self, request, tenant):
         request.tenant = tenant
         connection.set_tenant(request.tenant)
 
@@ -74,14 +140,21 @@ class TenantMiddleware(BaseTenantMiddleware):
     """
 
     def get_tenant(self, model, hostname, request):
-        return model.objects.get(domain_url=hostname)
+        return get_cached_tenant(model, domain_url=hostname)
+
+    async def aget_tenant(self, model, hostname, request):
+        return await aget_cached_tenant(model, domain_url=hostname)
 
 
 class RequestHeaderMiddleware(BaseTenantMiddleware):
 
     def get_tenant(self, model, hostname, request):
         schema_name = self.get_schema_name(request)
-        return model.objects.get(schema_name=schema_name)
+        return get_cached_tenant(model, schema_name=schema_name)
+
+    async def aget_tenant(self, model, hostname, request):
+        schema_name = self.get_schema_name(request)
+        return await aget_cached_tenant(model, schema_name=schema_name)
 
     @staticmethod
     def get_schema_name(request):
@@ -127,4 +200,15 @@ class DefaultTenantMiddleware(SuspiciousTenantMiddleware):
             if not schema_name:
                 schema_name = get_public_schema_name()
 
-            return model.objects.get(schema_name=schema_name)
+            return get_cached_tenant(model, schema_name=schema_name)
+
+    async def aget_tenant(self, model, hostname, request):
+        try:
+            return await super(DefaultTenantMiddleware, self).aget_tenant(
+                model, hostname, request)
+        except model.DoesNotExist:
+            schema_name = self.DEFAULT_SCHEMA_NAME
+            if not schema_name:
+                schema_name = get_public_schema_name()
+
+            return await aget_cached_tenant(model, schema_name=schema_name)
@@ -0,0 +1,19 @@
+from django.core.management.base import CommandError
+
+from .asynchronous import AsyncExecutor
+from .base import BaseExecutor
+from .parallel import ParallelExecutor
+from .standard import StandardExecutor
+
+EXECUTORS = {executor.codename: executor for executor in (StandardExecutor, ParallelExecutor, AsyncExecutor)}
+
+
+def get_executor(codename=None):
+    """
+    Return the migration executor class registered under ``codename``, the
+    standard one by default.
+    """
+    try:
+        return EXECUTORS[codename or StandardExecutor.codename]
+    except KeyError:
+        raise CommandError("Unknown executor '%s', use one of: %s." % (codename, ', '.join(sorted(EXECUTORS))))
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import connections
+
+from tenant_schemas.utils import get_async_migration_max_threads
+
+from .base import BaseExecutor, apply_migration
+
+CONCURRENT_OPERATIONS = (AddIndexConcurrently, RemoveIndexConcurrently)
+
+
+def _apply_migration_in_thread(key, database):
+    try:
+        apply_migration(key, database)
+    finally:
+        # Every thread has its own connection.
+        connections[database].close()
+
+
+class AsyncExecutor(BaseExecutor):
+    """
+    Applies the migrations in order, except the non atomic ones only made of
+    ``AddIndexConcurrently`` / ``RemoveIndexConcurrently`` operations, which
+    are run in the background by ``TENANT_ASYNC_MIGRATION_MAX_THREADS``
+    threads while the following migrations are applied. A migration waits
+    for the background migrations it depends on.
+    """
+    codename = 'async'
+
+    def run_plan(self, plan, graph):
+        pending = {}
+        with ThreadPoolExecutor(get_async_migration_max_threads()) as pool:
+            for migration, _ in plan:
+                key = (migration.app_label, migration.name)
+                ancestors = set(graph.forwards_plan(key))
+                for dependency in [dependency for dependency in pending if dependency in ancestors]:
+                    pending.pop(dependency).result()
+
+                if self.is_concurrent(migration):
+                    self.log_migration(key, ' (in the background)')
+                    pending[key] = pool.submit(_apply_migration_in_thread, key, self.database)
+                elif self.needs_signals(migration):
+                    self.migrate(*key)
+                else:
+                    self.log_migration(key)
+                    apply_migration(key, self.database)
+
+            for future in pending.values():
+                future.result()
+
+    @staticmethod
+    def is_concurrent(migration):
+        return (not migration.atomic and bool(migration.operations)
+                and all(isinstance(operation, CONCURRENT_OPERATIONS) for operation in migration.operations))
@@ -0,0 +1,91 @@
+from django.core.management import call_command
+from django.core.management.sql import emit_pre_migrate_signal
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.operations import RenameModel
+
+
+def apply_migration(key, database):
+    """
+    Apply the migration ``key`` (``(app_label, name)``) and the ones it depends
+    on, without sending the pre_migrate and post_migrate signals.
+    """
+    executor = MigrationExecutor(connections[database])
+    executor.migrate([key])
+
+
+class BaseExecutor(object):
+    """
+    Runs the migrations of migrate_schemas.
+
+    Subclasses apply the migrations of the plan in some other order or
+    concurrently in run_plan(), then the standard ``migrate`` command runs to
+    finish the job: it applies whatever is left and sends the post_migrate
+    signal. pre_migrate is sent before run_plan(), its receivers create what
+    the migrations depend on (e.g. get_current_tenant()), and once more by
+    ``migrate``.
+    """
+    # Options of migrate passed on by migrate_schemas.
+    migrate_options = ('fake', 'fake_initial', 'plan')
+    codename = None
+
+    def __init__(self, args, options, stdout=None, style=None):
+        self.args = args
+        self.options = options
+        self.stdout = stdout
+        self.style = style
+        self.database = options.get('database') or 'default'
+        self.verbosity = int(options.get('verbosity', 1))
+
+    def run_migrations(self, app_label=None, migration_name=None):
+        targets = [target for target in (app_label, migration_name) if target]
+        executor = MigrationExecutor(connections[self.database])
+        plan = executor.migration_plan(self.get_targets(executor, app_label, migration_name))
+        # Unapplying, faking or only showing migrations is left to migrate.
+        if plan and not any(backwards for _, backwards in plan) and not self.get_migrate_options():
+            # Create the django_migrations table before the workers race to.
+            executor.recorder.ensure_schema()
+            emit_pre_migrate_signal(self.verbosity, False, self.database,
+                                    apps=executor.loader.project_state().apps)
+            self.run_plan(plan, executor.loader.graph)
+        self.migrate(*targets)
+
+    def run_plan(self, plan, graph):
+        raise NotImplementedError
+
+    @staticmethod
+    def get_targets(executor, app_label=None, migration_name=None):
+        """
+        Return the migration targets of ``migrate app_label migration_name``.
+        """
+        if app_label and migration_name:
+            if migration_name == 'zero':
+                return [(app_label, None)]
+            migration = executor.loader.get_migration_by_prefix(app_label, migration_name)
+            return [(app_label, migration.name)]
+        if app_label:
+            return [key for key in executor.loader.graph.leaf_nodes() if key[0] == app_label]
+        return executor.loader.graph.leaf_nodes()
+
+    @staticmethod
+    def needs_signals(migration):
+        """
+        Return True for the migrations that have to be applied by ``migrate``,
+        because pre_migrate receivers add operations to them (e.g. contenttypes
+        renaming the content types of renamed models).
+        """
+        return any(isinstance(operation, RenameModel) for operation in migration.operations)
+
+    def get_migrate_options(self):
+        return {name: self.options[name] for name in self.migrate_options if self.options.get(name)}
+
+    def migrate(self, *targets):
+        options = self.get_migrate_options()
+        if self.stdout is not None:
+            options['stdout'] = self.stdout
+        call_command('migrate', *targets, database=self.database, verbosity=self.verbosity,
+                     interactive=False, skip_checks=True, **options)
+
+    def log_migration(self, key, suffix=''):
+        if self.verbosity >= 1 and self.stdout is not None:
+            self.stdout.write("  Applying %s.%s%s" % (key[0], key[1], suffix))
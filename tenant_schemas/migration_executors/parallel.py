@@ -0,0 +1,70 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+from tenant_schemas.utils import get_parallel_migration_chunks, get_parallel_migration_max_processes
+
+from .base import BaseExecutor, apply_migration
+
+
+def _apply_migration(task):
+    key, database = task
+    apply_migration(key, database)
+    return key
+
+
+class ParallelExecutor(BaseExecutor):
+    """
+    Applies the migrations that don't depend on each other concurrently, with
+    a pool of ``TENANT_PARALLEL_MIGRATION_MAX_PROCESSES`` processes.
+
+    The plan is split in waves: a migration belongs to the wave following the
+    last one of its dependencies, so the migrations of a wave (at most one per
+    app) can be applied at the same time once the previous waves are done.
+    """
+    codename = 'parallel'
+
+    def run_plan(self, plan, graph):
+        waves = self.get_waves(plan, graph)
+        if all(len(wave) <= 1 for wave in waves):
+            return
+
+        context = multiprocessing.get_context('fork')
+        # The workers must not share the sockets of the parent's connections.
+        connections.close_all()
+        with ProcessPoolExecutor(get_parallel_migration_max_processes(), mp_context=context) as pool:
+            for wave in waves:
+                concurrent = [migration for migration in wave if not self.needs_signals(migration)]
+                for migration in concurrent:
+                    self.log_migration((migration.app_label, migration.name))
+                tasks = [((migration.app_label, migration.name), self.database) for migration in concurrent]
+                try:
+                    list(pool.map(_apply_migration, tasks, chunksize=get_parallel_migration_chunks()))
+                except BrokenProcessPool:
+                    # A worker was killed, or exited, the migrations it was
+                    # applying may or may not have been recorded.
+                    raise CommandError("A worker process died while applying the migrations %s." % ', '.join(
+                        '%s.%s' % key for key, _ in tasks))
+                for migration in wave:
+                    if migration not in concurrent:
+                        self.migrate(migration.app_label, migration.name)
+
+    @staticmethod
+    def get_waves(plan, graph):
+        """
+        Group the migrations of a forwards ``plan`` in waves of migrations
+        that don't depend on each other.
+        """
+        waves = []
+        wave_of = {}
+        for migration, _ in plan:
+            key = (migration.app_label, migration.name)
+            parents = [wave_of[parent.key] for parent in graph.node_map[key].parents if parent.key in wave_of]
+            wave_of[key] = max(parents) + 1 if parents else 0
+            if wave_of[key] == len(waves):
+                waves.append([])
+            waves[wave_of[key]].append(migration)
+        return waves
@@ -0,0 +1,11 @@
+from .base import BaseExecutor
+
+
+class StandardExecutor(BaseExecutor):
+    """
+    Applies the migrations one after the other with Django's ``migrate``.
+    """
+    codename = 'standard'
+
+    def run_migrations(self, app_label=None, migration_name=None):
+        self.migrate(*[target for target in (app_label, migration_name) if target])
@@ -1,10 +1,17 @@
+import logging
+import time
+
 from django.conf import settings
 from django.core import checks
-from django.db import connection, models
+from django.db import connection, models, transaction
 
 from .fields import RLSForeignKey, generate_rls_fk_field
-from .utils import get_tenant_model
-from .signals import post_schema_sync
+from .context import FakeTenant
+from .tenant_cache import get_cached_tenant, tenant_lookup_cache
+from .utils import get_tenant_key, get_tenant_model
+from .signals import post_schema_sync, post_schema_sync_bulk
+
+logger = logging.getLogger(__name__)
 
 
 def get_tenant():
@@ -12,7 +19,22 @@ def get_tenant():
     if tenant is None:
         raise Exception("No tenant configured in db connection, connection.tenant is none")
     model = get_tenant_model()
-    return tenant if isinstance(tenant, model) else model(schema_name=tenant.schema_name)
+    if isinstance(tenant, model):
+        return tenant
+    if get_tenant_key() == 'pk':
+        # Rows reference the primary key, which only the database knows. It
+        # isn't kept on the schema: the tenant cache expires and is
+        # invalidated by the other processes, e.g. when the tenant is
+        # recreated under a new primary key.
+        return get_cached_tenant(model, schema_name=tenant.schema_name)
+    # This is the default of every RLSForeignKey, reuse the instance built for
+    # the schema instead of building one per created object.
+    instance = getattr(tenant, 'model_instance', None)
+    if type(instance) is not model:
+        instance = model(schema_name=tenant.schema_name)
+        if isinstance(tenant, FakeTenant):
+            tenant.model_instance = instance
+    return instance
 
 
 class TenantQueryset(models.QuerySet):
@@ -36,6 +58,39 @@ class TenantQueryset(models.QuerySet):
         if counter:
             return counter, counter_dict
 
+    def purge(self, **kwargs):
+        """
+        Delete the tenants along with all their rows, in batches instead of
+        loading them in memory. See tenant_schemas.purge.purge_tenant() for
+        the arguments.
+        """
+        from .purge import purge_tenant
+
+        return {tenant.schema_name: purge_tenant(tenant, **kwargs) for tenant in self}
+
+    def bulk_create_tenants(self, tenants, batch_size=1000):
+        """
+        Insert ``tenants`` in batches of ``batch_size``, each batch in its own
+        transaction along with the ``post_schema_sync_bulk`` handlers seeding
+        its data. ``post_save`` and ``post_schema_sync`` are not sent. Return
+        the created tenants.
+        """
+        tenants = list(tenants)
+        created = []
+        for start in range(0, len(tenants), batch_size):
+            batch = tenants[start:start + batch_size]
+            started = time.monotonic()
+            with transaction.atomic(using=self.db):
+                batch = self.bulk_create(batch)
+                inserted = time.monotonic()
+                post_schema_sync_bulk.send(sender=TenantMixin, tenants=batch)
+            # Lookups of these tenants may have been cached as misses.
+            tenant_lookup_cache.invalidate_many(batch)
+            logger.info('Created %d tenants in %.3fs, post_schema_sync_bulk took %.3fs',
+                        len(batch), inserted - started, time.monotonic() - inserted)
+            created.extend(batch)
+        return created
+
 
 class TenantMixin(models.Model):
     """
@@ -50,9 +105,10 @@ class TenantMixin(models.Model):
         abstract = True
 
     def save(self, *args, **kwargs):
+        is_new = self._state.adding
         super().save(*args, **kwargs)
 
-        if self.pk is None:
+        if is_new:
             post_schema_sync.send(sender=TenantMixin, tenant=self)
 
 
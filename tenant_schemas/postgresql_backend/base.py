@@ -1,12 +1,19 @@
+import re
+from collections.abc import Mapping
+
 import psycopg2
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import transaction
 import django.db.utils
 
+from tenant_schemas.context import FakeTenant, get_current_tenant, get_fake_tenant, set_current_tenant  # noqa
 from tenant_schemas.postgresql_backend.schema import RLSDatabaseSchemaEditor
-from tenant_schemas.utils import get_public_schema_name, get_limit_set_calls
+from tenant_schemas.utils import (get_clear_content_type_cache, get_limit_set_calls,
+                                  get_public_schema_name, get_tenant_prepare_set_statement,
+                                  get_tenant_set_mode)
 
 
 ORIGINAL_BACKEND = getattr(
@@ -15,6 +22,19 @@ ORIGINAL_BACKEND = getattr(
 # Django 1.9+ takes care to rename the default backend to 'django.db.backends.postgresql'
 original_backend = django.db.utils.load_backend(ORIGINAL_BACKEND)
 
+# First keyword of the statements the tenant setting can be sent along with
+# in 'piggyback' and 'transaction' modes.
+PIGGYBACK_STATEMENTS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'))
+# First keyword of the statements that don't depend on the tenant setting.
+TENANT_INDEPENDENT_STATEMENTS = frozenset(('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT', 'SET', 'RESET'))
+# First keyword of the DDL and maintenance statements, which don't read the
+# tenant and some of which can't run inside a transaction block.
+MAINTENANCE_STATEMENTS = frozenset((
+    'CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'COMMENT', 'GRANT', 'REVOKE', 'VACUUM', 'ANALYZE', 'CLUSTER',
+    'REINDEX', 'CHECKPOINT', 'DISCARD', 'LISTEN', 'UNLISTEN', 'NOTIFY', 'SHOW', 'DEALLOCATE',
+))
+FIRST_KEYWORD_RE = re.compile(r'\s*([A-Za-z]+)')
+
 
 class DatabaseWrapper(original_backend.DatabaseWrapper):
     """
@@ -24,25 +44,79 @@ class DatabaseWrapper(original_backend.DatabaseWrapper):
     include_public_schema = True
     SchemaEditorClass = RLSDatabaseSchemaEditor
 
+    sql_set_config_tenant = "SELECT set_config('txerpa.tenant', %s, %s)"
+    sql_set_config_tenant_named = (
+        "SELECT set_config('txerpa.tenant', %(_tenant_schema_name)s, %(_tenant_is_local)s)"
+    )
+    sql_prepare_set_tenant = (
+        "PREPARE txerpa_set_tenant(text) AS SELECT set_config('txerpa.tenant', $1, false)"
+    )
+    sql_execute_set_tenant = "EXECUTE txerpa_set_tenant(%s)"
+
     def __init__(self, *args, **kwargs):
-        self.search_path_set = None
-        self.tenant = None
-        self.schema_name = None
+        # Value of the tenant setting on the current physical connection,
+        # None when unknown.
+        self._applied_schema_name = None
+        # Whether the statement setting the tenant is prepared on the current
+        # physical connection.
+        self._set_tenant_prepared = False
 
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
 
-        # Use a patched version of the DatabaseIntrospection that only returns the table list for the
-        # currently selected schema.
-        self.set_schema_to_public()
+        self.execute_wrappers.append(self._tenant_execute_wrapper)
+
+        # The tenant itself is kept in the current context, which defaults to
+        # the public schema, see tenant_schemas.context.
+        self.set_settings_schema(get_public_schema_name())
+
+    @property
+    def tenant(self):
+        return get_current_tenant(self.alias)
+
+    @tenant.setter
+    def tenant(self, tenant):
+        set_current_tenant(tenant, self.alias)
+
+    @property
+    def schema_name(self):
+        tenant = self.tenant
+        return tenant.schema_name if tenant is not None else None
+
+    def init_connection_state(self):
+        # A new physical connection starts without the tenant setting.
+        self._applied_schema_name = None
+        self._set_tenant_prepared = False
+        super(DatabaseWrapper, self).init_connection_state()
+        if get_tenant_prepare_set_statement() and get_tenant_set_mode() == 'session':
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.sql_prepare_set_tenant)
+            self._set_tenant_prepared = True
 
     def close(self):
-        self.search_path_set = False
+        self._applied_schema_name = None
+        self._set_tenant_prepared = False
         super(DatabaseWrapper, self).close()
 
+    def commit(self):
+        super(DatabaseWrapper, self).commit()
+        if get_tenant_set_mode() == 'transaction':
+            # The tenant was only set for the transaction that just ended.
+            self._applied_schema_name = None
+
     def rollback(self):
         super(DatabaseWrapper, self).rollback()
-        # Django's rollback clears the search path so we have to set it again the next time.
-        self.search_path_set = False
+        # Rolling back reverts a SET made during the transaction, so we have to set it again the next time.
+        self._applied_schema_name = None
+
+    def _set_autocommit(self, autocommit):
+        super(DatabaseWrapper, self)._set_autocommit(autocommit)
+        if get_tenant_set_mode() == 'transaction':
+            self._applied_schema_name = None
+
+    def _savepoint_rollback(self, sid):
+        super(DatabaseWrapper, self)._savepoint_rollback(sid)
+        # Same as rollback(), the SET may have been made after the savepoint.
+        self._applied_schema_name = None
 
     def set_tenant(self, tenant, include_public=True):
         """
@@ -57,19 +131,15 @@ class DatabaseWrapper(original_backend.DatabaseWrapper):
         Main API method to current database schema,
         but it does not actually modify the db connection.
         """
-        self.tenant = FakeTenant(schema_name=schema_name)
-        self.schema_name = schema_name
+        self.tenant = get_fake_tenant(schema_name)
         self.include_public_schema = include_public
         self.set_settings_schema(schema_name)
-        self.search_path_set = False
-        # Content type can no longer be cached as public and tenant schemas
-        # have different models. If someone wants to change this, the cache
-        # needs to be separated between public and shared schemas. If this
-        # cache isn't cleared, this can cause permission problems. For example,
-        # on public, a particular model has id 14, but on the tenants it has
-        # the id 15. if 14 is cached instead of 15, the permissions for the
-        # wrong model will be fetched.
-        ContentType.objects.clear_cache()
+        # All tenants share the django_content_type table with RLS, so the
+        # content type cache is valid for every tenant. Clearing it on every
+        # switch, as needed when each schema had its own content type ids, can
+        # be restored with TENANT_CLEAR_CONTENT_TYPE_CACHE.
+        if get_clear_content_type_cache():
+            ContentType.objects.clear_cache()
 
     def set_schema_to_public(self):
         """
@@ -91,9 +161,29 @@ class DatabaseWrapper(original_backend.DatabaseWrapper):
         else:
             cursor = super(DatabaseWrapper, self)._cursor()
 
-        # optionally limit the number of executions - under load, the execution
-        # of `set search_path` can be quite time consuming
-        if (not get_limit_set_calls()) or not self.search_path_set:
+        mode = get_tenant_set_mode()
+        if mode == 'transaction':
+            if name and self.autocommit:
+                # psycopg2 declares the cursor WITH HOLD outside of a
+                # transaction, no transaction-local setting applies to it.
+                raise ImproperlyConfigured(
+                    "Server-side cursors can't be used outside of a transaction "
+                    "with TENANT_SET_MODE = 'transaction'. Wrap the query in "
+                    "transaction.atomic() or set DISABLE_SERVER_SIDE_CURSORS."
+                )
+            if name and not (get_limit_set_calls() and self._applied_schema_name == self.schema_name):
+                with self.connection.cursor() as cursor_for_tenant_property:
+                    self._set_tenant_setting(cursor_for_tenant_property, local=True)
+            return cursor
+
+        # In 'piggyback' mode the tenant is sent along with the first
+        # statement executed on the cursor, see _tenant_execute_wrapper().
+        if not name and mode == 'piggyback':
+            return cursor
+
+        # Only set the tenant when the connection holds a different one, unless
+        # this has been disabled by TENANT_LIMIT_SET_CALLS = False.
+        if (not get_limit_set_calls()) or self._applied_schema_name != self.schema_name:
             # Actual search_path modification for the cursor. Database will
             # search schemata from left to right when looking for the object
             # (table, index, sequence, etc.).
@@ -115,25 +205,98 @@ class DatabaseWrapper(original_backend.DatabaseWrapper):
             # if the next instruction is not a rollback it will just fail also, so
             # we do not have to worry that it's not the good one
             try:
-                cursor_for_tenant_property.execute(
-                    f"SET txerpa.tenant = '{self.schema_name}'"
-                )
+                if self._set_tenant_prepared:
+                    cursor_for_tenant_property.execute(self.sql_execute_set_tenant, (self.schema_name,))
+                else:
+                    cursor_for_tenant_property.execute(self.sql_set_config_tenant, (self.schema_name, False))
             except (django.db.utils.DatabaseError, psycopg2.InternalError):
-                self.search_path_set = False
+                self._applied_schema_name = None
             else:
-                self.search_path_set = True
+                self._applied_schema_name = self.schema_name
 
             if name:
                 cursor_for_tenant_property.close()
 
         return cursor
 
+    def _tenant_execute_wrapper(self, execute, sql, params, many, context):
+        """
+        Execute wrapper folding the tenant setting into the statement, saving
+        the round trip of a separate SET.
 
-class FakeTenant:
-    """
-    We can't import any db model in a backend (apparently?), so this class is used
-    for wrapping schema names in a tenant-like structure.
-    """
+        In 'piggyback' mode the setting is session scoped and only sent when
+        the tenant changed. In 'transaction' mode it is local to the current
+        transaction, so it is sent once per transaction, and with every
+        statement in autocommit mode.
+        """
+        mode = get_tenant_set_mode()
+        if mode not in ('piggyback', 'transaction'):
+            return execute(sql, params, many, context)
+        local = mode == 'transaction'
+        autocommit = local and self.autocommit
+        if not autocommit and get_limit_set_calls() and self._applied_schema_name == self.schema_name:
+            return execute(sql, params, many, context)
+
+        if not self.schema_name:
+            raise ImproperlyConfigured(
+                "Database schema not set. Did you forget "
+                "to call set_schema() or set_tenant()?"
+            )
+
+        match = FIRST_KEYWORD_RE.match(sql) if isinstance(sql, str) else None
+        keyword = match.group(1).upper() if match else None
+        if keyword in TENANT_INDEPENDENT_STATEMENTS:
+            return execute(sql, params, many, context)
+
+        if autocommit:
+            if keyword in MAINTENANCE_STATEMENTS and not many:
+                return execute(sql, params, many, context)
+            if many or keyword not in PIGGYBACK_STATEMENTS:
+                # Every statement of executemany() would be its own
+                # transaction otherwise, and the others (e.g. EXPLAIN, VALUES,
+                # CALL) are sent as they are.
+                with transaction.atomic(using=self.alias):
+                    return self._tenant_execute_wrapper(execute, sql, params, many, context)
+            # A multi-statement query runs in a single implicit transaction.
+            sql, params = self._fold_tenant_setting(sql, params, local)
+            return execute(sql, params, many, context)
+
+        if many or keyword not in PIGGYBACK_STATEMENTS:
+            # executemany() and statements that can't run in a multi-statement
+            # query (e.g. CREATE INDEX CONCURRENTLY) get a SET of their own.
+            self._set_tenant_setting(context['cursor'].cursor, local)
+            return execute(sql, params, many, context)
+
+        sql, params = self._fold_tenant_setting(sql, params, local)
+        try:
+            result = execute(sql, params, many, context)
+        except Exception:
+            # Both statements are in the same implicit transaction, the
+            # setting is rolled back with the failing statement.
+            self._applied_schema_name = None
+            raise
+        self._applied_schema_name = self.schema_name
+        return result
+
+    def _fold_tenant_setting(self, sql, params, local=False):
+        """
+        Prepend the statement setting the tenant to ``sql``. Both statements are
+        sent in the same message and the cursor returns the results of the
+        last one.
+        """
+        if params is None:
+            # Without parameters the statement is sent as is, it has to be
+            # escaped now that ours are interpolated in it.
+            return '%s; %s' % (self.sql_set_config_tenant, sql.replace('%', '%%')), (self.schema_name, local)
+        if isinstance(params, Mapping):
+            params = dict(params, _tenant_schema_name=self.schema_name, _tenant_is_local=local)
+            return '%s; %s' % (self.sql_set_config_tenant_named, sql), params
+        return '%s; %s' % (self.sql_set_config_tenant, sql), (self.schema_name, local) + tuple(params)
 
-    def __init__(self, schema_name):
-        self.schema_name = schema_name
+    def _set_tenant_setting(self, cursor, local=False):
+        try:
+            cursor.execute(self.sql_set_config_tenant, (self.schema_name, local))
+        except (django.db.utils.DatabaseError, psycopg2.Error):
+            self._applied_schema_name = None
+            raise
+        self._applied_schema_name = self.schema_name
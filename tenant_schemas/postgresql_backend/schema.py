@@ -1,4 +1,18 @@
+import copy
+from collections import namedtuple
+
+from django.core.exceptions import ImproperlyConfigured
 from django.db.backends.postgresql.schema import DatabaseSchemaEditor
+from django.db.backends.utils import truncate_name
+
+from tenant_schemas.fields import get_rls_field
+from tenant_schemas.utils import (get_composite_indexes, get_rls_policy_mode, get_tenant_key, get_tenant_partitions,
+                                  tenant_context)
+
+# Row level security state of a table, tenant_default is the expression of the
+# default of its tenant_id column.
+RLSState = namedtuple('RLSState', 'enabled forced has_policy tenant_default')
+NO_RLS_STATE = RLSState(False, False, False, None)
 
 
 class RLSDatabaseSchemaEditor(DatabaseSchemaEditor):
@@ -13,11 +27,70 @@ class RLSDatabaseSchemaEditor(DatabaseSchemaEditor):
         "DROP POLICY IF EXISTS _po_tenant_%(table)s ON %(table)s"
     )
     sql_alter_column_defaul_tenant = (
-        "ALTER TABLE ONLY %(table)s ALTER COLUMN tenant_id SET DEFAULT get_current_tenant();"
+        "ALTER TABLE ONLY %(table)s ALTER COLUMN tenant_id SET DEFAULT %(default)s"
+    )
+    sql_partition_by = " PARTITION BY %(method)s (tenant_id)"
+    sql_create_hash_partition = (
+        "CREATE TABLE %(partition)s PARTITION OF %(table)s FOR VALUES WITH (MODULUS %(modulus)s, REMAINDER %(remainder)s)"
+    )
+    sql_create_default_partition = "CREATE TABLE %(partition)s PARTITION OF %(table)s DEFAULT"
+    sql_partitions = """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """
+    sql_alter_policy = (
+        "ALTER POLICY _po_tenant_%(table)s ON %(table)s USING %(policy)s"
     )
     main_rls_policy = (
         "(tenant_id = get_current_tenant()) with check (tenant_id = get_current_tenant())"
     )
+    # Policies by TENANT_RLS_POLICY mode. Reading the setting directly lets
+    # the planner treat it as a stable value and use the index on tenant_id,
+    # 'initplan' evaluates it once per query, 'integer' is for tenant_id
+    # columns holding the primary key of the tenant.
+    rls_policies = {
+        'function': main_rls_policy,
+        'setting': (
+            "(tenant_id = current_setting('txerpa.tenant', true)) "
+            "with check (tenant_id = current_setting('txerpa.tenant', true))"
+        ),
+        'initplan': (
+            "(tenant_id = (SELECT current_setting('txerpa.tenant', true))) "
+            "with check (tenant_id = (SELECT current_setting('txerpa.tenant', true)))"
+        ),
+        'integer': (
+            "(tenant_id = (SELECT get_current_tenant_id())) "
+            "with check (tenant_id = (SELECT get_current_tenant_id()))"
+        ),
+    }
+    # Default of tenant_id by TENANT_KEY, as returned by pg_get_expr()
+    tenant_defaults = {
+        'schema_name': "get_current_tenant()",
+        'pk': "get_current_tenant_id()",
+    }
+    # Policy names are unquoted identifiers, folded to lower case and
+    # truncated to 63 characters.
+    sql_rls_state = """
+        SELECT c.relname, c.relrowsecurity, c.relforcerowsecurity,
+               EXISTS (
+                   SELECT 1 FROM pg_policy p
+                   WHERE p.polrelid = c.oid AND p.polname = left(lower('_po_tenant_' || c.relname), 63)
+               ),
+               (
+                   SELECT pg_get_expr(d.adbin, d.adrelid)
+                   FROM pg_attrdef d
+                   JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+                   WHERE d.adrelid = c.oid AND a.attname = 'tenant_id'
+               )
+        FROM pg_class c
+        WHERE c.relkind IN ('r', 'p') AND pg_table_is_visible(c.oid)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # RLS state of every table, loaded once per editor (i.e. per
+        # migration) and kept up to date with the DDL executed by it.
+        self._rls_state = None
 
     def create_model(self, model):
         # if any field has the rls_required flag then rls constraints are created
@@ -28,6 +101,152 @@ class RLSDatabaseSchemaEditor(DatabaseSchemaEditor):
         # enable RLS on table and create policy
         self._set_tenant_rls(enable_rls, model)
 
+        partitioning = self.get_partitioning(model)
+        if partitioning is not None:
+            table, columns = model._meta.db_table, [model._meta.pk.column, 'tenant_id']
+            self.execute(self.sql_create_pk % {
+                'table': self.quote_name(table),
+                'name': self.quote_name(self._create_index_name(table, columns, suffix='_pk')),
+                'columns': ', '.join(self.quote_name(column) for column in columns),
+            })
+            self.create_partitions(model, *partitioning)
+
+    def table_sql(self, model):
+        partitioning = self.get_partitioning(model)
+        if partitioning is None:
+            return super().table_sql(model)
+        # PARTITION BY has to come before the tablespace, if any.
+        self.sql_create_table = type(self).sql_create_table + self.sql_partition_by % {
+            'method': partitioning[0].upper()}
+        try:
+            return super().table_sql(model)
+        finally:
+            del self.sql_create_table
+
+    def column_sql(self, model, field, include_default=False):
+        if field.primary_key and self.get_partitioning(model) is not None:
+            # The primary key of a partitioned table has to include
+            # tenant_id, it's added by create_model().
+            field = copy.copy(field)
+            field.primary_key = field.unique = False
+        return super().column_sql(model, field, include_default)
+
+    def get_partitioning(self, model):
+        """
+        Return the (method, partitions) of ``model`` in TENANT_PARTITIONS, None
+        for tables that aren't partitioned.
+        """
+        partitioning = get_tenant_partitions().get(model._meta.label)
+        if partitioning is None:
+            return None
+        method = partitioning.get('method', 'hash')
+        if method not in ('hash', 'list'):
+            raise ImproperlyConfigured("Unknown partitioning method '%s' of %s in TENANT_PARTITIONS, "
+                                       "use 'hash' or 'list'." % (method, model._meta.label))
+        if get_rls_field(model) is None:
+            raise ImproperlyConfigured("%s in TENANT_PARTITIONS isn't a multitenant model." % model._meta.label)
+        unique = [field.name for field in model._meta.local_concrete_fields if field.unique and not field.primary_key]
+        if unique:
+            raise ImproperlyConfigured("%s in TENANT_PARTITIONS can't have unique fields (%s), use unique "
+                                       "constraints, which include tenant_id." % (model._meta.label, ', '.join(unique)))
+        return method, partitioning.get('partitions', 8)
+
+    def get_partition_name(self, table, suffix):
+        return truncate_name('%s_%s' % (table, suffix), self.connection.ops.max_name_length())
+
+    def create_partitions(self, model, method, partitions, table=None):
+        """
+        Create the partitions of the partitioned table of ``model`` (or of
+        ``table`` while it is built under another name): the hash partitions,
+        or the default partition of list partitioned tables, which gets the
+        rows of the tenants without partition, see create_tenant_partition().
+        Row level security is enabled on each one, so they can't be queried
+        directly to bypass the policy of the table.
+        """
+        prefix = model._meta.db_table
+        table = table or prefix
+        if method == 'hash':
+            names = [self.get_partition_name(prefix, 'p%d' % remainder) for remainder in range(partitions)]
+            statements = [
+                self.sql_create_hash_partition % {
+                    'partition': self.quote_name(name),
+                    'table': self.quote_name(table),
+                    'modulus': partitions,
+                    'remainder': remainder,
+                } for remainder, name in enumerate(names)
+            ]
+        else:
+            names = [self.get_partition_name(prefix, 'default')]
+            statements = [self.sql_create_default_partition % {
+                'partition': self.quote_name(names[0]),
+                'table': self.quote_name(table),
+            }]
+        for name in names:
+            statements += self.get_rls_statements(name)
+        self.execute('; '.join(statements))
+        return names
+
+    def create_tenant_partition(self, model, tenant):
+        """
+        Create the partition of a list partitioned table holding the rows of
+        ``tenant``, moving them out of the default partition. They are moved
+        as the tenant, so the row level security policy of the default
+        partition lets them through whatever the role.
+        """
+        table = model._meta.db_table
+        value = tenant.pk if get_tenant_key() == 'pk' else tenant.schema_name
+        name = self.get_partition_name(table, value)
+        default = self.get_partition_name(table, 'default')
+        self.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % (
+            self.quote_name(name), self.quote_name(table)))
+        with tenant_context(tenant):
+            self.execute('WITH moved AS (DELETE FROM %s WHERE tenant_id = %%s RETURNING *) '
+                         'INSERT INTO %s SELECT * FROM moved' % (self.quote_name(default), self.quote_name(name)),
+                         [value])
+        self.execute('ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN (%%s)' % (
+            self.quote_name(table), self.quote_name(name)), [value])
+        for statement in self.get_rls_statements(name):
+            self.execute(statement)
+        return name
+
+    def create_tenant_partitions(self, model, tenants):
+        """
+        Create the missing partitions of ``tenants`` in the list partitioned
+        table of ``model``, unless the table isn't partitioned yet (see the
+        partition_tables command). Return the names of the created partitions.
+        """
+        table = model._meta.db_table
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.sql_partitions, [self.quote_name(table)])
+            existing = {row[0] for row in cursor.fetchall()}
+        if not existing:
+            # Partitioned tables by list always have a default partition.
+            return []
+        by_pk = get_tenant_key() == 'pk'
+        return [
+            self.create_tenant_partition(model, tenant) for tenant in tenants
+            if self.get_partition_name(table, tenant.pk if by_pk else tenant.schema_name) not in existing
+        ]
+
+    def get_rls_statements(self, table):
+        """
+        Return the statements enabling row level security on a new ``table``.
+        """
+        return [
+            self.sql_enable_rls % {"table": self.quote_name(table)},
+            self.sql_force_rls % {"table": self.quote_name(table)},
+            self.sql_create_policy % {"table": table, "policy": self.get_rls_policy()},
+        ]
+
+    def delete_model(self, model):
+        super().delete_model(model)
+        self._set_rls_state(model._meta.db_table, NO_RLS_STATE)
+
+    def alter_db_table(self, model, old_db_table, new_db_table):
+        super().alter_db_table(model, old_db_table, new_db_table)
+        # Reload the state of the renamed table when needed.
+        self._rls_state = None
+
     def add_field(self, model, field):
         enable_rls = field.rls_required if hasattr(field, 'rls_required') else False
 
@@ -49,20 +268,177 @@ class RLSDatabaseSchemaEditor(DatabaseSchemaEditor):
         # disable RLS on table and delete policy
         self._unset_tenant_rls(disable_rls, model)
 
+    def _create_index_sql(self, model, *, fields=None, name=None, suffix="", col_suffixes=(), opclasses=(),
+                          **kwargs):
+        leading = self._tenant_leading(model, fields)
+        if leading is not None:
+            if name is None:
+                # Named after the original columns, so the index is found by
+                # name when Django drops it.
+                name = self._create_index_name(model._meta.db_table, [field.column for field in fields], suffix)
+            col_suffixes = self._shift(fields, leading, col_suffixes)
+            opclasses = self._shift(fields, leading, opclasses)
+            fields = leading
+        return super()._create_index_sql(model, fields=fields, name=name, suffix=suffix, col_suffixes=col_suffixes,
+                                         opclasses=opclasses, **kwargs)
+
+    def _unique_sql(self, model, fields, name, *args, **kwargs):
+        # Unique constraints declared in the CREATE TABLE statement.
+        leading = self._tenant_leading(model, fields, unique=True)
+        if leading is not None:
+            if kwargs.get('opclasses'):
+                kwargs['opclasses'] = self._shift(fields, leading, kwargs['opclasses'])
+            fields = leading
+        return super()._unique_sql(model, fields, name, *args, **kwargs)
+
+    def _create_unique_sql(self, model, fields, name=None, *args, **kwargs):
+        if fields and len(fields) == 1 and self._is_unique_field(model, fields[0]):
+            # unique=True of a field, e.g. the target of a foreign key.
+            return super()._create_unique_sql(model, fields, name, *args, **kwargs)
+        leading = self._tenant_leading(model, fields, unique=True)
+        if leading is not None:
+            if name is None:
+                name = self._create_index_name(model._meta.db_table, [self._column(item) for item in fields],
+                                               suffix='_uniq')
+            if kwargs.get('opclasses'):
+                kwargs['opclasses'] = self._shift(fields, leading, kwargs['opclasses'])
+            fields = leading
+        return super()._create_unique_sql(model, fields, name, *args, **kwargs)
+
+    def _constraint_names(self, model, column_names=None, *args, **kwargs):
+        names = super()._constraint_names(model, column_names, *args, **kwargs)
+        if not names and column_names:
+            # Indexes and unique constraints created with the tenant column
+            # moved in front.
+            leading = self._tenant_leading(model, column_names, unique=bool(kwargs.get('unique')))
+            if leading is not None:
+                names = super()._constraint_names(model, leading, *args, **kwargs)
+        return names
+
+    def _tenant_leading(self, model, fields, unique=False):
+        """
+        Return ``fields`` (fields or column names) with the tenant column in
+        front when TENANT_COMPOSITE_INDEXES is set, None when they are left as
+        they are: shared models, expressions, lists already leading with the
+        tenant column and single foreign keys, whose index is used to check
+        the references. The unique constraints of partitioned tables always
+        get the tenant column, they can't be created without it.
+        """
+        partitioned = unique and self.get_partitioning(model) is not None
+        if not fields or not (get_composite_indexes() or partitioned):
+            return None
+        tenant_field = get_rls_field(model)
+        if tenant_field is None:
+            return None
+        tenant = tenant_field if not isinstance(fields[0], str) else tenant_field.column
+        if fields[0] == tenant:
+            return None
+        if len(fields) == 1 and not isinstance(fields[0], str) and fields[0].remote_field is not None \
+                and not partitioned:
+            return None
+        return [tenant] + [item for item in fields if item != tenant]
+
+    @staticmethod
+    def _shift(fields, leading, values):
+        """
+        Reorder the per column ``values`` (opclasses, column suffixes) of
+        ``fields`` along with their columns in ``leading``.
+        """
+        if not values:
+            return values
+        by_item = dict(zip(fields, values))
+        return [by_item.get(item, '') for item in leading]
+
+    @staticmethod
+    def _column(item):
+        return item if isinstance(item, str) else item.column
+
+    @staticmethod
+    def _is_unique_field(model, item):
+        if isinstance(item, str):
+            return any(field.unique for field in model._meta.local_concrete_fields if field.column == item)
+        return item.unique
+
+    def get_rls_policy(self, mode=None):
+        """
+        Return the USING and WITH CHECK clauses of the tenant policy for the
+        TENANT_RLS_POLICY mode.
+        """
+        mode = mode or get_rls_policy_mode()
+        try:
+            return self.rls_policies[mode]
+        except KeyError:
+            raise ImproperlyConfigured("Unknown TENANT_RLS_POLICY '%s', use one of: %s." % (
+                mode, ', '.join(sorted(self.rls_policies))))
+
+    def rewrite_rls_policies(self, mode=None):
+        """
+        Rewrite the tenant policy of every table having one for the
+        TENANT_RLS_POLICY mode, in a single statement. Return the tables.
+        """
+        policy = self.get_rls_policy(mode)
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.sql_rls_state)
+            tables = sorted(row[0] for row in cursor.fetchall() if row[3])
+        if tables:
+            self.execute('; '.join(
+                self.sql_alter_policy % {"table": table, "policy": policy} for table in tables
+            ))
+        return tables
+
+    def _get_rls_state(self, table):
+        if self.collect_sql:
+            # sqlmigrate, the database may not match the migrations.
+            return NO_RLS_STATE
+        if self._rls_state is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute(self.sql_rls_state)
+                self._rls_state = {row[0]: RLSState(*row[1:]) for row in cursor.fetchall()}
+        return self._rls_state.get(table, NO_RLS_STATE)
+
+    def _set_rls_state(self, table, state):
+        if self._rls_state is not None:
+            self._rls_state[table] = state
+
     def _set_tenant_rls(self, enable_rls, model):
-        if enable_rls:
-            self.execute(self.sql_enable_rls % {"table": self.quote_name(model._meta.db_table)})
-            self.execute(self.sql_force_rls % {"table": self.quote_name(model._meta.db_table)})
-            self.execute(self.sql_create_policy % {
-                "table": model._meta.db_table,
-                "policy": self.main_rls_policy
+        if not enable_rls:
+            return
+        table = model._meta.db_table
+        state = self._get_rls_state(table)
+        statements = []
+        if not state.enabled:
+            statements.append(self.sql_enable_rls % {"table": self.quote_name(table)})
+        if not state.forced:
+            statements.append(self.sql_force_rls % {"table": self.quote_name(table)})
+        if not state.has_policy:
+            statements.append(self.sql_create_policy % {
+                "table": table,
+                "policy": self.get_rls_policy()
+            })
+        tenant_default = self.tenant_defaults[get_tenant_key()]
+        if state.tenant_default != tenant_default:
+            statements.append(self.sql_alter_column_defaul_tenant % {
+                "table": self.quote_name(table),
+                "default": tenant_default,
             })
-            self.execute(self.sql_alter_column_defaul_tenant % {"table": self.quote_name(model._meta.db_table)})
+        if statements:
+            # One round trip for all the statements of the table.
+            self.execute('; '.join(statements))
+        self._set_rls_state(table, RLSState(True, True, True, tenant_default))
 
     def _unset_tenant_rls(self, disable_rls, model):
-        if disable_rls:
-            self.execute(self.sql_disable_rls % {"table": self.quote_name(model._meta.db_table)})
-            self.execute(self.sql_drop_policy % {"table": model._meta.db_table})
+        if not disable_rls:
+            return
+        table = model._meta.db_table
+        state = self._get_rls_state(table)
+        statements = []
+        if state.enabled or self.collect_sql:
+            statements.append(self.sql_disable_rls % {"table": self.quote_name(table)})
+        if state.has_policy or self.collect_sql:
+            statements.append(self.sql_drop_policy % {"table": table})
+        if statements:
+            self.execute('; '.join(statements))
+        self._set_rls_state(table, state._replace(enabled=False, has_policy=False, tenant_default=None))
 
     # abstract method, not apply in this backend because requires_literal_defaults = False
     def prepare_default(self, value):
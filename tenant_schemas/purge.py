@@ -0,0 +1,215 @@
+"""
+Deletion of all the rows of a tenant.
+
+Deleting a tenant with ``delete()`` makes Django's collector load the related
+rows of every multitenant table into memory before deleting them, which never
+ends for large tenants. ``purge_tenant()`` deletes them table by table instead,
+the tables referencing others first, in batches of ``batch_size`` rows that are
+each committed on their own, and only then deletes the tenant.
+
+The rows are deleted with the tenant set on the connection, so the row level
+security policies keep the other tenants' rows out of reach. No signals are
+sent for them, and ``on_delete`` handlers are not run: every row of the tenant
+goes, whatever references it.
+"""
+import time
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.transaction import TransactionManagementError
+
+from .fields import get_rls_field
+from .utils import get_tenant_key, tenant_context
+
+
+def get_purge_order(models=None):
+    """
+    Return the multitenant ``models`` (all of them by default) in the order
+    their tables are purged, see get_purge_plan().
+    """
+    return [model for model, unlink in get_purge_plan(models)]
+
+
+def get_purge_plan(models=None):
+    """
+    Return ``(model, fields)`` for the multitenant ``models`` (all of them by
+    default), each model before the models its foreign keys point to.
+    ``fields`` are the nullable foreign keys set to NULL before deleting
+    anything, to break the cycles of tables referencing each other. Raise
+    ValueError when a cycle only goes through non-null foreign keys.
+    """
+    if models is None:
+        models = apps.get_models(include_auto_created=True)
+    by_table = {}
+    for model in models:
+        if get_rls_field(model) is not None and model._meta.managed and not model._meta.proxy:
+            by_table.setdefault(model._meta.db_table, model)
+
+    references = {table: {} for table in by_table}
+    for table, model in by_table.items():
+        for field in model._meta.local_concrete_fields:
+            if field.remote_field is not None:
+                target = field.related_model._meta.db_table
+                if target in by_table and target != table:
+                    references[table].setdefault(target, []).append(field)
+
+    components = _get_components(references)
+    unlink = {table: [] for table in by_table}
+    referenced_by = {table: set() for table in by_table}
+    for table, targets in references.items():
+        for target, fields in targets.items():
+            if components[table] == components[target] and all(field.null for field in fields):
+                unlink[table].extend(fields)
+            else:
+                referenced_by[target].add(table)
+
+    order, visited, visiting = [], set(), []
+
+    def visit(table):
+        if table in visiting:
+            cycle = visiting[visiting.index(table):]
+            raise ValueError("The tables %s reference each other through non-null foreign keys, they can't be "
+                             "purged in batches." % ', '.join(cycle))
+        if table in visited:
+            return
+        visiting.append(table)
+        for referencing in sorted(referenced_by[table]):
+            visit(referencing)
+        visiting.pop()
+        visited.add(table)
+        order.append((by_table[table], unlink[table]))
+
+    for table in sorted(by_table):
+        visit(table)
+    return order
+
+
+def _get_components(references):
+    """
+    Return the strongly connected component of each table of the
+    ``references`` graph (Tarjan's algorithm).
+    """
+    index, lowlink, components, stack = {}, {}, {}, []
+
+    def connect(table):
+        index[table] = lowlink[table] = len(index)
+        stack.append(table)
+        for target in references[table]:
+            if target not in index:
+                connect(target)
+                lowlink[table] = min(lowlink[table], lowlink[target])
+            elif target not in components and target in stack:
+                lowlink[table] = min(lowlink[table], index[target])
+        if lowlink[table] == index[table]:
+            while True:
+                member = stack.pop()
+                components[member] = table
+                if member == table:
+                    break
+
+    for table in sorted(references):
+        if table not in index:
+            connect(table)
+    return components
+
+
+def purge_tenant(tenant, batch_size=1000, sleep=0, progress=None, models=None):
+    """
+    Delete the rows of ``tenant`` from every multitenant table (or from the
+    tables of ``models``), then the tenant itself. ``sleep`` seconds are
+    waited between batches to spread the load, ``progress(model, deleted)``
+    is called after each batch with the number of rows deleted so far from
+    the table of ``model``. Return the number of rows deleted by model label.
+    Raise TransactionManagementError inside an atomic block, which would
+    hold every batch until it ends.
+    """
+    if connection.in_atomic_block:
+        raise TransactionManagementError(
+            "purge_tenant() commits each batch on its own, it can't be run inside an atomic block.")
+    value = tenant.pk if get_tenant_key() == 'pk' else tenant.schema_name
+    plan = get_purge_plan(models)
+    deleted = {}
+    with tenant_context(tenant):
+        # Every row referencing a row of another batch has to be unlinked
+        # first, the foreign keys are checked when each batch commits.
+        for model, fields in plan:
+            for field in fields + _get_self_references(model, null=True):
+                _unlink(model, field, value, batch_size, sleep)
+        for model, fields in plan:
+            deleted[model._meta.label] = _purge_table(model, value, batch_size, sleep, progress)
+        tenant.delete()
+    return deleted
+
+
+def _get_self_references(model, null):
+    return [
+        field for field in model._meta.local_concrete_fields
+        if field.remote_field is not None and field.null == null
+        and field.related_model._meta.db_table == model._meta.db_table
+    ]
+
+
+def _unlink(model, field, value, batch_size, sleep):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    pk = quote_name(model._meta.pk.column)
+    _run_in_batches(
+        'UPDATE %(table)s SET %(column)s = NULL WHERE %(pk)s IN ('
+        'SELECT %(pk)s FROM %(table)s WHERE %(tenant)s = %%s AND %(column)s IS NOT NULL LIMIT %%s)' % {
+            'table': table, 'column': quote_name(field.column), 'pk': pk,
+            'tenant': quote_name(get_rls_field(model).column),
+        },
+        value, batch_size, sleep,
+    )
+
+
+def _purge_table(model, value, batch_size, sleep, progress):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    tenant_column = quote_name(get_rls_field(model).column)
+    pk = quote_name(model._meta.pk.column)
+    callback = (lambda count: progress(model, count)) if progress is not None else None
+
+    # Non-null references to rows of the same table can't be unlinked, the
+    # rows no other row references are deleted first.
+    leaves = ''.join(
+        ' AND NOT EXISTS (SELECT 1 FROM %(table)s r WHERE r.%(column)s = t.%(target)s AND r.%(pk)s <> t.%(pk)s)' % {
+            'table': table, 'column': quote_name(field.column), 'target': quote_name(field.target_field.column),
+            'pk': pk,
+        }
+        for field in _get_self_references(model, null=False)
+    )
+    sql = (
+        'DELETE FROM %(table)s WHERE %(pk)s IN ('
+        'SELECT t.%(pk)s FROM %(table)s t WHERE t.%(tenant)s = %%s%(leaves)s LIMIT %%s)' % {
+            'table': table, 'pk': pk, 'tenant': tenant_column, 'leaves': leaves,
+        }
+    )
+    total = _run_in_batches(sql, value, batch_size, sleep, callback, until_empty=bool(leaves))
+    if leaves:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM %s WHERE %s = %%s' % (table, tenant_column), [value])
+            if cursor.fetchone()[0]:
+                raise ValueError("Rows of %s reference each other in a cycle through non-null foreign keys, "
+                                 "they can't be purged in batches." % model._meta.label)
+    return total
+
+
+def _run_in_batches(sql, value, batch_size, sleep, callback=None, until_empty=False):
+    """
+    Run ``sql`` until it affects less than ``batch_size`` rows, or none when
+    ``until_empty`` is True, each run in its own transaction.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [value, batch_size])
+                count = cursor.rowcount
+        total += count
+        if callback is not None:
+            callback(total)
+        if count == 0 if until_empty else count < batch_size:
+            return total
+        if sleep:
+            time.sleep(sleep)
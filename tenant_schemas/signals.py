@@ -4,3 +4,9 @@ post_schema_sync = Signal()
 post_schema_sync.__doc__ = """
 Sent after a tenant has been saved, its schema created and synced
 """
+
+post_schema_sync_bulk = Signal()
+post_schema_sync_bulk.__doc__ = """
+Sent after a batch of tenants has been created by bulk_create_tenants(), with
+the list of the created tenants
+"""
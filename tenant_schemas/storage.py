@@ -3,11 +3,11 @@ import os
 from django.core.exceptions import SuspiciousOperation
 from django.utils._os import safe_join
 
-from django.db import connection
-
 from django.core.files.storage import FileSystemStorage
 from django.contrib.staticfiles.storage import StaticFilesStorage
 
+from tenant_schemas.context import get_current_tenant
+
 __all__ = (
     'TenantStorageMixin',
     'TenantFileSystemStorage',
@@ -32,7 +32,7 @@ class TenantStorageMixin(object):
         if name is None:
             name = ''
         try:
-            location = safe_join(self.location, connection.tenant.domain_url)
+            location = safe_join(self.location, get_current_tenant().domain_url)
         except AttributeError:
             location = self.location
         try:
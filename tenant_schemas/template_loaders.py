@@ -3,147 +3,355 @@ Adaptations of the cached and filesystem template loader working in a
 multi-tenant setting
 """
 
+import functools
 import hashlib
+import os
+import posixpath
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
 from django.db import connection
-from django.template import TemplateDoesNotExist
-from django.template.base import Template
-from django.template.loaders.base import Loader as BaseLoader
+from django.template import Origin, Template, TemplateDoesNotExist
+from django.template.backends.django import copy_exception
+from django.template.loaders.cached import Loader as DjangoCachedLoader
+from django.template.loaders.filesystem import Loader as DjangoFilesystemLoader
 from django.utils._os import safe_join
-from django.utils.encoding import force_bytes
 
+from tenant_schemas.context import get_current_schema_name
 from tenant_schemas.postgresql_backend.base import FakeTenant
+from tenant_schemas.utils import (get_template_cache_max_bytes,
+                                  get_template_cache_max_entries,
+                                  get_template_cache_miss_timeout,
+                                  get_template_index_check_interval,
+                                  get_template_index_max_entries)
 
-try:
-    from django.template import Origin
 
-    def make_origin(engine, name, loader, template_name, dirs):
-        return Origin(name=name, template_name=template_name, loader=loader)
+class TemplateCache(object):
+    """
+    Thread safe LRU of the templates loaded by CachedLoader, bounded by the
+    number of entries and by the approximate size of the distinct templates
+    they hold, the length of their sources.
 
-except ImportError:  # Django 1.8 backwards compatibility
-    def make_origin(engine, name, loader, template_name, dirs):
-        return engine.make_origin(name, loader, template_name, dirs)
+    Keys are tuples starting with the schema name of the tenant, so the
+    entries of a tenant can be dropped at once. Failed lookups are kept
+    ``miss_timeout`` seconds only, forever when it is None.
+    """
 
+    def __init__(self, max_entries, max_bytes, miss_timeout):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.miss_timeout = miss_timeout
+        # key -> (value, expires_at)
+        self._entries = OrderedDict()
+        self._tenant_keys = {}
+        # id(template) -> [size, number of entries holding it]
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
 
-class CachedLoader(BaseLoader):
-    is_usable = True
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._delete(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
 
-    def __init__(self, engine, loaders):
-        self.template_cache = {}
-        self.find_template_cache = {}
-        self.loaders = engine.get_template_loaders(loaders)
-        super(CachedLoader, self).__init__(engine)
-
-    @staticmethod
-    def cache_key(template_name, template_dirs):
-        if connection.tenant and template_dirs:
-            return '-'.join([str(connection.tenant.pk), template_name,
-                             hashlib.sha1(force_bytes('|'.join(template_dirs))).hexdigest()])
-        if template_dirs:
-            # If template directories were specified, use a hash to differentiate
-            return '-'.join([template_name, hashlib.sha1(force_bytes('|'.join(template_dirs))).hexdigest()])
+    def __setitem__(self, key, value):
+        is_template = hasattr(value, 'render')
+        if is_template or self.miss_timeout is None:
+            expires_at = None
         else:
-            return template_name
+            # A cached TemplateDoesNotExist.
+            expires_at = time.monotonic() + self.miss_timeout
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = (value, expires_at)
+            self._tenant_keys.setdefault(key[0], set()).add(key)
+            if is_template:
+                template = self._templates.get(id(value))
+                if template is None:
+                    size = len(getattr(value, 'source', ''))
+                    self._templates[id(value)] = [size, 1]
+                    self.size += size
+                else:
+                    template[1] += 1
+            while len(self._entries) > self.max_entries or (self.size > self.max_bytes and len(self._entries) > 1):
+                self._delete(next(iter(self._entries)))
+                self.evictions += 1
 
-    def find_template(self, name, dirs=None):
+    def clear(self, schema_name=None):
         """
-        Helper method. Lookup the template :param name: in all the configured loaders
+        Drop every entry, or only the entries of the tenant ``schema_name``.
         """
-        key = self.cache_key(name, dirs)
+        with self._lock:
+            if schema_name is None:
+                self._entries.clear()
+                self._tenant_keys.clear()
+                self._templates.clear()
+                self.size = 0
+                return
+            for key in list(self._tenant_keys.get(schema_name, ())):
+                self._delete(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'tenants': len(self._tenant_keys),
+                'templates': len(self._templates),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _delete(self, key):
+        value, expires_at = self._entries.pop(key)
+        template = self._templates.get(id(value))
+        if template is not None:
+            template[1] -= 1
+            if not template[1]:
+                del self._templates[id(value)]
+                self.size -= template[0]
+        keys = self._tenant_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._tenant_keys[key[0]]
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_digest(names):
+    return hashlib.sha1('|'.join(names).encode()).hexdigest()
+
+
+class CachedLoader(DjangoCachedLoader):
+    """
+    Django's cached loader, with the templates cached per tenant in a bounded
+    TemplateCache.
+
+    The tenants resolving a template name to the same file share one compiled
+    template: compiled templates are also kept by origin and modification
+    time for as long as a tenant holds them, so the tenants without their own
+    version of a template neither read nor compile it again.
+    """
+
+    def __init__(self, engine, loaders):
+        super(CachedLoader, self).__init__(engine, loaders)
+        self.get_template_cache = TemplateCache(
+            get_template_cache_max_entries(),
+            get_template_cache_max_bytes(),
+            get_template_cache_miss_timeout(),
+        )
+        self.compiled_templates = weakref.WeakValueDictionary()
+
+    def get_template(self, template_name, skip=None):
+        key = self.cache_key(template_name, skip)
+        cached = self.get_template_cache.get(key)
+        if cached:
+            if isinstance(cached, type) and issubclass(cached, TemplateDoesNotExist):
+                raise cached(template_name)
+            elif isinstance(cached, TemplateDoesNotExist):
+                raise copy_exception(cached)
+            return cached
+
         try:
-            result = self.find_template_cache[key]
-        except KeyError:
-            result = None
-            for loader in self.loaders:
-                try:
-                    template, display_name = loader(name, dirs)
-                except TemplateDoesNotExist:
-                    pass
-                else:
-                    origin = make_origin(self.engine, display_name, loader, name, dirs)
-                    result = template, origin
-                    break
-        self.find_template_cache[key] = result
-        if result:
-            return result
-        else:
-            self.template_cache[key] = TemplateDoesNotExist
-            raise TemplateDoesNotExist(name)
-
-    def load_template(self, template_name, template_dirs=None):
-        key = self.cache_key(template_name, template_dirs)
-        template_tuple = self.template_cache.get(key)
-        # A cached previous failure:
-        if template_tuple is TemplateDoesNotExist:
-            raise TemplateDoesNotExist
-        elif template_tuple is None:
-            template, origin = self.find_template(template_name, template_dirs)
-            if not hasattr(template, 'render'):
+            template = self.find_template(template_name, skip)
+        except TemplateDoesNotExist as e:
+            # See django.template.loaders.cached.Loader.get_template().
+            self.get_template_cache[key] = copy_exception(e) if self.engine.debug else TemplateDoesNotExist
+            raise
+        self.get_template_cache[key] = template
+        return template
+
+    def find_template(self, template_name, skip=None):
+        """
+        Return the template ``template_name`` resolves to for the current
+        tenant, compiled unless a tenant already holds it.
+        """
+        tried = []
+        for origin in self.get_template_sources(template_name):
+            if skip is not None and origin in skip:
+                tried.append((origin, 'Skipped to avoid recursion'))
+                continue
+            # Only files have a modification time, names of other loaders
+            # (e.g. locmem) aren't paths.
+            mtime = _get_mtime(origin.name) if os.path.isabs(origin.name) else None
+            compiled_key = (origin.loader, origin.name, mtime)
+            template = self.compiled_templates.get(compiled_key)
+            if template is None:
                 try:
-                    template = Template(template, origin, template_name, self.engine)
+                    contents = self.get_contents(origin)
                 except TemplateDoesNotExist:
-                    # If compiling the template we found raises TemplateDoesNotExist,
-                    # back off to returning the source and display name for the template
-                    # we were asked to load. This allows for correct identification (later)
-                    # of the actual template that does not exist.
-                    self.template_cache[key] = (template, origin)
-            self.template_cache[key] = (template, None)
-        return self.template_cache[key]
+                    tried.append((origin, 'Source does not exist'))
+                    continue
+                template = Template(contents, origin, origin.template_name, self.engine)
+                self.compiled_templates[compiled_key] = template
+            return template
+        raise TemplateDoesNotExist(template_name, tried=tried)
 
-    def reset(self):
+    def cache_key(self, template_name, skip=None):
+        """
+        Return ``(schema_name, template_name)``, followed by the digest of the
+        origins of ``skip`` matching ``template_name`` when there are some.
+        This runs for every template lookup, so it neither formats strings
+        nor hashes more than once each set of origins.
         """
-        Empty the template cache.
+        schema_name = get_current_schema_name()
+        if skip:
+            matching = tuple(origin.name for origin in skip if origin.template_name == template_name)
+            if matching:
+                return schema_name, template_name, _get_digest(matching)
+        return schema_name, template_name
+
+    def generate_hash(self, values):
+        return _get_digest(tuple(values))
+
+    def reset(self, tenant=None):
         """
-        self.template_cache.clear()
+        Empty the template cache, or only the templates of ``tenant``.
+        """
+        self.get_template_cache.clear(tenant.schema_name if tenant is not None else None)
+
+    def stats(self):
+        """
+        Return the size and the hit, miss and eviction counters of the cache,
+        along with the number of distinct templates it holds.
+        """
+        return self.get_template_cache.stats()
+
+
+class TemplateDirIndex(object):
+    """
+    Names of the templates found under a directory, so looking up a template
+    that isn't there costs no system call. The directory is scanned again
+    once the modification time of one of its subdirectories changed, which is
+    checked at most every ``check_interval`` seconds, never when it is None.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.scan()
+
+    def scan(self):
+        names, mtimes = set(), {}
+        for dirpath, dirnames, filenames in os.walk(self.path, followlinks=True):
+            mtimes[dirpath] = _get_mtime(dirpath)
+            relative = os.path.relpath(dirpath, self.path)
+            for filename in filenames:
+                names.add(posixpath.normpath(os.path.join(relative, filename).replace(os.sep, '/')))
+        if not mtimes:
+            # The directory doesn't exist (yet).
+            mtimes[self.path] = None
+        self.names, self.mtimes = frozenset(names), mtimes
+        self.checked_at = time.monotonic()
+
+    def __contains__(self, template_name):
+        if self.check_interval is not None and time.monotonic() - self.checked_at >= self.check_interval:
+            self.checked_at = time.monotonic()
+            if any(_get_mtime(path) != mtime for path, mtime in self.mtimes.items()):
+                self.scan()
+        return posixpath.normpath(template_name) in self.names
+
+    def __len__(self):
+        return len(self.names)
+
 
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
-class FilesystemLoader(BaseLoader):
-    is_usable = True
 
-    @staticmethod
-    def get_template_sources(template_name, template_dirs=None):
+class FilesystemLoader(DjangoFilesystemLoader):
+    """
+    Filesystem loader searching the directories of the current tenant under
+    ``MULTITENANT_TEMPLATE_DIRS``. The files of each tenant directory are
+    indexed, so the templates a tenant doesn't override are skipped without
+    touching the filesystem. Only the indexes of the
+    ``TENANT_TEMPLATE_INDEX_MAX_ENTRIES`` most recently used directories are
+    kept.
+    """
+
+    def __init__(self, engine, dirs=None):
+        super(FilesystemLoader, self).__init__(engine, dirs)
+        self.indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_dirs(self):
         """
-        Returns the absolute paths to "template_name", when appended to each
-        directory in "template_dirs". Any paths that don't lie inside one of the
-        template dirs are excluded from the result set, for security reasons.
+        Return the template directories of the current tenant.
         """
-        if not connection.tenant or isinstance(connection.tenant, FakeTenant):
-            return
-        if not template_dirs:
+        tenant = connection.tenant
+        if not tenant or isinstance(tenant, FakeTenant):
+            return []
+        template_dirs = self.dirs
+        if template_dirs is None:
             try:
                 template_dirs = settings.MULTITENANT_TEMPLATE_DIRS
             except AttributeError:
                 raise ImproperlyConfigured('To use %s.%s you must define the MULTITENANT_TEMPLATE_DIRS' %
                                            (__name__, FilesystemLoader.__name__))
+        dirs = []
         for template_dir in template_dirs:
             try:
                 if '%s' in template_dir:
-                    yield safe_join(template_dir % connection.tenant.domain_url, template_name)
+                    dirs.append(template_dir % tenant.domain_url)
                 else:
-                    yield safe_join(template_dir, connection.tenant.domain_url, template_name)
-            except UnicodeDecodeError:
-                # The template dir name was a bytestring that wasn't valid UTF-8.
-                raise
-            except ValueError:
+                    dirs.append(safe_join(template_dir, tenant.domain_url))
+            except SuspiciousFileOperation:
+                pass
+        return dirs
+
+    def get_template_sources(self, template_name):
+        for template_dir in self.get_dirs():
+            if template_name not in self.get_index(template_dir):
+                continue
+            try:
+                name = safe_join(template_dir, template_name)
+            except SuspiciousFileOperation:
                 # The joined path was located outside of this particular
                 # template_dir (it might be inside another one, so this isn't
                 # fatal).
-                pass
+                continue
+            yield Origin(name=name, template_name=template_name, loader=self)
 
-    def load_template_source(self, template_name, template_dirs=None):
-        tried = []
-        for filepath in self.get_template_sources(template_name, template_dirs):
+    def get_index(self, template_dir):
+        with self._lock:
             try:
-                with open(filepath, 'rb') as fp:
-                    return fp.read().decode(settings.FILE_CHARSET), filepath
-            except IOError:
-                tried.append(filepath)
-        if tried:
-            error_msg = "Tried %s" % tried
-        else:
-            error_msg = "Your TEMPLATE_DIRS setting is empty. Change it to point to at least one template directory."
-        raise TemplateDoesNotExist(error_msg)
+                self.indexes.move_to_end(template_dir)
+                return self.indexes[template_dir]
+            except KeyError:
+                pass
+        # Scan outside of the lock, the other tenants shouldn't wait for it.
+        index = TemplateDirIndex(template_dir, get_template_index_check_interval())
+        with self._lock:
+            self.indexes[template_dir] = index
+            while len(self.indexes) > get_template_index_max_entries():
+                self.indexes.popitem(last=False)
+        return index
 
-    load_template_source.is_usable = True
+    def reset(self):
+        """
+        Forget the indexed tenant directories.
+        """
+        with self._lock:
+            self.indexes.clear()
@@ -0,0 +1,284 @@
+"""
+In-process cache for the tenant lookups done by the tenant middlewares.
+
+Resolving the tenant of a request is a query against the tenant table that
+returns the same row for almost every request. When ``TENANT_CACHE_TIMEOUT``
+is set, the middlewares keep the resolved tenants in a bounded LRU cache so
+the common request does not hit the database to find out its tenant.
+Lookups that matched no tenant are remembered for ``TENANT_CACHE_MISS_TIMEOUT``
+seconds in a separate LRU, so hostname scans can neither hammer the tenant
+table nor evict the known tenants.
+
+Entries are dropped whenever a tenant is saved or deleted in this process.
+Other processes are notified through a shared Django cache when
+``TENANT_CACHE_INVALIDATION_ALIAS`` is set, otherwise they see the change
+once their entries time out.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .context import get_fake_tenant
+from .utils import (get_tenant_cache_invalidation_alias,
+                    get_tenant_cache_max_size, get_tenant_cache_miss_timeout,
+                    get_tenant_cache_timeout)
+
+
+class TenantLookupCache(object):
+    """
+    Thread safe TTL + LRU mapping of tenant lookups to tenant instances.
+
+    Keys are tuples of ``(model_label, (field, value), ...)`` so an entry can
+    be matched against the fields of a saved or deleted tenant. Lookups that
+    found no tenant are kept apart from the resolved ones.
+    """
+    GENERATION_KEY = 'tenant_schemas:tenant_lookup_cache:generation'
+    # Seconds between two reads of the shared generation counter.
+    generation_check_interval = 1
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._misses = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, lets in-flight lookups detect that
+        # the row they read may already be stale.
+        self.generation = 0
+        self._shared_generation = None
+        self._shared_generation_checked_at = 0
+
+    def get(self, key):
+        self._check_shared_generation()
+        return self._get(self._entries, key)
+
+    def set(self, key, tenant, timeout, max_size, generation=None):
+        self._set(self._entries, key, tenant, timeout, max_size, generation)
+
+    def is_missing(self, key):
+        """
+        Return True if ``key`` recently matched no tenant.
+        """
+        self._check_shared_generation()
+        return self._get(self._misses, key) is not None
+
+    def set_missing(self, key, timeout, max_size, generation=None):
+        self._set(self._misses, key, True, timeout, max_size, generation)
+
+    def invalidate(self, tenant, publish=True):
+        """
+        Drop every entry that resolves to ``tenant`` or that was looked up by
+        any of its current field values.
+        """
+        self.invalidate_many([tenant], publish=publish)
+
+    def invalidate_many(self, tenants, publish=True):
+        """
+        Same as invalidate() for several tenants, in a single pass over the
+        entries and with a single notification of the other processes.
+        """
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, (cached, _) in self._entries.items()
+                     if any(self._matches(key, cached, tenant) for tenant in tenants)]
+            for key in stale:
+                del self._entries[key]
+            stale = [key for key in self._misses
+                     if any(self._matches(key, None, tenant) for tenant in tenants)]
+            for key in stale:
+                del self._misses[key]
+        if publish:
+            self._publish()
+
+    def clear(self, publish=False):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._misses.clear()
+        if publish:
+            self._publish()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, entries, key):
+        now = time.monotonic()
+        with self._lock:
+            try:
+                value, expires_at = entries[key]
+            except KeyError:
+                return None
+            if expires_at <= now:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def _set(self, entries, key, value, timeout, max_size, generation):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                # A tenant changed while this one was being looked up.
+                return
+            entries[key] = (value, time.monotonic() + timeout)
+            entries.move_to_end(key)
+            while len(entries) > max_size:
+                entries.popitem(last=False)
+
+    @staticmethod
+    def _matches(key, cached, tenant):
+        if cached is not None and type(cached) is type(tenant) and cached.pk == tenant.pk:
+            return True
+        return any(getattr(tenant, field, None) == value for field, value in key[1:])
+
+    def _publish(self):
+        alias = get_tenant_cache_invalidation_alias()
+        if not alias:
+            return
+        cache = caches[alias]
+        try:
+            shared_generation = cache.incr(self.GENERATION_KEY)
+        except ValueError:
+            cache.add(self.GENERATION_KEY, 1, timeout=None)
+            return
+        # Don't clear our own cache again when we are the only publisher
+        # since the last check.
+        if self._shared_generation is not None and shared_generation == self._shared_generation + 1:
+            self._shared_generation = shared_generation
+
+    def _check_shared_generation(self):
+        cache = self._get_shared_generation_cache()
+        if cache is not None:
+            self._update_shared_generation(cache.get(self.GENERATION_KEY, 0))
+
+    async def acheck_shared_generation(self):
+        """
+        Async version of the shared generation check done by get() and
+        is_missing(), reading the shared cache without blocking the event
+        loop. The following sync checks are skipped until the next interval.
+        """
+        cache = self._get_shared_generation_cache()
+        if cache is None:
+            return
+        if hasattr(cache, 'aget'):
+            shared_generation = await cache.aget(self.GENERATION_KEY, 0)
+        else:
+            # BaseCache.aget() is only available as of Django 4.0.
+            shared_generation = await sync_to_async(cache.get)(self.GENERATION_KEY, 0)
+        self._update_shared_generation(shared_generation)
+
+    def _get_shared_generation_cache(self):
+        """
+        Return the shared cache when its generation is due to be read.
+        """
+        alias = get_tenant_cache_invalidation_alias()
+        if not alias:
+            return None
+        now = time.monotonic()
+        if now - self._shared_generation_checked_at < self.generation_check_interval:
+            return None
+        self._shared_generation_checked_at = now
+        return caches[alias]
+
+    def _update_shared_generation(self, shared_generation):
+        if shared_generation != self._shared_generation:
+            if self._shared_generation is not None:
+                self.clear()
+            self._shared_generation = shared_generation
+
+
+tenant_lookup_cache = TenantLookupCache()
+
+
+def get_cached_tenant(model, **lookup):
+    """
+    Return ``model.objects.get(**lookup)``, served from the in-process tenant
+    cache when ``TENANT_CACHE_TIMEOUT`` is set. ``model.DoesNotExist`` is
+    raised without a query for lookups that missed during the last
+    ``TENANT_CACHE_MISS_TIMEOUT`` seconds.
+    """
+    timeout = get_tenant_cache_timeout()
+    miss_timeout = get_tenant_cache_miss_timeout()
+    if not timeout and not miss_timeout:
+        return model.objects.get(**lookup)
+
+    key = _get_key(model, lookup)
+    tenant = _get_cached(model, key, timeout, miss_timeout)
+    if tenant is not None:
+        return tenant
+
+    generation = tenant_lookup_cache.generation
+    try:
+        tenant = model.objects.get(**lookup)
+    except model.DoesNotExist:
+        _set_cached(key, None, timeout, miss_timeout, generation)
+        raise
+    _set_cached(key, tenant, timeout, miss_timeout, generation)
+    return tenant
+
+
+async def aget_cached_tenant(model, **lookup):
+    """
+    Async version of get_cached_tenant(). Cached lookups are answered without
+    leaving the event loop, only the query and the read of the shared
+    generation run in a thread.
+    """
+    timeout = get_tenant_cache_timeout()
+    miss_timeout = get_tenant_cache_miss_timeout()
+    if not timeout and not miss_timeout:
+        return await _aget(model, lookup)
+
+    key = _get_key(model, lookup)
+    await tenant_lookup_cache.acheck_shared_generation()
+    tenant = _get_cached(model, key, timeout, miss_timeout)
+    if tenant is not None:
+        return tenant
+
+    generation = tenant_lookup_cache.generation
+    try:
+        tenant = await _aget(model, lookup)
+    except model.DoesNotExist:
+        _set_cached(key, None, timeout, miss_timeout, generation)
+        raise
+    _set_cached(key, tenant, timeout, miss_timeout, generation)
+    return tenant
+
+
+def _get_key(model, lookup):
+    return (model._meta.label_lower,) + tuple(sorted(lookup.items()))
+
+
+def _get_cached(model, key, timeout, miss_timeout):
+    tenant = tenant_lookup_cache.get(key) if timeout else None
+    if tenant is None and miss_timeout and tenant_lookup_cache.is_missing(key):
+        raise model.DoesNotExist('%s matching query does not exist.' % model._meta.object_name)
+    return tenant
+
+
+def _set_cached(key, tenant, timeout, miss_timeout, generation):
+    if tenant is None:
+        if miss_timeout:
+            tenant_lookup_cache.set_missing(key, miss_timeout, get_tenant_cache_max_size(), generation)
+    elif timeout:
+        tenant_lookup_cache.set(key, tenant, timeout, get_tenant_cache_max_size(), generation)
+
+
+async def _aget(model, lookup):
+    manager = model.objects
+    if hasattr(manager, 'aget'):
+        return await manager.aget(**lookup)
+    # QuerySet.aget() is only available as of Django 4.1.
+    return await sync_to_async(manager.get)(**lookup)
+
+
+def invalidate_cached_tenant(sender, instance, **kwargs):
+    """
+    ``post_save`` and ``post_delete`` receiver dropping the cached lookups of
+    a tenant.
+    """
+    from .models import TenantMixin
+
+    if isinstance(instance, TenantMixin):
+        tenant_lookup_cache.invalidate(instance)
+        # Drop the instance kept by get_tenant() for the schema.
+        get_fake_tenant(instance.schema_name).model_instance = None
@@ -1,5 +1,14 @@
+from .test_backend import *
 from .test_cache import *
+from .test_commands import *
+from .test_context import *
 from .test_log import *
+from .test_migration_executors import *
+from .test_models import *
+from .test_purge import *
 from .test_routes import *
+from .test_schema import *
+from .test_template_loaders import *
+from .test_tenant_cache import *
 from .test_tenants import *
 from .test_utils import *
@@ -0,0 +1,306 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from tenant_schemas.models import get_tenant
+from tenant_schemas.tenant_cache import tenant_lookup_cache
+from tenant_schemas.utils import get_public_schema_name, get_tenant_model
+
+
+class TenantSettingMixin(object):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+
+    def run_queries(self, count=2):
+        """
+        Run ``count`` queries on their own cursor, return the queries that set
+        the tenant.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(count):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+        return [query['sql'] for query in queries if 'txerpa.tenant' in query['sql']]
+
+    @staticmethod
+    def current_tenant_setting():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('txerpa.tenant')")
+            return cursor.fetchone()[0]
+
+
+class TenantSettingTestCase(TenantSettingMixin, TestCase):
+    """
+    Tests how often the backend sends the tenant setting to the database.
+    """
+
+    def test_tenant_set_once(self):
+        connection.set_schema('tenant1')
+        self.assertEqual(len(self.run_queries()), 1)
+        self.assertEqual(len(self.run_queries()), 0)
+
+    def test_same_tenant_is_not_set_again(self):
+        connection.set_schema('tenant1')
+        self.run_queries()
+        connection.set_schema_to_public()
+        connection.set_schema('tenant1')
+        self.assertEqual(len(self.run_queries()), 0)
+
+    def test_switching_tenant(self):
+        connection.set_schema('tenant1')
+        self.run_queries()
+        connection.set_schema('tenant2')
+        self.assertEqual(len(self.run_queries()), 1)
+        connection.set_schema_to_public()
+        self.assertEqual(len(self.run_queries()), 1)
+
+    def test_rollback_resets_applied_tenant(self):
+        connection.set_schema('tenant1')
+        self.run_queries()
+        try:
+            with transaction.atomic():
+                connection.set_schema('tenant2')
+                self.run_queries()
+                raise ValueError
+        except ValueError:
+            pass
+        # The rollback restored tenant1 on the server, the SET of tenant2 is
+        # sent again by the next query.
+        self.assertEqual(self.current_tenant_setting(), 'tenant2')
+
+    @override_settings(TENANT_LIMIT_SET_CALLS=False)
+    def test_limit_set_calls_disabled(self):
+        connection.set_schema('tenant1')
+        self.assertEqual(len(self.run_queries()), 2)
+
+    def test_tenant_value(self):
+        connection.set_schema('tenant1')
+        self.assertEqual(self.current_tenant_setting(), 'tenant1')
+        connection.set_schema(get_public_schema_name())
+        self.assertEqual(self.current_tenant_setting(), get_public_schema_name())
+
+    def test_tenant_value_is_not_interpolated(self):
+        connection.set_schema("tenant'; RESET txerpa.tenant; --")
+        self.assertEqual(self.current_tenant_setting(), "tenant'; RESET txerpa.tenant; --")
+
+
+class TenantSettingReconnectTestCase(TenantSettingMixin, TransactionTestCase):
+
+    def test_reconnect_resets_applied_tenant(self):
+        connection.set_schema('tenant1')
+        self.run_queries()
+        connection.close()
+        self.assertEqual(self.current_tenant_setting(), 'tenant1')
+
+    @override_settings(TENANT_PREPARE_SET_STATEMENT=True)
+    def test_prepared_statement(self):
+        connection.close()
+        connection.set_schema('tenant1')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.current_tenant_setting(), 'tenant1')
+        self.assertIn('EXECUTE txerpa_set_tenant', queries[0]['sql'])
+        connection.set_schema('tenant2')
+        self.assertEqual(self.current_tenant_setting(), 'tenant2')
+        connection.close()
+
+
+@override_settings(TENANT_SET_MODE='piggyback')
+class PiggybackTenantSettingTestCase(TenantSettingMixin, TestCase):
+    """
+    Tests the tenant setting sent along with the first statement.
+    """
+
+    def test_tenant_folded_into_first_query(self):
+        connection.set_schema('tenant1')
+        queries = self.run_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('SELECT 1', queries[0])
+        self.assertEqual(len(self.run_queries()), 0)
+
+    def test_query_result(self):
+        connection.set_schema('tenant1')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT %s || '%%'", ['tenant'])
+            self.assertEqual(cursor.fetchone()[0], 'tenant%')
+        connection.set_schema('tenant2')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT %(value)s", {'value': 'tenant'})
+            self.assertEqual(cursor.fetchone()[0], 'tenant')
+        connection.set_schema('tenant1')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT '%'")
+            self.assertEqual(cursor.fetchone()[0], '%')
+
+    def test_tenant_value(self):
+        connection.set_schema('tenant1')
+        self.assertEqual(self.current_tenant_setting(), 'tenant1')
+        connection.set_schema('tenant2')
+        self.assertEqual(self.current_tenant_setting(), 'tenant2')
+
+    def test_failed_query_resets_applied_tenant(self):
+        connection.set_schema('tenant1')
+        self.run_queries()
+        connection.set_schema('tenant2')
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1 / 0')
+        except DatabaseError:
+            pass
+        self.assertEqual(self.current_tenant_setting(), 'tenant2')
+
+    def test_executemany(self):
+        connection.set_schema('tenant1')
+        with CaptureQueriesContext(connection) as queries:
+            with connection.cursor() as cursor:
+                cursor.executemany('SELECT %s', [(1,), (2,)])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.current_tenant_setting(), 'tenant1')
+
+
+@override_settings(TENANT_SET_MODE='transaction')
+class TransactionTenantSettingTestCase(TenantSettingMixin, TransactionTestCase):
+    """
+    Tests the tenant setting scoped to the current transaction.
+    """
+
+    def setUp(self):
+        # Start without a session level setting made by other tests.
+        connection.close()
+        super(TransactionTenantSettingTestCase, self).setUp()
+
+    @staticmethod
+    def session_tenant_setting():
+        # Bypasses the execute wrappers, nothing sets the tenant.
+        with connection.connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('txerpa.tenant', true)")
+            return cursor.fetchone()[0]
+
+    def test_autocommit_sets_tenant_for_every_query(self):
+        connection.set_schema('tenant1')
+        self.assertEqual(len(self.run_queries()), 2)
+        self.assertEqual(self.current_tenant_setting(), 'tenant1')
+        self.assertFalse(self.session_tenant_setting())
+
+    def test_transaction_sets_tenant_once(self):
+        connection.set_schema('tenant1')
+        with transaction.atomic():
+            self.assertEqual(len(self.run_queries()), 1)
+            self.assertEqual(self.current_tenant_setting(), 'tenant1')
+            connection.set_schema('tenant2')
+            self.assertEqual(self.current_tenant_setting(), 'tenant2')
+        self.assertFalse(self.session_tenant_setting())
+        with transaction.atomic():
+            self.assertEqual(len(self.run_queries()), 1)
+
+    def test_executemany_in_autocommit(self):
+        connection.set_schema('tenant1')
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE tenant_values (value text)')
+            cursor.executemany(
+                "INSERT INTO tenant_values VALUES (current_setting('txerpa.tenant') || %s)",
+                [('-1',), ('-2',)]
+            )
+            cursor.execute('SELECT value FROM tenant_values ORDER BY value')
+            self.assertEqual(cursor.fetchall(), [('tenant1-1',), ('tenant1-2',)])
+            cursor.execute('DROP TABLE tenant_values')
+
+    def test_other_statements_in_autocommit(self):
+        connection.set_schema('tenant1')
+        with connection.cursor() as cursor:
+            # Fails on a session where the setting was never made.
+            cursor.execute("EXPLAIN ANALYZE SELECT current_setting('txerpa.tenant')")
+            cursor.execute("VALUES (current_setting('txerpa.tenant'))")
+            self.assertEqual(cursor.fetchone()[0], 'tenant1')
+        with patch.object(connection, '_set_tenant_setting', wraps=connection._set_tenant_setting) as set_tenant:
+            get_tenant_model().objects.all().explain()
+        set_tenant.assert_called_once()
+        self.assertFalse(self.session_tenant_setting())
+
+    def test_server_side_cursor(self):
+        connection.set_schema('tenant1')
+        with self.assertRaises(ImproperlyConfigured):
+            with connection.chunked_cursor() as cursor:
+                cursor.execute('SELECT 1')
+        with transaction.atomic():
+            with connection.chunked_cursor() as cursor:
+                cursor.execute("SELECT current_setting('txerpa.tenant')")
+                self.assertEqual(cursor.fetchone()[0], 'tenant1')
+
+
+class ContentTypeCacheTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        ContentType.objects.clear_cache()
+        self.content_type = ContentType.objects.get_for_model(ContentType)
+
+    def test_cache_survives_tenant_switch(self):
+        connection.set_schema('tenant1')
+        connection.set_schema_to_public()
+        with self.assertNumQueries(0):
+            self.assertEqual(ContentType.objects.get_for_model(ContentType), self.content_type)
+
+    @override_settings(TENANT_CLEAR_CONTENT_TYPE_CACHE=True)
+    def test_clear_cache_on_tenant_switch(self):
+        connection.set_schema('tenant1')
+        connection.set_schema_to_public()
+        with self.assertNumQueries(1):
+            self.assertEqual(ContentType.objects.get_for_model(ContentType), self.content_type)
+
+
+class FakeTenantTestCase(TestCase):
+
+    def test_fake_tenant_is_interned(self):
+        connection.set_schema('tenant1')
+        tenant = connection.tenant
+        connection.set_schema('tenant2')
+        connection.set_schema('tenant1')
+        self.assertIs(connection.tenant, tenant)
+        self.assertEqual(connection.tenant.schema_name, 'tenant1')
+
+    def test_get_tenant_reuses_model_instance(self):
+        connection.set_schema('tenant1')
+        tenant = get_tenant()
+        self.assertIsInstance(tenant, get_tenant_model())
+        self.assertEqual(tenant.schema_name, 'tenant1')
+        self.assertIs(get_tenant(), tenant)
+        connection.set_schema('tenant2')
+        self.assertEqual(get_tenant().schema_name, 'tenant2')
+
+    def test_get_tenant_returns_tenant(self):
+        tenant = get_tenant_model()(domain_url='tenant.test.com', schema_name='tenant1')
+        connection.set_tenant(tenant)
+        self.assertIs(get_tenant(), tenant)
+
+    @override_settings(TENANT_KEY='pk', TENANT_CACHE_TIMEOUT=60)
+    def test_get_tenant_by_primary_key(self):
+        tenant = get_tenant_model().objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.addCleanup(tenant_lookup_cache.clear)
+        connection.set_schema('tenant1')
+        self.assertEqual(get_tenant().pk, tenant.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_tenant().pk, tenant.pk)
+
+    @override_settings(TENANT_KEY='pk', TENANT_CACHE_TIMEOUT=60, TENANT_CACHE_INVALIDATION_ALIAS='default')
+    def test_get_tenant_recreated_in_other_process(self):
+        TenantModel = get_tenant_model()
+        tenant = TenantModel.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.addCleanup(tenant_lookup_cache.clear)
+        connection.set_schema('tenant1')
+        self.assertEqual(get_tenant().pk, tenant.pk)
+        # Renamed and replaced by another process: no signal is received
+        # here, only the shared generation is bumped.
+        TenantModel.objects.filter(pk=tenant.pk).update(domain_url='old.test.com', schema_name='old')
+        recreated, = TenantModel.objects.bulk_create([
+            TenantModel(domain_url='tenant1.test.com', schema_name='tenant1')])
+        key = tenant_lookup_cache.GENERATION_KEY
+        cache.set(key, cache.get(key, 0) + 1)
+        self.addCleanup(cache.delete, key)
+        tenant_lookup_cache._shared_generation_checked_at = 0
+        self.assertEqual(get_tenant().pk, recreated.pk)
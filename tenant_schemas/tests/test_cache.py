@@ -1,5 +1,10 @@
-from tenant_schemas.cache import make_key, reverse_key
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+from mock import patch
+
+from tenant_schemas.cache import TenantCache, make_key, reverse_key
 from tenant_schemas.test.cases import TenantTestCase
+from tenant_schemas.utils import schema_context
 
 
 class CacheHelperTestCase(TenantTestCase):
@@ -11,3 +16,74 @@ class CacheHelperTestCase(TenantTestCase):
     def test_reverse_key(self):
         key = 'foo'
         self.assertEqual(key, reverse_key(make_key(key=key, key_prefix='', version=1)))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'tenant_schemas.cache.TenantCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {'GENERATION_TIMEOUT': 60},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tenant-cache-tests',
+    },
+})
+class TenantCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = caches['default']
+        self.addCleanup(self.cache.clear)
+
+    def test_tenant_namespaces(self):
+        with schema_context('tenant1'):
+            self.cache.set('foo', 1)
+            self.cache.set_many({'bar': 2, 'baz': 3})
+        with schema_context('tenant2'):
+            self.assertIsNone(self.cache.get('foo'))
+            self.cache.set('foo', 4)
+        with schema_context('tenant1'):
+            self.assertEqual(self.cache.get('foo'), 1)
+            self.assertEqual(self.cache.get_many(['bar', 'baz', 'qux']), {'bar': 2, 'baz': 3})
+            self.assertEqual(self.cache.incr('bar'), 3)
+
+    def test_clear_tenant(self):
+        for schema_name in ('tenant1', 'tenant2'):
+            with schema_context(schema_name):
+                self.cache.set('foo', schema_name)
+        self.cache.clear_tenant('tenant1')
+        with schema_context('tenant1'):
+            self.assertIsNone(self.cache.get('foo'))
+            self.cache.set('foo', 'new')
+            self.assertEqual(self.cache.get('foo'), 'new')
+        with schema_context('tenant2'):
+            self.assertEqual(self.cache.get('foo'), 'tenant2')
+
+    def test_generation_cached_locally(self):
+        with schema_context('tenant1'):
+            self.cache.get('foo')
+            # Cleared by another process.
+            caches['shared'].incr(self.cache.generation_key % 'tenant1')
+            self.cache.set('foo', 1)
+            self.assertEqual(self.cache.get('foo'), 1)
+            self.cache._generations.clear()
+            self.assertIsNone(self.cache.get('foo'))
+
+    @patch.object(TenantCache, '_new_generation', side_effect=[1000, 2000])
+    def test_evicted_generation_not_reused(self, new_generation):
+        with schema_context('tenant1'):
+            self.cache.set('foo', 1)
+            caches['shared'].delete(self.cache.generation_key % 'tenant1')
+            self.cache._generations.clear()
+            self.assertIsNone(self.cache.get('foo'))
+
+    def test_key_options(self):
+        with schema_context('tenant1'):
+            self.cache.set('foo', 1)
+            self.cache.set('foo', 2, version=2)
+            self.assertEqual(self.cache.get('foo'), 1)
+            self.assertEqual(self.cache.get('foo', version=2), 2)
+            prefixed = TenantCache('shared', {'KEY_PREFIX': 'site'})
+            self.assertIsNone(prefixed.get('foo'))
+            prefixed.set('foo', 3)
+            self.assertEqual(self.cache.get('foo'), 1)
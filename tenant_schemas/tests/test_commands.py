@@ -0,0 +1,246 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, models
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import isolate_apps
+from mock import patch
+
+from tenant_schemas.fields import RLSForeignKey
+from tenant_schemas.management.commands import BaseTenantCommand, InteractiveTenantOption
+from tenant_schemas.management.commands.partition_tables import Command
+from tenant_schemas.tests.models import Tenant
+from tenant_schemas.utils import get_public_schema_name
+
+
+class CheckCommand(BaseTenantCommand):
+    COMMAND_NAME = 'check'
+
+
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class BaseTenantCommandTestCase(TransactionTestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        Tenant(domain_url='test.com', schema_name=get_public_schema_name()).save()
+        self.tenant1 = Tenant(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.tenant1.save()
+        Tenant(domain_url='tenant2.test.com', schema_name='tenant2').save()
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, checkpoint_dir)
+        self.checkpoint = os.path.join(checkpoint_dir, 'checkpoint.json')
+
+    def test_workers(self):
+        out = StringIO()
+        call_command(CheckCommand(), workers=2, skip_public=True, verbosity=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Ran check on 2 tenants', output)
+        self.assertIn('0 failed', output)
+        self.assertIn('tenant1: ', output)
+        self.assertIn('tenant2: ', output)
+
+    def test_worker_exits(self):
+        def execute_command(tenant, *args, **options):
+            if tenant.schema_name == 'tenant1':
+                raise SystemExit(1)
+            os._exit(1)
+
+        with patch.object(CheckCommand, 'execute_command', side_effect=execute_command):
+            with self.assertRaisesRegex(CommandError, 'failed on 2 tenants'):
+                call_command(CheckCommand(), workers=2, skip_public=True, verbosity=0, stderr=StringIO())
+
+    def run_command(self, **options):
+        with patch.object(CheckCommand, 'execute_command') as execute_command:
+            call_command(CheckCommand(), skip_public=True, verbosity=0, **options)
+        return [call[0][0].schema_name for call in execute_command.call_args_list]
+
+    @override_settings(TENANT_SET_MODE='transaction')
+    def test_tenants_in_chunks(self):
+        with patch.object(CheckCommand, 'tenants_chunk_size', 1):
+            self.assertEqual(self.run_command(), ['tenant1', 'tenant2'])
+
+    def test_checkpoint_is_removed_once_done(self):
+        self.assertEqual(self.run_command(checkpoint=self.checkpoint), ['tenant1', 'tenant2'])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            json.dump({'command': 'check', 'pk': self.tenant1.pk}, checkpoint_file)
+        self.assertEqual(self.run_command(checkpoint=self.checkpoint, resume=True), ['tenant2'])
+
+    def test_resume_without_checkpoint_file(self):
+        self.assertEqual(self.run_command(checkpoint=self.checkpoint, resume=True), ['tenant1', 'tenant2'])
+
+    def test_resume_requires_checkpoint(self):
+        self.assertRaises(CommandError, self.run_command, resume=True)
+
+    def test_failure_keeps_checkpoint(self):
+        def execute_command(tenant, *args, **options):
+            if tenant.schema_name == 'tenant2':
+                raise ValueError
+
+        with patch.object(CheckCommand, 'execute_command', side_effect=execute_command):
+            self.assertRaises(ValueError, call_command, CheckCommand(), skip_public=True, verbosity=0,
+                              checkpoint=self.checkpoint)
+        with open(self.checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['pk'], self.tenant1.pk)
+        os.remove(self.checkpoint)
+
+    def test_interactive_tenant_option(self):
+        with self.assertNumQueries(1):
+            tenant = InteractiveTenantOption().get_tenant_from_options_or_interactive(schema_name='tenant1')
+        self.assertEqual(tenant, self.tenant1)
+        self.assertRaises(CommandError, InteractiveTenantOption().get_tenant_from_options_or_interactive,
+                          schema_name='unknown')
+
+
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class ConvertTenantKeysTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.tenant1 = Tenant.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.tenant2 = Tenant.objects.create(domain_url='tenant2.test.com', schema_name='tenant2')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE key_test_table (id serial PRIMARY KEY, number varchar(10), '
+                'tenant_id varchar(63) NOT NULL CONSTRAINT key_test_table_tenant_fk '
+                'REFERENCES tenant_schemas_tenant (schema_name) DEFERRABLE INITIALLY DEFERRED, '
+                'CONSTRAINT key_test_table_number_uniq UNIQUE (tenant_id, number))'
+            )
+            cursor.execute('CREATE INDEX key_test_table_tenant_idx ON key_test_table (tenant_id)')
+            cursor.execute('CREATE INDEX key_test_table_tenant_like ON key_test_table (tenant_id varchar_pattern_ops)')
+            cursor.executemany('INSERT INTO key_test_table (number, tenant_id) VALUES (%s, %s)', [
+                ('1', 'tenant1'), ('2', 'tenant1'), ('1', 'tenant2'), ('3', 'tenant1'), ('2', 'tenant2'),
+            ])
+            # Run the deferred foreign key checks, tables with pending ones can't be altered.
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('ALTER TABLE key_test_table ENABLE ROW LEVEL SECURITY')
+            cursor.execute(
+                "CREATE POLICY _po_tenant_key_test_table ON key_test_table FOR ALL "
+                "USING (tenant_id = get_current_tenant()) WITH CHECK (tenant_id = get_current_tenant())"
+            )
+
+    def test_convert(self):
+        out = StringIO()
+        call_command('convert_tenant_keys', 'key_test_table', batch_size=2, verbosity=2, stdout=out)
+        self.assertIn('5 rows backfilled', out.getvalue())
+        self.assertIn('key_test_table: converted.', out.getvalue())
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tenant_id FROM key_test_table ORDER BY id')
+            self.assertEqual([row[0] for row in cursor.fetchall()], [
+                self.tenant1.pk, self.tenant1.pk, self.tenant2.pk, self.tenant1.pk, self.tenant2.pk,
+            ])
+            constraints = connection.introspection.get_constraints(cursor, 'key_test_table')
+            cursor.execute("SELECT qual FROM pg_policies WHERE tablename = 'key_test_table'")
+            policy = cursor.fetchone()[0]
+        self.assertEqual(constraints['key_test_table_tenant_idx']['columns'], ['tenant_id'])
+        self.assertEqual(constraints['key_test_table_number_uniq']['columns'], ['tenant_id', 'number'])
+        self.assertTrue(constraints['key_test_table_number_uniq']['unique'])
+        self.assertEqual(constraints['key_test_table_tenant_fk']['foreign_key'], ('tenant_schemas_tenant', 'id'))
+        self.assertNotIn('key_test_table_tenant_like', constraints)
+        self.assertIn('get_current_tenant_id()', policy)
+
+        out = StringIO()
+        call_command('convert_tenant_keys', 'key_test_table', stdout=out)
+        self.assertIn('already converted', out.getvalue())
+
+    def test_backfill_only(self):
+        call_command('convert_tenant_keys', 'key_test_table', backfill_only=True, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO key_test_table (number, tenant_id) VALUES ('4', 'tenant2')")
+            cursor.execute('SELECT tenant_id, tenant_key FROM key_test_table ORDER BY id DESC LIMIT 1')
+            self.assertEqual(cursor.fetchone(), ('tenant2', self.tenant2.pk))
+
+    def test_unknown_tenant(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE key_test_table DROP CONSTRAINT key_test_table_tenant_fk')
+            cursor.execute("INSERT INTO key_test_table (number, tenant_id) VALUES ('1', 'unknown')")
+        with self.assertRaisesRegex(CommandError, 'unknown'):
+            call_command('convert_tenant_keys', 'key_test_table', stdout=StringIO())
+
+    def test_partitioned_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE key_test_partitioned (id integer, tenant_id varchar(63), '
+                           'PRIMARY KEY (id, tenant_id)) PARTITION BY LIST (tenant_id)')
+        with self.assertRaisesRegex(CommandError, 'partitioned'):
+            call_command('convert_tenant_keys', 'key_test_partitioned', stdout=StringIO())
+
+
+@isolate_apps('tenant_schemas')
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class PartitionTablesTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+
+        class Entry(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            name = models.CharField(max_length=10)
+
+        self.model = Entry
+        with connection.schema_editor() as editor:
+            editor.create_model(Entry)
+        for schema_name in ('tenant1', 'tenant2'):
+            Tenant.objects.create(domain_url='%s.test.com' % schema_name, schema_name=schema_name)
+            for name in ('a', 'b', 'c'):
+                Entry.objects.create(name=name, tenant_id=schema_name)
+        with connection.cursor() as cursor:
+            # Tables with pending foreign key checks can't be altered.
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def count_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM %s' % table)
+            return cursor.fetchone()[0]
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'hash', 'partitions': 4}})
+    def test_hash_partitions(self):
+        out = StringIO()
+        Command(stdout=out).partition_model(self.model, batch_size=2)
+        self.assertIn('6 rows moved into hash partitions', out.getvalue())
+        self.assertEqual(sum(self.count_rows('tenant_schemas_entry_p%d' % i) for i in range(4)), 6)
+
+        self.assertEqual(self.model.objects.filter(tenant_id='tenant1').count(), 3)
+        # The sequence of the primary key carries on.
+        entry = self.model.objects.create(name='d', tenant_id='tenant1')
+        self.assertEqual(self.model.objects.get(pk=entry.pk).name, 'd')
+
+        out = StringIO()
+        Command(stdout=out).partition_model(self.model)
+        self.assertIn('already partitioned', out.getvalue())
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'hash', 'partitions': 2}})
+    def test_rows_written_during_copy(self):
+        command = Command(stdout=StringIO())
+        copy_rows = command.copy_rows
+
+        def copy_then_write(*args):
+            copied = copy_rows(*args)
+            self.model.objects.filter(name='a').update(name='z')
+            self.model.objects.filter(name='b').delete()
+            self.model.objects.create(name='d', tenant_id='tenant1')
+            return copied
+
+        with patch.object(command, 'copy_rows', copy_then_write):
+            command.partition_model(self.model, batch_size=4)
+        self.assertEqual(sorted(self.model.objects.values_list('name', flat=True)), ['c', 'c', 'd', 'z', 'z'])
+        self.assertEqual(self.count_rows('tenant_schemas_entry_p0') + self.count_rows('tenant_schemas_entry_p1'), 5)
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'list'}})
+    def test_list_partitions(self):
+        out = StringIO()
+        Command(stdout=out).partition_model(self.model)
+        self.assertIn('2 tenant partitions created', out.getvalue())
+        self.assertEqual(self.count_rows('tenant_schemas_entry_default'), 0)
+        self.assertEqual(self.count_rows('tenant_schemas_entry_tenant1'), 3)
+        self.assertEqual(self.count_rows('tenant_schemas_entry_tenant2'), 3)
+
+    def test_model_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_tables', 'dts_test_app.DummyModel', stdout=StringIO())
@@ -0,0 +1,129 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.test import SimpleTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from tenant_schemas import cache
+from tenant_schemas.context import (get_current_schema_name, get_current_tenant,
+                                    get_fake_tenant, reset_current_tenant,
+                                    set_current_tenant)
+from tenant_schemas.middleware import TenantMiddleware
+from tenant_schemas.tenant_cache import tenant_lookup_cache
+from tenant_schemas.tests.models import Tenant
+from tenant_schemas.tests.testcases import BaseTestCase
+from tenant_schemas.utils import get_public_schema_name, schema_context
+
+
+class TenantContextTestCase(SimpleTestCase):
+
+    def test_connection_reads_context(self):
+        token = set_current_tenant(get_fake_tenant('tenant1'))
+        try:
+            self.assertEqual(connection.schema_name, 'tenant1')
+            self.assertEqual(cache.make_key('key', 'prefix', 1), 'tenant1:prefix:1:key')
+        finally:
+            reset_current_tenant(token)
+
+    def test_schema_context(self):
+        previous_tenant = get_current_tenant()
+        with schema_context('tenant1'):
+            self.assertEqual(get_current_schema_name(), 'tenant1')
+        self.assertEqual(get_current_tenant().schema_name, previous_tenant.schema_name)
+
+    def test_concurrent_tasks(self):
+        async def run_in_tenant(schema_name):
+            connection.set_schema(schema_name)
+            await asyncio.sleep(0.01)
+            return get_current_schema_name()
+
+        async def run_concurrently():
+            return await asyncio.gather(run_in_tenant('tenant1'), run_in_tenant('tenant2'))
+
+        self.assertEqual(async_to_sync(run_concurrently)(), ['tenant1', 'tenant2'])
+
+
+@override_settings(ALLOWED_HOSTS=['.test.com'])
+class AsyncTenantMiddlewareTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AsyncTenantMiddlewareTestCase, self).setUp()
+        self.factory = RequestFactory()
+        Tenant(domain_url='test.com', schema_name=get_public_schema_name()).save()
+        Tenant(domain_url='tenant1.test.com', schema_name='tenant1').save()
+        Tenant(domain_url='tenant2.test.com', schema_name='tenant2').save()
+
+    def test_concurrent_requests(self):
+        async def view(request):
+            await asyncio.sleep(0.01)
+            return HttpResponse(get_current_schema_name())
+
+        middleware = TenantMiddleware(view)
+
+        async def run_concurrently():
+            return await asyncio.gather(
+                middleware(self.factory.get('/', HTTP_HOST='tenant1.test.com')),
+                middleware(self.factory.get('/', HTTP_HOST='tenant2.test.com')),
+            )
+
+        responses = async_to_sync(run_concurrently)()
+        self.assertEqual([response.content for response in responses], [b'tenant1', b'tenant2'])
+
+    @override_settings(TENANT_CACHE_TIMEOUT=60)
+    def test_cached_tenant_without_thread_hop(self):
+        async def view(request):
+            return HttpResponse(get_current_schema_name())
+
+        tenant_lookup_cache.clear()
+        self.addCleanup(tenant_lookup_cache.clear)
+        middleware = TenantMiddleware(view)
+        async_to_sync(middleware)(self.factory.get('/', HTTP_HOST='tenant1.test.com'))
+
+        with patch('tenant_schemas.middleware.sync_to_async') as mock_sync_to_async:
+            with CaptureQueriesContext(connection) as queries:
+                response = async_to_sync(middleware)(self.factory.get('/', HTTP_HOST='tenant1.test.com'))
+        self.assertEqual(response.content, b'tenant1')
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(mock_sync_to_async.called)
+
+    def test_sync_get_tenant_override(self):
+        class HeaderMiddleware(TenantMiddleware):
+            def get_tenant(self, model, hostname, request):
+                return model.objects.get(schema_name=request.META['HTTP_X_SCHEMA'])
+
+        async def view(request):
+            return HttpResponse(get_current_schema_name())
+
+        middleware = HeaderMiddleware(view)
+        self.assertFalse(middleware._has_native_aget_tenant())
+        response = async_to_sync(middleware)(
+            self.factory.get('/', HTTP_HOST='tenant1.test.com', HTTP_X_SCHEMA='tenant2'))
+        self.assertEqual(response.content, b'tenant2')
+
+    def test_unknown_host(self):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = TenantMiddleware(view)
+        with self.assertRaises(Http404):
+            async_to_sync(middleware)(self.factory.get('/', HTTP_HOST='unknown.test.com'))
+
+    def test_invalid_tenant(self):
+        class InvalidMiddleware(TenantMiddleware):
+            def get_tenant(self, model, hostname, request):
+                return None
+
+        def view(request):
+            return HttpResponse()
+
+        async def aview(request):
+            return HttpResponse()
+
+        with self.assertRaisesMessage(Http404, 'Invalid tenant None'):
+            InvalidMiddleware(view)(self.factory.get('/', HTTP_HOST='tenant1.test.com'))
+        with self.assertRaisesMessage(Http404, 'Invalid tenant None'):
+            async_to_sync(InvalidMiddleware(aview))(self.factory.get('/', HTTP_HOST='tenant1.test.com'))
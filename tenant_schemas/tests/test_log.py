@@ -1,17 +1,18 @@
 import logging
-from mock import patch
+from mock import Mock, patch
 
 from django.test import TestCase
 
 from tenant_schemas import log
 
 
-@patch('tenant_schemas.log.connection.tenant', autospec=True,
-       schema_name='context')
+@patch('tenant_schemas.log.get_current_tenant')
 class LoggingFilterTests(TestCase):
 
-    def test_tenant_context_filter(self, mock_connection):
-        mock_connection.domain_url = 'context.example.com'
+    def test_tenant_context_filter(self, mock_get_current_tenant):
+        mock_get_current_tenant.return_value = Mock(
+            spec=['schema_name', 'domain_url'], schema_name='context',
+            domain_url='context.example.com')
         filter_ = log.TenantContextFilter()
         record = logging.makeLogRecord({})
         res = filter_.filter(record)
@@ -19,7 +20,8 @@ class LoggingFilterTests(TestCase):
         self.assertEqual(record.schema_name, 'context')
         self.assertEqual(record.domain_url, 'context.example.com')
 
-    def test_tenant_context_filter_blank_domain_url(self, mock_connection):
+    def test_tenant_context_filter_blank_domain_url(self, mock_get_current_tenant):
+        mock_get_current_tenant.return_value = Mock(spec=['schema_name'], schema_name='context')
         filter_ = log.TenantContextFilter()
         record = logging.makeLogRecord({})
         res = filter_.filter(record)
@@ -0,0 +1,111 @@
+import os
+from io import StringIO
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import migrations, models
+from django.db.models.signals import pre_migrate
+from django.db.migrations.graph import MigrationGraph
+from django.test import SimpleTestCase, TestCase
+from mock import patch
+
+from tenant_schemas.migration_executors import (AsyncExecutor, ParallelExecutor, StandardExecutor,
+                                                get_executor)
+
+
+def make_graph(dependencies):
+    graph = MigrationGraph()
+    plan = []
+    for key in dependencies:
+        migration = migrations.Migration(key[1], key[0])
+        graph.add_node(key, migration)
+        plan.append((migration, False))
+    for key, parents in dependencies.items():
+        for parent in parents:
+            graph.add_dependency(None, key, parent)
+    return graph, plan
+
+
+class MigrationExecutorsTestCase(SimpleTestCase):
+
+    def test_get_executor(self):
+        self.assertIs(get_executor(), StandardExecutor)
+        self.assertIs(get_executor('parallel'), ParallelExecutor)
+        self.assertIs(get_executor('async'), AsyncExecutor)
+        self.assertRaises(CommandError, get_executor, 'unknown')
+
+    def test_parallel_waves(self):
+        graph, plan = make_graph({
+            ('a', '0001'): [],
+            ('b', '0001'): [],
+            ('a', '0002'): [('a', '0001')],
+            ('c', '0001'): [('b', '0001')],
+            ('b', '0002'): [('b', '0001'), ('a', '0002')],
+        })
+        waves = ParallelExecutor.get_waves(plan, graph)
+        self.assertEqual(
+            [sorted((migration.app_label, migration.name) for migration in wave) for wave in waves],
+            [[('a', '0001'), ('b', '0001')], [('a', '0002'), ('c', '0001')], [('b', '0002')]]
+        )
+
+    def test_parallel_worker_dies(self):
+        graph, plan = make_graph({('a', '0001'): [], ('b', '0001'): []})
+        executor = ParallelExecutor((), {'verbosity': 0}, stdout=StringIO())
+        with patch('tenant_schemas.migration_executors.parallel.apply_migration', side_effect=lambda *args: os._exit(1)):
+            with self.assertRaisesRegex(CommandError, 'worker process died'):
+                executor.run_plan(plan, graph)
+
+    def test_async_concurrent_migration(self):
+        index = models.Index(fields=['name'], name='name_idx')
+        migration = migrations.Migration('0002', 'a')
+        migration.operations = [AddIndexConcurrently('model', index)]
+        self.assertFalse(AsyncExecutor.is_concurrent(migration))
+        migration.atomic = False
+        self.assertTrue(AsyncExecutor.is_concurrent(migration))
+        migration.operations.append(migrations.RunSQL('SELECT 1'))
+        self.assertFalse(AsyncExecutor.is_concurrent(migration))
+
+
+class MigrateSchemasTestCase(TestCase):
+
+    def test_executors(self):
+        for executor in ('standard', 'parallel', 'async'):
+            out = StringIO()
+            call_command('migrate_schemas', executor=executor, verbosity=1, stdout=out)
+            self.assertIn('No migrations to apply', out.getvalue())
+
+    def test_unknown_executor(self):
+        self.assertRaises(CommandError, call_command, 'migrate_schemas', executor='unknown')
+
+    def test_migrate_options(self):
+        for executor in ('standard', 'parallel', 'async'):
+            out = StringIO()
+            call_command('migrate_schemas', '--fake', '--plan', executor=executor, verbosity=1, stdout=out)
+            self.assertIn('Planned operations', out.getvalue())
+
+    def test_pre_migrate_sent_before_plan(self):
+        received = []
+
+        def receiver(**kwargs):
+            received.append('pre_migrate')
+
+        def run_plan(plan, graph):
+            received.append('run_plan')
+
+        pre_migrate.connect(receiver)
+        self.addCleanup(pre_migrate.disconnect, receiver)
+        executor = ParallelExecutor((), {'verbosity': 0}, stdout=StringIO())
+        with patch.object(executor, 'run_plan', side_effect=run_plan), \
+                patch.object(executor, 'migrate'), \
+                patch('tenant_schemas.migration_executors.base.MigrationExecutor.migration_plan',
+                      return_value=[(migrations.Migration('0001', 'a'), False)]):
+            executor.run_migrations()
+        self.assertEqual(received[-1], 'run_plan')
+        self.assertIn('pre_migrate', received)
+
+    def test_fake_app_migration(self):
+        out = StringIO()
+        call_command('migrate_schemas', '--app_label=dts_test_app', '--migration_name=0004', '--fake',
+                     verbosity=1, stdout=out)
+        self.assertIn('No migrations to apply', out.getvalue())
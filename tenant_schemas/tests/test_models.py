@@ -0,0 +1,49 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from tenant_schemas.models import TenantMixin
+from tenant_schemas.signals import post_schema_sync, post_schema_sync_bulk
+from tenant_schemas.tenant_cache import get_cached_tenant, tenant_lookup_cache
+from tenant_schemas.tests.models import Tenant
+
+
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class TenantCreationTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.received = []
+
+    def receiver(self, sender, **kwargs):
+        self.received.append(kwargs.get('tenant') or kwargs.get('tenants'))
+
+    def test_post_schema_sync_sent_on_creation_only(self):
+        post_schema_sync.connect(self.receiver, sender=TenantMixin)
+        self.addCleanup(post_schema_sync.disconnect, self.receiver, sender=TenantMixin)
+
+        tenant = Tenant(domain_url='tenant1.test.com', schema_name='tenant1')
+        tenant.save()
+        self.assertEqual(self.received, [tenant])
+        tenant.domain_url = 'tenant1.example.com'
+        tenant.save()
+        self.assertEqual(self.received, [tenant])
+
+    def test_bulk_create_tenants(self):
+        post_schema_sync_bulk.connect(self.receiver, sender=TenantMixin)
+        self.addCleanup(post_schema_sync_bulk.disconnect, self.receiver, sender=TenantMixin)
+
+        tenants = Tenant.objects.bulk_create_tenants(
+            (Tenant(domain_url='tenant%d.test.com' % i, schema_name='tenant%d' % i) for i in range(5)),
+            batch_size=2,
+        )
+        self.assertEqual([len(batch) for batch in self.received], [2, 2, 1])
+        self.assertTrue(all(tenant.pk is not None for tenant in tenants))
+        self.assertEqual(Tenant.objects.filter(schema_name__startswith='tenant').count(), 5)
+
+    @override_settings(TENANT_CACHE_TIMEOUT=60, TENANT_CACHE_MISS_TIMEOUT=60)
+    def test_bulk_create_tenants_drops_cached_misses(self):
+        self.addCleanup(tenant_lookup_cache.clear)
+        with self.assertRaises(Tenant.DoesNotExist):
+            get_cached_tenant(Tenant, domain_url='tenant1.test.com')
+        Tenant.objects.bulk_create_tenants([Tenant(domain_url='tenant1.test.com', schema_name='tenant1')])
+        self.assertEqual(get_cached_tenant(Tenant, domain_url='tenant1.test.com').schema_name, 'tenant1')
@@ -0,0 +1,166 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, models, transaction
+from django.db.transaction import TransactionManagementError
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import isolate_apps
+
+from tenant_schemas.fields import RLSForeignKey
+from tenant_schemas.purge import get_purge_order, get_purge_plan, purge_tenant
+from tenant_schemas.tests.models import Tenant
+from tenant_schemas.utils import get_public_schema_name
+
+
+def create_models(test_case, *models):
+    """
+    Create the tables of ``models``, dropped when ``test_case`` ends since
+    the purge can't run in the transaction of a TestCase.
+    """
+    with connection.schema_editor() as editor:
+        for model in models:
+            editor.create_model(model)
+    test_case.addCleanup(delete_models, *models)
+
+
+def delete_models(*models):
+    with connection.schema_editor() as editor:
+        for model in reversed(models):
+            editor.delete_model(model)
+
+
+@isolate_apps('tenant_schemas')
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class PurgeTenantTestCase(TransactionTestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+
+        class Parent(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+
+        class Child(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            parent = models.ForeignKey(Parent, on_delete=models.PROTECT)
+
+        class Node(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            parent = models.ForeignKey('self', null=True, on_delete=models.PROTECT)
+
+        self.models = [Parent, Child, Node]
+        create_models(self, *self.models)
+
+        self.tenant1 = Tenant.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.tenant2 = Tenant.objects.create(domain_url='tenant2.test.com', schema_name='tenant2')
+        for schema_name in ('tenant1', 'tenant2'):
+            for _ in range(3):
+                parent = Parent.objects.create(tenant_id=schema_name)
+                Child.objects.create(tenant_id=schema_name, parent=parent)
+            node = None
+            for _ in range(5):
+                node = Node.objects.create(tenant_id=schema_name, parent=node)
+
+    def test_purge_order(self):
+        Parent, Child, Node = self.models
+        order = get_purge_order(self.models)
+        self.assertEqual(len(order), 3)
+        self.assertLess(order.index(Child), order.index(Parent))
+
+    def test_purge_tenant(self):
+        Parent, Child, Node = self.models
+        progress = []
+        deleted = purge_tenant(self.tenant1, batch_size=2, progress=lambda model, count: progress.append(
+            (model, count)), models=self.models)
+
+        self.assertEqual(deleted, {Parent._meta.label: 3, Child._meta.label: 3, Node._meta.label: 5})
+        self.assertEqual([count for model, count in progress if model is Node], [2, 4, 5])
+        self.assertFalse(Tenant.objects.filter(schema_name='tenant1').exists())
+        for model in self.models:
+            self.assertFalse(model.objects.filter(tenant_id='tenant1').exists())
+        self.assertEqual(Node.objects.filter(tenant_id='tenant2', parent__isnull=False).count(), 4)
+        self.assertEqual(Child.objects.filter(tenant_id='tenant2').count(), 3)
+
+    def test_queryset_purge(self):
+        result = Tenant.objects.filter(schema_name='tenant2').purge(models=self.models)
+        self.assertEqual(list(result), ['tenant2'])
+        self.assertEqual(sum(result['tenant2'].values()), 11)
+        self.assertTrue(Tenant.objects.filter(schema_name='tenant1').exists())
+
+    def test_purge_in_atomic_block(self):
+        with transaction.atomic():
+            with self.assertRaises(TransactionManagementError):
+                purge_tenant(self.tenant1, models=self.models)
+            with self.assertRaises(TransactionManagementError):
+                Tenant.objects.filter(schema_name='tenant1').purge(models=self.models)
+        self.assertTrue(Tenant.objects.filter(schema_name='tenant1').exists())
+
+    def test_command_refuses_public_tenant(self):
+        Tenant.objects.create(domain_url='test.com', schema_name=get_public_schema_name())
+        with self.assertRaises(CommandError):
+            call_command('purge_tenant', schema_name=get_public_schema_name(), interactive=False, stdout=StringIO())
+
+
+@isolate_apps('tenant_schemas')
+@override_settings(TENANT_MODEL='tenant_schemas.Tenant')
+class PurgeReferencesTestCase(TransactionTestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.tenant = Tenant.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+
+    def create_models(self, *models):
+        create_models(self, *models)
+
+    def purge(self, models):
+        return purge_tenant(self.tenant, batch_size=2, models=models)
+
+    def test_tables_referencing_each_other(self):
+        class Invoice(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            last_line = models.ForeignKey('Line', null=True, on_delete=models.PROTECT, related_name='+')
+
+        class Line(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT)
+
+        self.create_models(Invoice, Line)
+        for _ in range(3):
+            invoice = Invoice.objects.create(tenant_id='tenant1')
+            lines = [Line.objects.create(tenant_id='tenant1', invoice=invoice) for _ in range(3)]
+            invoice.last_line = lines[-1]
+            invoice.save()
+
+        plan = get_purge_plan([Invoice, Line])
+        self.assertEqual([model for model, fields in plan], [Line, Invoice])
+        self.assertEqual(plan[1][1], [Invoice._meta.get_field('last_line')])
+        self.assertEqual(self.purge([Invoice, Line]), {Invoice._meta.label: 3, Line._meta.label: 9})
+
+    def test_non_null_cycle(self):
+        class First(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            second = models.ForeignKey('Second', on_delete=models.PROTECT)
+
+        class Second(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            first = models.ForeignKey(First, on_delete=models.PROTECT)
+
+        with self.assertRaisesRegex(ValueError, 'non-null'):
+            get_purge_plan([First, Second])
+
+    def test_non_null_self_reference(self):
+        class Category(models.Model):
+            tenant = RLSForeignKey(Tenant, to_field='schema_name', on_delete=models.PROTECT)
+            parent = models.ForeignKey('self', on_delete=models.PROTECT)
+
+        self.create_models(Category)
+        with connection.cursor() as cursor:
+            # A tree of 7 categories, the root is its own parent.
+            cursor.execute("INSERT INTO %s (id, tenant_id, parent_id) VALUES "
+                           "(1, 'tenant1', 1), (2, 'tenant1', 1), (3, 'tenant1', 1), (4, 'tenant1', 2), "
+                           "(5, 'tenant1', 2), (6, 'tenant1', 3), (7, 'tenant1', 6)" % Category._meta.db_table)
+        progress = []
+        purge_tenant(self.tenant, batch_size=2, models=[Category],
+                     progress=lambda model, count: progress.append(count))
+        self.assertEqual(progress[-1], 7)
+        self.assertLessEqual(max(b - a for a, b in zip([0] + progress, progress)), 2)
@@ -0,0 +1,285 @@
+from io import StringIO
+from types import SimpleNamespace
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_apps
+
+from tenant_schemas.apps import check_tenant_indexes
+from tenant_schemas.fields import RLSForeignKey
+from tenant_schemas.models import TenantMixin
+
+
+class RLSSchemaEditorTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.model = SimpleNamespace(_meta=SimpleNamespace(db_table='rls_test_table'))
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE rls_test_table (id serial PRIMARY KEY, tenant_id varchar(63))')
+            cursor.execute(
+                "CREATE OR REPLACE FUNCTION get_current_tenant() RETURNS VARCHAR AS $$ "
+                "SELECT current_setting('txerpa.tenant') $$ LANGUAGE SQL STABLE COST 100000"
+            )
+
+    def get_rls_state(self):
+        with connection.schema_editor() as editor:
+            return editor._get_rls_state('rls_test_table')
+
+    def test_set_tenant_rls_in_one_statement(self):
+        with connection.schema_editor() as editor:
+            editor._get_rls_state('rls_test_table')
+            with CaptureQueriesContext(connection) as queries:
+                editor._set_tenant_rls(True, self.model)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.get_rls_state(), (True, True, True, 'get_current_tenant()'))
+
+    def test_set_tenant_rls_again_is_a_no_op(self):
+        with connection.schema_editor() as editor:
+            editor._set_tenant_rls(True, self.model)
+        with connection.schema_editor() as editor:
+            editor._get_rls_state('rls_test_table')
+            with CaptureQueriesContext(connection) as queries:
+                editor._set_tenant_rls(True, self.model)
+                editor._set_tenant_rls(True, self.model)
+        self.assertEqual(len(queries), 0)
+
+    def test_unset_tenant_rls(self):
+        with connection.schema_editor() as editor:
+            editor._set_tenant_rls(True, self.model)
+            editor._unset_tenant_rls(True, self.model)
+            # The cached state follows the changes.
+            self.assertFalse(editor._get_rls_state('rls_test_table').enabled)
+        state = self.get_rls_state()
+        self.assertFalse(state.enabled)
+        self.assertFalse(state.has_policy)
+
+    def test_collect_sql(self):
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor._set_tenant_rls(True, self.model)
+        self.assertEqual(len(editor.collected_sql), 1)
+        self.assertIn('CREATE POLICY _po_tenant_rls_test_table', editor.collected_sql[0])
+
+    def get_policy(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT qual FROM pg_policies WHERE tablename = 'rls_test_table'")
+            return cursor.fetchone()[0]
+
+    @override_settings(TENANT_RLS_POLICY='initplan')
+    def test_policy_mode(self):
+        with connection.schema_editor() as editor:
+            editor._set_tenant_rls(True, self.model)
+        self.assertIn("SELECT current_setting('txerpa.tenant'", self.get_policy())
+
+    def test_unknown_policy_mode(self):
+        with connection.schema_editor() as editor:
+            self.assertRaises(ImproperlyConfigured, editor.get_rls_policy, 'unknown')
+
+    def test_rewrite_rls_policies(self):
+        with connection.schema_editor() as editor:
+            editor._set_tenant_rls(True, self.model)
+        self.assertIn('get_current_tenant()', self.get_policy())
+
+        out = StringIO()
+        call_command('rewrite_rls_policies', mode='setting', stdout=out)
+        self.assertIn("current_setting('txerpa.tenant'", self.get_policy())
+        self.assertNotIn('SELECT', self.get_policy())
+
+    def test_rewrite_rls_policies_dry_run(self):
+        with connection.schema_editor() as editor:
+            editor._set_tenant_rls(True, self.model)
+        out = StringIO()
+        call_command('rewrite_rls_policies', mode='setting', dry_run=True, stdout=out)
+        self.assertIn('ALTER POLICY _po_tenant_rls_test_table ON rls_test_table', out.getvalue())
+        self.assertIn('get_current_tenant()', self.get_policy())
+
+
+@isolate_apps('tenant_schemas', attr_name='apps')
+class CompositeIndexTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+
+        class IndexTenant(TenantMixin):
+            pass
+
+        class Invoice(models.Model):
+            tenant = RLSForeignKey(IndexTenant, to_field='schema_name', on_delete=models.PROTECT)
+            number = models.CharField(max_length=10, db_index=True)
+            series = models.CharField(max_length=10)
+            issued = models.DateField()
+
+            class Meta:
+                unique_together = [('series', 'number')]
+                indexes = [models.Index(fields=['-issued'], name='invoice_issued_idx')]
+
+        self.tenant_model = IndexTenant
+        self.model = Invoice
+
+    def create_sql(self):
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(self.model)
+        return '\n'.join(editor.collected_sql)
+
+    def test_indexes_left_as_they_are(self):
+        sql = self.create_sql()
+        self.assertIn('("number")', sql)
+        self.assertIn('("series", "number")', sql)
+        self.assertIn('("issued" DESC)', sql)
+
+    @override_settings(TENANT_COMPOSITE_INDEXES=True)
+    def test_composite_indexes(self):
+        sql = self.create_sql()
+        self.assertIn('("tenant_id", "number")', sql)
+        self.assertRegex(sql, r'\("tenant_id" ?, "number" varchar_pattern_ops\)')
+        self.assertIn('("tenant_id", "series", "number")', sql)
+        self.assertIn('("tenant_id", "issued" DESC)', sql)
+        # The index of the foreign key itself.
+        self.assertIn('("tenant_id")', sql)
+
+    @override_settings(TENANT_COMPOSITE_INDEXES=True)
+    def test_drop_composite_unique_together(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(self.tenant_model)
+            editor.create_model(self.model)
+        with connection.schema_editor() as editor:
+            editor.alter_unique_together(self.model, self.model._meta.unique_together, [])
+            self.assertEqual(editor._constraint_names(self.model, ['tenant_id', 'series', 'number'], unique=True), [])
+            editor.delete_model(self.model)
+            editor.delete_model(self.tenant_model)
+
+    def test_check_tenant_indexes(self):
+        warnings = check_tenant_indexes([self.apps.get_app_config('tenant_schemas')])
+        self.assertEqual([warning.id for warning in warnings], ['tenant_schemas.W005'] * 3)
+        self.assertIn('field number', warnings[0].msg)
+        self.assertIn("unique_together ('series', 'number')", warnings[1].msg)
+        self.assertIn('invoice_issued_idx', warnings[2].msg)
+        with self.settings(TENANT_COMPOSITE_INDEXES=True):
+            self.assertEqual(check_tenant_indexes([self.apps.get_app_config('tenant_schemas')]), [])
+
+    def test_check_tenant_expression_indexes(self):
+        class Document(models.Model):
+            tenant = RLSForeignKey(self.tenant_model, to_field='schema_name', on_delete=models.PROTECT)
+            title = models.CharField(max_length=10)
+
+            class Meta:
+                indexes = [
+                    models.Index(F('tenant').desc(), 'title', name='document_tenant_idx'),
+                    models.Index(Lower('tenant'), name='document_lower_tenant_idx'),
+                    models.Index(Lower('title'), name='document_lower_title_idx'),
+                ]
+
+        warnings = [warning for warning in check_tenant_indexes([self.apps.get_app_config('tenant_schemas')])
+                    if warning.obj is Document]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('document_lower_title_idx', warnings[0].msg)
+        self.assertIn("F('tenant')", warnings[0].hint)
+
+
+@isolate_apps('tenant_schemas')
+class PartitionedTableTestCase(TestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+
+        class PartitionTenant(TenantMixin):
+            pass
+
+        class Entry(models.Model):
+            tenant = RLSForeignKey(PartitionTenant, to_field='schema_name', on_delete=models.PROTECT)
+            number = models.CharField(max_length=10)
+
+            class Meta:
+                unique_together = [('number',)]
+
+        self.tenant_model = PartitionTenant
+        self.model = Entry
+
+    def get_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname, relkind, relrowsecurity, relforcerowsecurity FROM pg_class "
+                "WHERE relname LIKE 'tenant_schemas_entry%%' AND relkind IN ('r', 'p') ORDER BY relname"
+            )
+            return cursor.fetchall()
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'hash', 'partitions': 2}})
+    def test_hash_partitioned_table(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(self.tenant_model)
+            editor.create_model(self.model)
+        self.assertEqual(self.get_tables(), [
+            ('tenant_schemas_entry', 'p', True, True),
+            ('tenant_schemas_entry_p0', 'r', True, True),
+            ('tenant_schemas_entry_p1', 'r', True, True),
+        ])
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, 'tenant_schemas_entry')
+        primary_key = [value for value in constraints.values() if value['primary_key']][0]
+        self.assertEqual(primary_key['columns'], ['id', 'tenant_id'])
+        self.assertIn(['tenant_id', 'number'], [value['columns'] for value in constraints.values() if value['unique']])
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'list'}})
+    def test_list_partitioned_table(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(self.tenant_model)
+            # Created before the table, it has no partition yet.
+            tenant = self.tenant_model.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+            editor.create_model(self.model)
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO tenant_schemas_entry (tenant_id, number) VALUES ('tenant1', '1')")
+            editor.create_tenant_partition(self.model, tenant)
+        self.assertEqual([table[:2] for table in self.get_tables()], [
+            ('tenant_schemas_entry', 'p'),
+            ('tenant_schemas_entry_default', 'r'),
+            ('tenant_schemas_entry_tenant1', 'r'),
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM tenant_schemas_entry_tenant1')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'list'}})
+    def test_new_tenant_partitions(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(self.tenant_model)
+            editor.create_model(self.model)
+        self.tenant_model.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        self.tenant_model.objects.bulk_create_tenants([
+            self.tenant_model(domain_url='tenant2.test.com', schema_name='tenant2'),
+        ])
+        self.assertEqual([table[0] for table in self.get_tables()], [
+            'tenant_schemas_entry',
+            'tenant_schemas_entry_default',
+            'tenant_schemas_entry_tenant1',
+            'tenant_schemas_entry_tenant2',
+        ])
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'list'}})
+    def test_new_tenant_rows_moved_without_bypassing_rls(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(self.tenant_model)
+            editor.create_model(self.model)
+        with connection.cursor() as cursor:
+            # A role owning the tables, subject to their forced policies.
+            cursor.execute('CREATE ROLE tenant_schemas_partition_owner')
+            cursor.execute('GRANT CREATE ON SCHEMA public TO tenant_schemas_partition_owner')
+            for table in ('tenant_schemas_entry', 'tenant_schemas_entry_default', 'tenant_schemas_partitiontenant'):
+                cursor.execute('ALTER TABLE %s OWNER TO tenant_schemas_partition_owner' % table)
+            # Seeded before the tenant gets its partition, e.g. by a
+            # post_schema_sync_bulk handler.
+            cursor.execute("INSERT INTO tenant_schemas_entry (tenant_id, number) VALUES ('tenant1', '1')")
+            cursor.execute('SET ROLE tenant_schemas_partition_owner')
+        self.tenant_model.objects.create(domain_url='tenant1.test.com', schema_name='tenant1')
+        with connection.cursor() as cursor:
+            cursor.execute('RESET ROLE')
+            cursor.execute('SELECT count(*) FROM tenant_schemas_entry_tenant1')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    @override_settings(TENANT_PARTITIONS={'tenant_schemas.Entry': {'method': 'range'}})
+    def test_unknown_method(self):
+        with connection.schema_editor(collect_sql=True) as editor:
+            self.assertRaises(ImproperlyConfigured, editor.create_model, self.model)
@@ -0,0 +1,247 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import timeit
+
+from django.db import connection
+from django.template import Context, TemplateDoesNotExist
+from django.template.engine import Engine
+from django.test import SimpleTestCase, override_settings
+from mock import patch
+
+from tenant_schemas.context import get_fake_tenant
+from tenant_schemas.tests.models import Tenant
+from tenant_schemas.utils import get_public_schema_name, schema_context
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = {
+    'base.html': '<html>{% block content %}{% endblock %}</html>',
+    'page.html': '{% extends "base.html" %}{% block content %}page{% endblock %}',
+    'other.html': 'other',
+}
+
+
+class CachedLoaderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        connection.set_schema_to_public()
+        self.addCleanup(connection.set_schema_to_public)
+
+    def get_engine(self):
+        engine = Engine(loaders=[
+            ('tenant_schemas.template_loaders.CachedLoader', [
+                ('django.template.loaders.locmem.Loader', TEMPLATES),
+            ]),
+        ])
+        return engine, engine.template_loaders[0]
+
+    def test_templates_cached_per_tenant(self):
+        engine, loader = self.get_engine()
+        for schema_name in ('tenant1', 'tenant2'):
+            with schema_context(schema_name):
+                self.assertEqual(engine.get_template('page.html').render(Context()), '<html>page</html>')
+                self.assertIs(engine.get_template('page.html'), engine.get_template('page.html'))
+        stats = loader.stats()
+        self.assertEqual(stats['tenants'], 2)
+        self.assertEqual(stats['entries'], 4)
+        self.assertEqual(stats['templates'], 2)
+        self.assertEqual(stats['bytes'], len(TEMPLATES['base.html']) + len(TEMPLATES['page.html']))
+
+    def test_compiled_templates_shared(self):
+        engine, loader = self.get_engine()
+        with schema_context('tenant1'):
+            template = engine.get_template('page.html')
+        with schema_context('tenant2'), patch.object(loader, 'get_contents') as get_contents:
+            self.assertIs(engine.get_template('page.html'), template)
+        get_contents.assert_not_called()
+        # Compiled templates no tenant holds are dropped.
+        loader.reset()
+        del template
+        self.assertEqual(len(loader.compiled_templates), 0)
+
+    def test_reset_tenant(self):
+        engine, loader = self.get_engine()
+        for schema_name in ('tenant1', 'tenant2'):
+            with schema_context(schema_name):
+                engine.get_template('other.html')
+        loader.reset(tenant=get_fake_tenant('tenant1'))
+        self.assertEqual(loader.stats()['tenants'], 1)
+        loader.reset()
+        self.assertEqual(loader.stats()['entries'], 0)
+
+    @override_settings(TENANT_TEMPLATE_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_evicted(self):
+        engine, loader = self.get_engine()
+        engine.get_template('other.html')
+        engine.get_template('page.html')
+        engine.get_template('other.html')
+        engine.get_template('base.html')
+        self.assertEqual(loader.stats()['evictions'], 1)
+        engine.get_template('other.html')
+        self.assertEqual(loader.stats()['hits'], 2)
+
+    @override_settings(TENANT_TEMPLATE_CACHE_MAX_BYTES=len(TEMPLATES['base.html']))
+    def test_size_bound(self):
+        engine, loader = self.get_engine()
+        engine.get_template('page.html').render(Context())
+        self.assertEqual(loader.stats()['entries'], 1)
+        self.assertEqual(loader.stats()['evictions'], 1)
+
+    @override_settings(TENANT_TEMPLATE_CACHE_MISS_TIMEOUT=0)
+    def test_misses_expire(self):
+        engine, loader = self.get_engine()
+        for _ in range(2):
+            with self.assertRaises(TemplateDoesNotExist):
+                engine.get_template('missing.html')
+        self.assertEqual(loader.stats()['hits'], 0)
+        self.assertEqual(loader.stats()['misses'], 2)
+
+    def test_misses_cached(self):
+        engine, loader = self.get_engine()
+        with schema_context(get_public_schema_name()):
+            for _ in range(2):
+                with self.assertRaises(TemplateDoesNotExist):
+                    engine.get_template('missing.html')
+        self.assertEqual(loader.stats()['hits'], 1)
+
+    def test_cache_key(self):
+        engine, loader = self.get_engine()
+        with schema_context('tenant1'):
+            self.assertEqual(loader.cache_key('page.html'), ('tenant1', 'page.html'))
+            page = engine.get_template('page.html')
+            key = loader.cache_key('page.html', skip=[page.origin])
+            self.assertEqual(key[:2], ('tenant1', 'page.html'))
+            self.assertIs(loader.cache_key('page.html', skip=[page.origin])[2], key[2])
+            # Origins of other templates don't change the key.
+            self.assertEqual(loader.cache_key('base.html', skip=[page.origin]), ('tenant1', 'base.html'))
+
+    def test_lookup_cost(self):
+        """
+        Microbenchmark of the lookups of a render: a cached template should be
+        found faster than the wrapped loader compiles it again, and its key
+        built faster than the joined string with a SHA1 digest of the skipped
+        origins used before. Both are measured in the same run so the speed of
+        the machine doesn't matter, the costs are logged at the INFO level.
+        """
+        engine, loader = self.get_engine()
+        uncached = Engine(loaders=[('django.template.loaders.locmem.Loader', TEMPLATES)]).template_loaders[0]
+        names = list(TEMPLATES) * 50
+        with schema_context('tenant1'):
+            for name in TEMPLATES:
+                engine.get_template(name)
+            skip = [engine.get_template('page.html').origin]
+
+            def joined_cache_key(template_name, skip=None):
+                skip_prefix = ''
+                if skip:
+                    matching = [origin.name for origin in skip if origin.template_name == template_name]
+                    if matching:
+                        skip_prefix = hashlib.sha1('|'.join(matching).encode()).hexdigest()
+                return connection.schema_name, '-'.join(s for s in (str(template_name), skip_prefix) if s)
+
+            def per_lookup(lookup):
+                seconds = min(timeit.repeat(lambda: [lookup(name) for name in names], number=10, repeat=3))
+                return seconds / len(names) / 10 * 1e6
+
+            cached = per_lookup(loader.get_template)
+            uncached = per_lookup(uncached.get_template)
+            key = per_lookup(lambda name: loader.cache_key(name, skip))
+            joined_key = per_lookup(lambda name: joined_cache_key(name, skip))
+
+        costs = '%.2fµs per lookup, %.2fµs uncached, %.2fµs per key, %.2fµs per joined key' % (
+            cached, uncached, key, joined_key)
+        logger.info('Template lookup cost: %s', costs)
+        self.assertLess(cached, uncached, costs)
+        self.assertLess(key, joined_key, costs)
+
+
+class FilesystemLoaderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.templates_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templates_dir)
+        self.tenant_dir = os.path.join(self.templates_dir, 'tenant1.test.com')
+        self.write('tenant1.test.com/page.html', 'tenant page')
+        self.tenant = Tenant(domain_url='tenant1.test.com', schema_name='tenant1')
+        connection.set_tenant(self.tenant)
+        self.addCleanup(connection.set_schema_to_public)
+
+    def write(self, name, content):
+        path = os.path.join(self.templates_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    def get_engine(self):
+        engine = Engine(loaders=[
+            ('tenant_schemas.template_loaders.FilesystemLoader', [self.templates_dir]),
+            ('django.template.loaders.locmem.Loader', TEMPLATES),
+        ])
+        return engine, engine.template_loaders[0]
+
+    def test_tenant_templates(self):
+        engine, loader = self.get_engine()
+        self.assertEqual(engine.get_template('page.html').render(Context()), 'tenant page')
+        self.assertEqual(engine.get_template('other.html').render(Context()), 'other')
+        connection.set_tenant(Tenant(domain_url='tenant2.test.com', schema_name='tenant2'))
+        self.assertEqual(engine.get_template('page.html').render(Context()), '<html>page</html>')
+
+    def test_fake_tenant(self):
+        engine, loader = self.get_engine()
+        connection.set_schema('tenant1')
+        self.assertEqual(engine.get_template('page.html').render(Context()), '<html>page</html>')
+
+    @override_settings(TENANT_TEMPLATE_INDEX_CHECK_INTERVAL=None)
+    def test_missing_templates_without_system_calls(self):
+        engine, loader = self.get_engine()
+        engine.get_template('page.html')
+        with patch('os.stat') as stat, patch('builtins.open') as open_:
+            self.assertEqual(list(loader.get_template_sources('other.html')), [])
+        stat.assert_not_called()
+        open_.assert_not_called()
+
+    @override_settings(TENANT_TEMPLATE_INDEX_CHECK_INTERVAL=0)
+    def test_index_refreshed(self):
+        engine, loader = self.get_engine()
+        self.assertEqual(engine.get_template('other.html').render(Context()), 'other')
+        self.write('tenant1.test.com/sub/other.html', 'sub')
+        self.write('tenant1.test.com/other.html', 'tenant other')
+        # The modification times may not have changed yet on coarse clocks.
+        os.utime(self.tenant_dir, ns=(0, 0))
+        self.assertEqual(engine.get_template('sub/other.html').render(Context()), 'sub')
+        self.assertEqual(engine.get_template('other.html').render(Context()), 'tenant other')
+        self.assertEqual(len(loader.get_index(self.tenant_dir)), 3)
+
+    @override_settings(TENANT_TEMPLATE_INDEX_MAX_ENTRIES=2)
+    def test_least_recently_used_index_evicted(self):
+        engine, loader = self.get_engine()
+        engine.get_template('page.html')
+        connection.set_tenant(Tenant(domain_url='tenant2.test.com', schema_name='tenant2'))
+        engine.get_template('page.html')
+        connection.set_tenant(self.tenant)
+        engine.get_template('page.html')
+        connection.set_tenant(Tenant(domain_url='tenant3.test.com', schema_name='tenant3'))
+        engine.get_template('page.html')
+        self.assertEqual(list(loader.indexes), [
+            self.tenant_dir,
+            os.path.join(self.templates_dir, 'tenant3.test.com'),
+        ])
+
+    def test_cached_loader(self):
+        engine = Engine(loaders=[
+            ('tenant_schemas.template_loaders.CachedLoader', [
+                ('tenant_schemas.template_loaders.FilesystemLoader', [self.templates_dir]),
+                ('django.template.loaders.locmem.Loader', TEMPLATES),
+            ]),
+        ])
+        tenant1_page = engine.get_template('page.html')
+        self.assertEqual(tenant1_page.render(Context()), 'tenant page')
+        connection.set_tenant(Tenant(domain_url='tenant2.test.com', schema_name='tenant2'))
+        self.assertEqual(engine.get_template('page.html').render(Context()), '<html>page</html>')
+        connection.set_tenant(Tenant(domain_url='tenant3.test.com', schema_name='tenant3'))
+        self.assertEqual(engine.template_loaders[0].stats()['templates'], 3)
+        self.assertIsNot(engine.get_template('page.html'), tenant1_page)
+        self.assertEqual(engine.template_loaders[0].stats()['templates'], 3)
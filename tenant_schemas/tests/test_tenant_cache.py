@@ -0,0 +1,169 @@
+import threading
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection
+from django.http import Http404
+from django.test import SimpleTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from tenant_schemas.middleware import DefaultTenantMiddleware, TenantMiddleware
+from tenant_schemas.tenant_cache import TenantLookupCache, tenant_lookup_cache
+from tenant_schemas.tests.models import Tenant
+from tenant_schemas.tests.testcases import BaseTestCase
+from tenant_schemas.utils import get_public_schema_name
+
+
+class TenantLookupCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache = TenantLookupCache()
+        self.tenant = Tenant(pk=1, domain_url='tenant.test.com', schema_name='test')
+
+    def test_get_set(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, self.tenant, timeout=60, max_size=10)
+        self.assertIs(self.cache.get(key), self.tenant)
+
+    def test_expired_entry(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        self.cache.set(key, self.tenant, timeout=-1, max_size=10)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        first = ('tenant_schemas.tenant', ('domain_url', 'first.test.com'))
+        second = ('tenant_schemas.tenant', ('domain_url', 'second.test.com'))
+        third = ('tenant_schemas.tenant', ('domain_url', 'third.test.com'))
+        self.cache.set(first, self.tenant, timeout=60, max_size=2)
+        self.cache.set(second, self.tenant, timeout=60, max_size=2)
+        self.cache.get(first)
+        self.cache.set(third, self.tenant, timeout=60, max_size=2)
+        self.assertIsNotNone(self.cache.get(first))
+        self.assertIsNone(self.cache.get(second))
+        self.assertIsNotNone(self.cache.get(third))
+
+    def test_invalidate_by_pk_and_field_values(self):
+        by_old_domain = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        by_new_domain = ('tenant_schemas.tenant', ('domain_url', 'renamed.test.com'))
+        other = ('tenant_schemas.tenant', ('domain_url', 'other.test.com'))
+        self.cache.set(by_old_domain, self.tenant, timeout=60, max_size=10)
+        self.cache.set(other, Tenant(pk=2, domain_url='other.test.com'), timeout=60, max_size=10)
+
+        renamed = Tenant(pk=1, domain_url='renamed.test.com', schema_name='test')
+        self.cache.invalidate(renamed, publish=False)
+
+        self.assertIsNone(self.cache.get(by_old_domain))
+        self.assertIsNone(self.cache.get(by_new_domain))
+        self.assertIsNotNone(self.cache.get(other))
+
+    def test_missing_lookup(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        self.assertFalse(self.cache.is_missing(key))
+        self.cache.set_missing(key, timeout=60, max_size=10)
+        self.assertTrue(self.cache.is_missing(key))
+        self.assertIsNone(self.cache.get(key))
+
+    def test_invalidate_missing_lookup(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        self.cache.set_missing(key, timeout=60, max_size=10)
+        self.cache.invalidate(self.tenant, publish=False)
+        self.assertFalse(self.cache.is_missing(key))
+
+    def test_stale_lookup_is_not_stored(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        generation = self.cache.generation
+        self.cache.invalidate(self.tenant, publish=False)
+        self.cache.set(key, self.tenant, timeout=60, max_size=10, generation=generation)
+        self.assertIsNone(self.cache.get(key))
+
+    @override_settings(TENANT_CACHE_INVALIDATION_ALIAS='default')
+    def test_async_shared_generation_check(self):
+        key = ('tenant_schemas.tenant', ('domain_url', 'tenant.test.com'))
+        self.cache.set(key, self.tenant, timeout=60, max_size=10)
+        cache.set(TenantLookupCache.GENERATION_KEY, 1)
+        self.addCleanup(cache.delete, TenantLookupCache.GENERATION_KEY)
+        self.cache._shared_generation = 0
+
+        threads = []
+        get = cache.get
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return get(*args, **kwargs)
+
+        async def check():
+            with patch.object(cache, 'get', record_thread):
+                await self.cache.acheck_shared_generation()
+            return threading.current_thread()
+
+        loop_thread = async_to_sync(check)()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache._shared_generation, 1)
+
+
+@override_settings(ALLOWED_HOSTS=['.test.com'], TENANT_CACHE_TIMEOUT=60, TENANT_CACHE_MISS_TIMEOUT=5)
+class CachedTenantRoutingTestCase(BaseTestCase):
+    def setUp(self):
+        super(CachedTenantRoutingTestCase, self).setUp()
+        tenant_lookup_cache.clear()
+        self.factory = RequestFactory()
+        self.tm = TenantMiddleware(lambda request: None)
+        Tenant(domain_url='test.com', schema_name=get_public_schema_name()).save()
+        self.tenant = Tenant(domain_url='tenant.test.com', schema_name='test')
+        self.tenant.save()
+
+    def tearDown(self):
+        tenant_lookup_cache.clear()
+        super(CachedTenantRoutingTestCase, self).tearDown()
+
+    def test_cached_tenant_routing(self):
+        self.tm.process_request(self.factory.get('/', HTTP_HOST='tenant.test.com'))
+
+        request = self.factory.get('/', HTTP_HOST='tenant.test.com')
+        with CaptureQueriesContext(connection) as queries:
+            self.tm.process_request(request)
+        self.assertEqual(request.tenant, self.tenant)
+        self.assertEqual(len(queries), 0)
+
+    def test_save_invalidates_cached_tenant(self):
+        self.tm.process_request(self.factory.get('/', HTTP_HOST='tenant.test.com'))
+
+        connection.set_schema_to_public()
+        self.tenant.domain_url = 'renamed.test.com'
+        self.tenant.save()
+
+        request = self.factory.get('/', HTTP_HOST='renamed.test.com')
+        self.tm.process_request(request)
+        self.assertEqual(request.tenant.domain_url, 'renamed.test.com')
+
+    def test_cached_unknown_host(self):
+        request = self.factory.get('/', HTTP_HOST='unknown.test.com')
+        self.assertRaises(Http404, self.tm.process_request, request)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertRaises(Http404, self.tm.process_request, request)
+        self.assertEqual(len(queries), 0)
+
+    def test_cached_unknown_host_to_default_schema(self):
+        dtm = DefaultTenantMiddleware(lambda request: None)
+        dtm.process_request(self.factory.get('/', HTTP_HOST='unknown.test.com'))
+
+        request = self.factory.get('/', HTTP_HOST='unknown.test.com')
+        with CaptureQueriesContext(connection) as queries:
+            dtm.process_request(request)
+        self.assertEqual(request.tenant.schema_name, get_public_schema_name())
+        self.assertEqual(len(queries), 0)
+
+    def test_created_tenant_is_not_missing(self):
+        request = self.factory.get('/', HTTP_HOST='new.test.com')
+        self.assertRaises(Http404, self.tm.process_request, request)
+
+        connection.set_schema_to_public()
+        Tenant(domain_url='new.test.com', schema_name='new').save()
+
+        self.tm.process_request(request)
+        self.assertEqual(request.tenant.schema_name, 'new')
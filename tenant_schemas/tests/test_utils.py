@@ -4,9 +4,10 @@ import sys
 import types
 
 from django.apps import AppConfig
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 from tenant_schemas import utils
+from tenant_schemas.apps import best_practice
 
 
 class AppLabelsTestCase(TestCase):
@@ -51,3 +52,17 @@ class AppLabelsTestCase(TestCase):
             ]),
             ['example1', 'example2_app'],
         )
+
+
+class BestPracticeTestCase(SimpleTestCase):
+
+    def get_errors(self):
+        return [error.id for error in best_practice(None)]
+
+    @override_settings(TENANT_KEY='pk')
+    def test_integer_key_with_integer_policy(self):
+        self.assertNotIn('tenant_schemas.E005', self.get_errors())
+
+    @override_settings(TENANT_KEY='pk', TENANT_RLS_POLICY='setting')
+    def test_integer_key_with_text_policy(self):
+        self.assertIn('tenant_schemas.E005', self.get_errors())
@@ -38,8 +38,16 @@ def get_tenant_model():
     return get_model(*settings.TENANT_MODEL.split("."))
 
 
+def get_tenant_key():
+    return getattr(settings, 'TENANT_KEY', 'schema_name')
+
+
 def get_tenant_field():
-    return 'schema_name'
+    """
+    Return the field of the tenant model multitenant rows reference, None for
+    its primary key.
+    """
+    return None if get_tenant_key() == 'pk' else 'schema_name'
 
 
 def get_public_schema_name():
@@ -47,7 +55,79 @@ def get_public_schema_name():
 
 
 def get_limit_set_calls():
-    return getattr(settings, 'TENANT_LIMIT_SET_CALLS', False)
+    return getattr(settings, 'TENANT_LIMIT_SET_CALLS', True)
+
+
+def get_tenant_set_mode():
+    return getattr(settings, 'TENANT_SET_MODE', 'session')
+
+
+def get_tenant_prepare_set_statement():
+    return getattr(settings, 'TENANT_PREPARE_SET_STATEMENT', False)
+
+
+def get_clear_content_type_cache():
+    return getattr(settings, 'TENANT_CLEAR_CONTENT_TYPE_CACHE', False)
+
+
+def get_rls_policy_mode():
+    return getattr(settings, 'TENANT_RLS_POLICY', 'integer' if get_tenant_key() == 'pk' else 'function')
+
+
+def get_composite_indexes():
+    return getattr(settings, 'TENANT_COMPOSITE_INDEXES', False)
+
+
+def get_tenant_partitions():
+    return getattr(settings, 'TENANT_PARTITIONS', {})
+
+
+def get_tenant_cache_timeout():
+    return getattr(settings, 'TENANT_CACHE_TIMEOUT', 0)
+
+
+def get_tenant_cache_miss_timeout():
+    return getattr(settings, 'TENANT_CACHE_MISS_TIMEOUT', 0)
+
+
+def get_tenant_cache_max_size():
+    return getattr(settings, 'TENANT_CACHE_MAX_SIZE', 1024)
+
+
+def get_tenant_cache_invalidation_alias():
+    return getattr(settings, 'TENANT_CACHE_INVALIDATION_ALIAS', None)
+
+
+def get_template_cache_max_entries():
+    return getattr(settings, 'TENANT_TEMPLATE_CACHE_MAX_ENTRIES', 10000)
+
+
+def get_template_cache_max_bytes():
+    return getattr(settings, 'TENANT_TEMPLATE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+
+def get_template_cache_miss_timeout():
+    return getattr(settings, 'TENANT_TEMPLATE_CACHE_MISS_TIMEOUT', 60)
+
+
+def get_template_index_check_interval():
+    return getattr(settings, 'TENANT_TEMPLATE_INDEX_CHECK_INTERVAL', 2)
+
+
+def get_template_index_max_entries():
+    return getattr(settings, 'TENANT_TEMPLATE_INDEX_MAX_ENTRIES', 1000)
+
+
+def get_parallel_migration_max_processes():
+    return getattr(settings, 'TENANT_PARALLEL_MIGRATION_MAX_PROCESSES', 2)
+
+
+def get_parallel_migration_chunks():
+    return getattr(settings, 'TENANT_PARALLEL_MIGRATION_CHUNKS', 2)
+
+
+def get_async_migration_max_threads():
+    return getattr(settings, 'TENANT_ASYNC_MIGRATION_MAX_THREADS', 2)
 
 
 def clean_tenant_url(url_string):